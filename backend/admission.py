@@ -0,0 +1,219 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, status
+
+from db import DBConnection, connection_fingerprint, target_key
+from metrics import registry, timed_stage
+
+admission_rejections = registry.counter(
+    "askdb_admission_rejections_total", "Queries shed by admission control", ["reason"]
+)
+admission_wait = registry.histogram(
+    "askdb_admission_wait_seconds", "Time queries spent queued for an admission slot", ["outcome"]
+)
+
+class AdmissionController:
+    """
+    Caps how many queries run at once per target database (keyed by connection
+    fingerprint) and per user. Queries over the cap wait in per-user queues that
+    are served weighted round-robin: the user at the head of the rotation is
+    admitted up to its tier's weight times in a row, then goes to the back.
+    A full queue, or a wait longer than `queue_timeout`, is answered with 503 and
+    a Retry-After estimated from recent slot hold times.
+    Only used from the event loop, so there is no lock.
+    """
+
+    def __init__(
+        self,
+        max_per_target: int = 8,
+        max_per_user: int = 4,
+        max_queue: int = 32,
+        max_queue_per_user: int = 8,
+        queue_timeout: float = 10,
+        target_overrides: Optional[Dict[str, int]] = None,
+        tier_weights: Optional[Dict[str, int]] = None,
+    ):
+        self.max_per_target = max_per_target
+        self.max_per_user = max_per_user
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout
+        self.target_overrides = target_overrides or {}  # {"host:port/db": max concurrent}
+        self.tier_weights = tier_weights or {}  # {"tier": admissions per round-robin turn}
+        self._targets: Dict[str, Dict[str, Any]] = {}
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected = 0
+
+    def _state(self, creds: DBConnection) -> Dict[str, Any]:
+        key = connection_fingerprint(creds)
+        state = self._targets.get(key)
+        if state is None:
+            target = target_key(creds)
+            state = {
+                "key": key,
+                "target": target,
+                "limit": int(self.target_overrides.get(target, self.max_per_target)),
+                "running": 0,
+                "by_user": {},  # {user_id: running}
+                "queues": OrderedDict(),  # {user_id: deque of futures}, in rotation order
+                "credits": {},  # {user_id: admissions left in this turn}
+                "weights": {},
+                "queued": 0,
+                "hold_avg": 1.0,  # EWMA of seconds a slot is held
+            }
+            self._targets[key] = state
+        return state
+
+    def _can_start(self, state: Dict[str, Any], user_id: str) -> bool:
+        return state["running"] < state["limit"] and state["by_user"].get(user_id, 0) < self.max_per_user
+
+    def _start(self, state: Dict[str, Any], user_id: str):
+        state["running"] += 1
+        state["by_user"][user_id] = state["by_user"].get(user_id, 0) + 1
+        self.admitted += 1
+
+    def _reject(self, state: Dict[str, Any], reason: str, waited: float = 0.0):
+        self.rejected += 1
+        admission_rejections.inc(reason=reason)
+        admission_wait.observe(waited, outcome="rejected")
+        # A per-database override of 0 admits nothing; estimate as for one slot
+        retry_after = state["hold_avg"] * (state["queued"] / max(1, state["limit"]) + 1)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The database is busy. Please try again shortly.",
+            headers={"Retry-After": str(min(60, max(1, math.ceil(retry_after))))},
+        )
+
+    async def acquire(self, creds: DBConnection, user_id: str, tier: str = "default"):
+        """Waits for a slot on the target database, or raises 503. Pair with release()."""
+        state = self._state(creds)
+        # Anyone already queued is blocked by their own per-user cap, so a user
+        # with nothing queued may take a free slot straight away
+        if user_id not in state["queues"] and self._can_start(state, user_id):
+            self._start(state, user_id)
+            admission_wait.observe(0.0, outcome="admitted")
+            return
+
+        if state["queued"] >= self.max_queue:
+            self._reject(state, "queue_full")
+        queue = state["queues"].get(user_id)
+        if queue is not None and len(queue) >= self.max_queue_per_user:
+            self._reject(state, "user_queue_full")
+
+        if queue is None:
+            queue = state["queues"][user_id] = deque()
+            state["weights"][user_id] = max(1, int(self.tier_weights.get(tier, 1)))
+            state["credits"][user_id] = state["weights"][user_id]
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        state["queued"] += 1
+        self.queued_total += 1
+
+        start = time.perf_counter()
+        try:
+            with timed_stage("admission"):
+                await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Admitted just as the wait ended: hand the slot on
+                self.release(creds, user_id)
+            else:
+                self._drop_waiter(state, user_id, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(state, "queue_timeout", time.perf_counter() - start)
+            raise
+        admission_wait.observe(time.perf_counter() - start, outcome="admitted")
+
+    def release(self, creds: DBConnection, user_id: str, held: Optional[float] = None):
+        state = self._state(creds)
+        state["running"] -= 1
+        state["by_user"][user_id] -= 1
+        if not state["by_user"][user_id]:
+            del state["by_user"][user_id]
+        if held is not None:
+            state["hold_avg"] = 0.8 * state["hold_avg"] + 0.2 * held
+        self._dispatch(state)
+        self._forget_idle(state)
+
+    @asynccontextmanager
+    async def slot(self, creds: DBConnection, user_id: str, tier: str = "default"):
+        await self.acquire(creds, user_id, tier)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(creds, user_id, time.perf_counter() - start)
+
+    def _dispatch(self, state: Dict[str, Any]):
+        # Weighted round-robin over users with queued queries
+        while state["running"] < state["limit"] and state["queues"]:
+            user_id = next((u for u in state["queues"] if self._can_start(state, u)), None)
+            if user_id is None:
+                return
+            waiter = state["queues"][user_id].popleft()
+            state["queued"] -= 1
+            state["credits"][user_id] -= 1
+            if not state["queues"][user_id]:
+                self._forget_user(state, user_id)
+            elif state["credits"][user_id] <= 0:
+                state["credits"][user_id] = state["weights"][user_id]
+                state["queues"].move_to_end(user_id)
+            self._start(state, user_id)
+            waiter.set_result(None)
+
+    def _drop_waiter(self, state: Dict[str, Any], user_id: str, waiter: asyncio.Future):
+        queue = state["queues"].get(user_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        state["queued"] -= 1
+        if not queue:
+            self._forget_user(state, user_id)
+        self._forget_idle(state)
+
+    def _forget_idle(self, state: Dict[str, Any]):
+        if not state["running"] and not state["queues"]:
+            self._targets.pop(state["key"], None)
+
+    @staticmethod
+    def _forget_user(state: Dict[str, Any], user_id: str):
+        del state["queues"][user_id]
+        del state["credits"][user_id]
+        del state["weights"][user_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "rejected": self.rejected,
+            "targets": [
+                {
+                    "target": state["target"],
+                    "limit": state["limit"],
+                    "running": state["running"],
+                    "queued": state["queued"],
+                    "users_queued": len(state["queues"]),
+                    "hold_avg_ms": round(state["hold_avg"] * 1000, 2),
+                }
+                for state in self._targets.values()
+            ],
+        }
+
+# Global instance
+admission = AdmissionController(
+    max_per_target=int(os.getenv("ADMISSION_MAX_PER_DB", 8)),
+    max_per_user=int(os.getenv("ADMISSION_MAX_PER_USER", 4)),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 32)),
+    max_queue_per_user=int(os.getenv("ADMISSION_MAX_QUEUE_PER_USER", 8)),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10)),
+    target_overrides=json.loads(os.getenv("ADMISSION_DB_OVERRIDES", "{}")),
+    tier_weights=json.loads(os.getenv("ADMISSION_TIER_WEIGHTS", "{}")),
+)
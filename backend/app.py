@@ -1,24 +1,39 @@
+import asyncio
+import hmac
 import time
 import os
+from contextlib import AsyncExitStack, aclosing
 from datetime import timedelta
 from urllib.parse import quote_plus
-from dotenv import load_dotenv
-
-load_dotenv()
-from fastapi import FastAPI, Depends, HTTPException, status
+import settings  # loads .env once, before any module reads its configuration
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from sqlalchemy import text
 from typing import List, Dict, Any, Optional
 
-from logger import app_logger
+from logger import app_logger, logging_stats
 from rate_limit import rate_limiter
-from auth import Token, create_access_token, get_current_user, get_password_hash, verify_password
-from db import DBConnection, test_connection, get_schema_summary, get_engine_for_creds
-from llm import generate_sql
-from sql_guard import SQLGuard
-from explain_guard import ExplainGuard
-from crypto_utils import encrypt_data, decrypt_data
+from auth import Token, create_access_token, get_current_user, get_password_hash, verify_password, clerk_public_key
+from db import DBConnection, ReplicaEndpoint, test_connection, engine_registry
+from replicas import replica_router
+from schema_cache import schema_cache
+from schema_retrieval import schema_retriever
+from index_advisor import index_advisor
+from sql_cache import sql_cache
+from explain_guard import plan_cache
+from token_cache import auth_cache, session_cache
+from result_cache import result_cache
+from admission import admission
+from llm import llm_client
+from crypto_utils import encrypt_data, cipher_suite
+from async_utils import run_blocking, run_with_events, cancel_on_disconnect, StageTimeoutError, ClientDisconnected
+from pipeline import decrypt_session, load_schema_entry, prepare_query, stream_prepare_query, open_connection, verify_plan, run_query, stream_query_rows, row_limit_for, tier_for
+from pipeline import first_page_cursor, fetch_page
+from pipeline import schema_flight, llm_flight, query_flight
+from metrics import TimingMiddleware, registry as metrics_registry, timed_stage
+from result_encoding import negotiate_format, encode_result, encode_json, UnsupportedFormatError
 
 app = FastAPI(title="Ask Your Database API", version="1.0.0")
 
@@ -29,7 +44,82 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "Server-Timing"],
 )
+app.add_middleware(TimingMiddleware)
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# /query/batch limits: prompts per request (at most the per-minute rate limit,
+# since every prompt counts against it), and per-request concurrency of SQL
+# generation and of EXPLAIN + execution (the latter also bounded by the pool)
+BATCH_MAX_PROMPTS = min(int(os.getenv("BATCH_MAX_PROMPTS", 50)), rate_limiter.requests_per_minute)
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 4))
+BATCH_EXECUTE_CONCURRENCY = int(os.getenv("BATCH_EXECUTE_CONCURRENCY", 2))
+
+def _collect_pipeline_metrics():
+    """Scrape-time view of pools and caches, which keep their own counters."""
+    engines = engine_registry.stats()
+    pool_labels = [{"target": pool["target"]} for pool in engines["pools"]]
+    yield "askdb_db_engines", "gauge", "Engines held by the registry", [({}, engines["engines"])]
+    yield "askdb_db_pool_size", "gauge", "Pool size per target", [
+        (labels, pool["size"]) for labels, pool in zip(pool_labels, engines["pools"])
+    ]
+    yield "askdb_db_pool_checked_out", "gauge", "Connections in use per target", [
+        (labels, pool["checked_out"] + pool.get("async_checked_out", 0))
+        for labels, pool in zip(pool_labels, engines["pools"])
+    ]
+
+    targets = admission.stats()["targets"]
+    yield "askdb_admission_running", "gauge", "Queries holding an admission slot per target", [
+        ({"target": t["target"]}, t["running"]) for t in targets
+    ]
+    yield "askdb_admission_queue_depth", "gauge", "Queries waiting for an admission slot per target", [
+        ({"target": t["target"]}, t["queued"]) for t in targets
+    ]
+
+    hosts = replica_router.stats()["hosts"]
+    host_labels = [{"target": h["target"], "role": h["role"]} for h in hosts]
+    yield "askdb_db_host_healthy", "gauge", "Routed database host in rotation (1) or not (0)", [
+        (labels, int(h["healthy"])) for labels, h in zip(host_labels, hosts)
+    ]
+    yield "askdb_db_host_latency_ewma_seconds", "gauge", "EWMA statement latency per routed database host", [
+        (labels, h["latency_ewma_ms"] / 1000) for labels, h in zip(host_labels, hosts) if h["latency_ewma_ms"] is not None
+    ]
+    yield "askdb_db_replica_lag_seconds", "gauge", "Replication delay at the last health check", [
+        (labels, h["lag_seconds"]) for labels, h in zip(host_labels, hosts) if h["lag_seconds"] is not None
+    ]
+
+    caches = {
+        "engine": engines,
+        "schema": schema_cache.stats(),
+        "sql": sql_cache.stats(),
+        "plan": plan_cache.stats(),
+        "auth": auth_cache.stats(),
+        "session": session_cache.stats(),
+        "result": result_cache.stats(),
+    }
+    hits, misses, ratios = [], [], []
+    for name, stats in caches.items():
+        cache_hits = stats.get("hits", stats.get("memory_hits", 0) + stats.get("disk_hits", 0))
+        cache_misses = stats.get("misses", 0)
+        hits.append(({"cache": name}, cache_hits))
+        misses.append(({"cache": name}, cache_misses))
+        total = cache_hits + cache_misses
+        ratios.append(({"cache": name}, cache_hits / total if total else 0.0))
+    yield "askdb_cache_hits_total", "counter", "Cache hits", hits
+    yield "askdb_cache_misses_total", "counter", "Cache misses", misses
+    yield "askdb_cache_hit_ratio", "gauge", "Cache hit ratio since start", ratios
+
+    retrieval = schema_retriever.stats()
+    yield "askdb_prompt_tokens_saved_total", "counter", "Schema tokens pruned from LLM prompts", [
+        ({}, retrieval["prompt_tokens_saved"])
+    ]
+    yield "askdb_log_records_dropped_total", "counter", "Log records dropped on a full queue", [
+        ({}, logging_stats(app_logger)["dropped"])
+    ]
+
+metrics_registry.register_collector(_collect_pipeline_metrics)
 
 @app.get("/")
 async def root():
@@ -47,16 +137,43 @@ class ConnectRequest(BaseModel):
     user: str
     password: str
     database: str
+    # Optional read replicas (same user, password and database); reads are routed to them
+    replicas: List[ReplicaEndpoint] = []
 
 class QueryRequest(BaseModel):
     db_token: str
     prompt: str
+    # rows | columnar | msgpack | arrow (defaults to rows, or negotiated from Accept)
+    format: Optional[str] = None
+    # Set to false to bypass the result cache for this request
+    use_cache: bool = True
+
+class BatchQueryRequest(BaseModel):
+    db_token: str
+    prompts: List[str]
+    use_cache: bool = True
+    # Stream items back as NDJSON in completion order instead of one JSON document
+    stream: bool = False
+
+class NextPageRequest(BaseModel):
+    db_token: str
+    # next_cursor from /query/ask or a previous /query/next
+    cursor: str
+    format: Optional[str] = None
+
+class SchemaRefreshRequest(BaseModel):
+    db_token: str
 
 class QueryResponse(BaseModel):
     sql: str
     results: List[Dict[str, Any]]
     column_names: List[str]
     execution_time_ms: float
+    sql_cached: bool = False
+    result_cached: bool = False
+    warnings: List[str] = []
+    # Set when the row cap cut the result short; pass it to /query/next
+    next_cursor: Optional[str] = None
 
 # --- Routes ---
 
@@ -96,9 +213,16 @@ async def connect_database(creds: ConnectRequest, current_user: str = Depends(ge
         for key in ["host", "user", "password", "database"]:
             if isinstance(data[key], str):
                 data[key] = data[key].strip()
+        for replica in data["replicas"]:
+            replica["host"] = replica["host"].strip()
         
         db_creds = DBConnection(**data)
-        test_connection(db_creds)
+        await run_blocking(test_connection, db_creds)
+        for replica in db_creds.replicas:
+            try:
+                await run_blocking(test_connection, db_creds.model_copy(update={"host": replica.host, "port": replica.port, "replicas": []}))
+            except ValueError as e:
+                raise ValueError(f"Replica {replica.host}:{replica.port}: {str(e)}")
         
         # Encrypt credentials to return to client (Stateless)
         db_token = encrypt_data(data)
@@ -123,9 +247,16 @@ async def connect_env_database(current_user: str = Depends(get_current_user)):
         }
         if not all(creds_dict.values()):
              raise ValueError("DB environment variables are not fully configured.")
+        # Optional read replicas: "host:port,host:port"
+        replicas = [r.strip() for r in os.getenv("DB_REPLICAS", "").split(",") if r.strip()]
+        if replicas:
+            creds_dict["replicas"] = [
+                {"host": r.rpartition(":")[0] or r, "port": int(r.rpartition(":")[2]) if ":" in r else creds_dict["port"]}
+                for r in replicas
+            ]
              
         db_creds = DBConnection(**creds_dict)
-        test_connection(db_creds)
+        await run_blocking(test_connection, db_creds)
         
         # Encrypt credentials to return to client
         db_token = encrypt_data(creds_dict)
@@ -135,62 +266,130 @@ async def connect_env_database(current_user: str = Depends(get_current_user)):
         app_logger.error(f"Env connection failed: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
+# Background warm-up: builds what the first requests would otherwise pay for,
+# after startup so it doesn't delay binding the port
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+WARMUP_DELAY = float(os.getenv("WARMUP_DELAY", 0))
+
+def warm_up():
+    start = time.perf_counter()
+    llm_client.warm_up()
+    cipher_suite()
+    clerk_public_key()
+    # Async engines need sqlalchemy.ext.asyncio and the aiomysql dialect
+    from sqlalchemy.ext.asyncio import create_async_engine  # noqa: F401
+    from sqlalchemy.dialects.mysql import aiomysql  # noqa: F401
+    app_logger.info("Warm-up complete", extra={"duration_ms": round((time.perf_counter() - start) * 1000, 2)})
+
+async def _run_warm_up():
+    try:
+        await run_blocking(warm_up)
+    except Exception as e:
+        app_logger.warning(f"Warm-up failed: {str(e)}")
+
+@app.on_event("startup")
+async def schedule_warm_up():
+    if WARMUP_ON_STARTUP:
+        loop = asyncio.get_running_loop()
+        loop.call_later(WARMUP_DELAY, lambda: setattr(app.state, "warm_up", asyncio.ensure_future(_run_warm_up())))
+
+@app.on_event("shutdown")
+async def close_clients():
+    # Closes the LLM client's keep-alive connection pool
+    await llm_client.aclose()
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    """
+    Prometheus exposition. Scrapers send METRICS_TOKEN as a bearer token when it
+    is set; otherwise a user access token is required, as for /stats.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if METRICS_TOKEN:
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    else:
+        if scheme.lower() != "bearer" or not token:
+            raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+        await get_current_user(token)
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/db/engine-stats")
+async def engine_stats(current_user: str = Depends(get_current_user)):
+    """
+    Engine registry counters (hits, misses, evictions) and per-pool occupancy.
+    """
+    return engine_registry.stats()
+
+@app.get("/stats")
+async def pipeline_stats(current_user: str = Depends(get_current_user)):
+    """
+    Cache and schema retrieval counters for the query pipeline.
+    """
+    return {
+        "schema_cache": schema_cache.stats(),
+        "schema_retrieval": schema_retriever.stats(),
+        "sql_cache": sql_cache.stats(),
+        "plan_cache": plan_cache.stats(),
+        "auth_cache": auth_cache.stats(),
+        "session_cache": session_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "admission": admission.stats(),
+        "replicas": replica_router.stats(),
+        "index_advisor": index_advisor.stats(),
+        "llm": llm_client.stats(),
+        "coalescing": {flight.name: flight.stats() for flight in (schema_flight, llm_flight, query_flight)},
+        "logging": logging_stats(app_logger),
+    }
+
+@app.post("/db/schema/refresh")
+async def refresh_schema(request: SchemaRefreshRequest, current_user: str = Depends(get_current_user)):
+    """
+    Forces a reload of the cached schema summary for the given database session.
+    """
+    creds = await decrypt_session(request.db_token)
+
+    try:
+        entry = await run_blocking(schema_cache.refresh, creds)
+    except Exception as e:
+        app_logger.error(f"Schema refresh failed for user {current_user}: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Failed to fetch schema: {str(e)}")
+
+    return {"status": "refreshed", "tables": len(entry["tables"]), "checksum": entry["checksum"]}
+
 @app.post("/query/ask", response_model=QueryResponse)
 async def ask_database(
     request: QueryRequest, 
+    http_request: Request,
     current_user: str = Depends(get_current_user)
 ):
     try:
         start_time = time.time()
+
+        try:
+            result_format = negotiate_format(request.format, http_request.headers.get("accept"))
+        except UnsupportedFormatError as fe:
+            raise HTTPException(status_code=406, detail=str(fe))
         
         # 1. Rate Limit
-        rate_limiter.check_rate_limit(current_user)
+        with timed_stage("rate_limit"):
+            limit_status = await rate_limiter.check_rate_limit(current_user)
         
-        # 2. Decrypt Credentials
-        try:
-            creds_dict = decrypt_data(request.db_token)
-            creds = DBConnection(**creds_dict)
-        except Exception:
-            raise HTTPException(status_code=401, detail="Invalid database session. Please reconnect.")
-
-        # 3. Get Schema (Optimized: In prod, cache this. Here we fetch to ensure accuracy)
-        try:
-            schema_summary = get_schema_summary(creds)
-        except Exception as e:
-             raise HTTPException(status_code=400, detail=f"Failed to fetch schema: {str(e)}")
+        async def answer():
+            # 2. Decrypt Credentials
+            creds = await decrypt_session(request.db_token)
 
-        # 4. LLM Generation
-        generated_sql = generate_sql(schema_summary, request.prompt)
-        
-        if "INVALID_QUERY" in generated_sql:
-             raise HTTPException(status_code=400, detail="Cannot answer this question with the available schema or request is unsafe.")
+            # 3-5. Schema, LLM generation (or cache hit) and SQLGuard
+            prepared = await prepare_query(creds, request.prompt, current_user)
 
-        app_logger.info("Generated SQL", extra={"user_id": current_user, "sql": generated_sql})
+            # Concurrency cap per database and per user (queued fairly, or 503),
+            # taken only once the database is needed
+            async with admission.slot(creds, current_user, tier_for(current_user)):
+                # 6-7. Result cache, or deep validation (EXPLAIN) and execution on the same pooled connection
+                return (prepared,) + await run_query(prepared, use_cache=request.use_cache)
 
-        # 5. SQL Validation (Static)
-        try:
-            clean_sql = SQLGuard.validate_query(generated_sql)
-        except ValueError as ve:
-             app_logger.warning(f"SQL Guard blocked query: {str(ve)}")
-             raise HTTPException(status_code=400, detail=f"Safety violation: {str(ve)}")
-
-        # 6. Deep Validation (EXPLAIN)
-        is_safe, explain_error = ExplainGuard.check_query_safety(creds, clean_sql)
-        if not is_safe:
-             app_logger.warning(f"Explain Guard blocked query: {explain_error}")
-             raise HTTPException(status_code=400, detail="Query failed safety check (EXPLAIN analysis)")
-
-        # 7. Execution
-        engine = get_engine_for_creds(creds)
-        try:
-            with engine.connect() as conn:
-                result = conn.execute(text(clean_sql))
-                rows = [dict(row._mapping) for row in result]
-                column_names = list(result.keys())
-                
-        except Exception as e:
-             app_logger.error(f"Execution error: {str(e)}")
-             raise HTTPException(status_code=500, detail=f"Database execution error: {str(e)}")
+        # A client that leaves stops generation and execution (KILL QUERY on MySQL)
+        prepared, column_names, rows, result_cached = await cancel_on_disconnect(http_request.receive, answer())
 
         end_time = time.time()
         duration = round((end_time - start_time) * 1000, 2)
@@ -200,25 +399,378 @@ async def ask_database(
             "Query Success", 
             extra={
                 "user_id": current_user, 
-                "query": clean_sql, 
+                "query": prepared.sql, 
                 "row_count": len(rows),
                 "duration_ms": duration
             }
         )
 
-        return {
-            "sql": clean_sql,
-            "results": rows,
-            "column_names": column_names,
-            "execution_time_ms": duration
+        # Encoded straight from the cursor rows, skipping response_model validation
+        meta = {
+            "sql": prepared.sql,
+            "execution_time_ms": duration,
+            "sql_cached": prepared.sql_cached,
+            "result_cached": result_cached,
+            "warnings": prepared.warnings,
+            "next_cursor": first_page_cursor(prepared, column_names, rows, current_user),
         }
+        try:
+            body, media_type = encode_result(result_format, meta, column_names, rows)
+        except UnsupportedFormatError as fe:
+            raise HTTPException(status_code=406, detail=str(fe))
+        return Response(content=body, media_type=media_type, headers=limit_status.headers())
+
+    except HTTPException as he:
+        raise he
+    except StageTimeoutError as te:
+        raise stage_timeout_exception(te, current_user)
+    except ClientDisconnected:
+        return client_disconnected_response(current_user)
+    except Exception as e:
+        app_logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+@app.post("/query/next", response_model=QueryResponse)
+async def next_page(
+    request: NextPageRequest,
+    http_request: Request,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    The next page of a /query/ask result, from its `next_cursor`. Runs the SQL the
+    cursor carries (keyset form when the ordering is unique, bounded OFFSET
+    otherwise) without calling the LLM or re-running schema and guard stages.
+    """
+    try:
+        start_time = time.time()
+        try:
+            result_format = negotiate_format(request.format, http_request.headers.get("accept"))
+        except UnsupportedFormatError as fe:
+            raise HTTPException(status_code=406, detail=str(fe))
+
+        with timed_stage("rate_limit"):
+            limit_status = await rate_limiter.check_rate_limit(current_user)
+
+        async def page():
+            creds = await decrypt_session(request.db_token)
+            async with admission.slot(creds, current_user, tier_for(current_user)):
+                return await fetch_page(creds, request.cursor, current_user)
+
+        sql, column_names, rows, next_cursor = await cancel_on_disconnect(http_request.receive, page())
+        duration = round((time.time() - start_time) * 1000, 2)
+        app_logger.info(
+            "Query Success",
+            extra={"user_id": current_user, "query": sql, "row_count": len(rows), "duration_ms": duration, "page": True}
+        )
+
+        meta = {
+            "sql": sql,
+            "execution_time_ms": duration,
+            "sql_cached": True,
+            "result_cached": False,
+            "warnings": [],
+            "next_cursor": next_cursor,
+        }
+        try:
+            body, media_type = encode_result(result_format, meta, column_names, rows)
+        except UnsupportedFormatError as fe:
+            raise HTTPException(status_code=406, detail=str(fe))
+        return Response(content=body, media_type=media_type, headers=limit_status.headers())
+
+    except HTTPException as he:
+        raise he
+    except StageTimeoutError as te:
+        raise stage_timeout_exception(te, current_user)
+    except ClientDisconnected:
+        return client_disconnected_response(current_user)
+    except Exception as e:
+        app_logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+@app.post("/query/ask/stream")
+async def ask_database_stream(
+    request: QueryRequest,
+    http_request: Request,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Streaming variant of /query/ask. Responds with NDJSON: a "meta" line with the
+    SQL and column names, "rows" lines of up to STREAM_CHUNK_SIZE rows (arrays in
+    column order), then an "end" line (or an "error" line if execution fails).
+    """
+    try:
+        start_time = time.time()
+        with timed_stage("rate_limit"):
+            limit_status = await rate_limiter.check_rate_limit(current_user)
+        creds = await decrypt_session(request.db_token)
+        prepared = await prepare_query(
+            creds, request.prompt, current_user,
+            max_limit=row_limit_for(current_user, streaming=True),
+        )
+        # The admission slot is held until the row stream ends, since the
+        # statement runs for as long as the client reads rows
+        slot = AsyncExitStack()
+        await slot.enter_async_context(admission.slot(creds, current_user, tier_for(current_user)))
+        try:
+            # The connection is handed to the row stream, which closes it
+            conn = await open_connection(creds)
+            try:
+                await verify_plan(prepared, conn)
+            except BaseException:
+                await conn.close()
+                raise
+        except BaseException:
+            await slot.aclose()
+            raise
+    except HTTPException as he:
+        raise he
+    except StageTimeoutError as te:
+        raise stage_timeout_exception(te, current_user)
+    except Exception as e:
+        app_logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+    async def ndjson_lines():
+        row_count = 0
+        try:
+            # Closed on every exit, so an abandoned statement is killed right away
+            async with aclosing(stream_query_rows(conn, prepared.sql, timeout=prepared.execution_timeout)) as chunks:
+                async for column_names, rows in chunks:
+                    if await http_request.is_disconnected():
+                        app_logger.info("Stream cancelled by client", extra={"user_id": current_user, "row_count": row_count})
+                        return
+                    if not rows:
+                        yield ndjson_line({
+                            "type": "meta",
+                            "sql": prepared.sql,
+                            "column_names": column_names,
+                            "sql_cached": prepared.sql_cached,
+                            "warnings": prepared.warnings,
+                        })
+                        continue
+                    row_count += len(rows)
+                    yield ndjson_line({"type": "rows", "rows": rows})
+        except Exception as e:
+            app_logger.error(f"Execution error: {str(e)}")
+            yield ndjson_line({"type": "error", "detail": f"Database execution error: {str(e)}"})
+            return
+        finally:
+            await slot.aclose()
+
+        duration = round((time.time() - start_time) * 1000, 2)
+        app_logger.info(
+            "Query Success",
+            extra={"user_id": current_user, "query": prepared.sql, "row_count": row_count, "duration_ms": duration, "streamed": True}
+        )
+        yield ndjson_line({"type": "end", "row_count": row_count, "execution_time_ms": duration})
 
+    async def finish():
+        await conn.close()
+        await slot.aclose()
+
+    # Closing twice is a no-op; this covers a client that leaves before the body starts
+    return StreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson",
+        headers=limit_status.headers(),
+        background=BackgroundTask(finish),
+    )
+
+@app.post("/query/ask/sse")
+async def ask_database_sse(
+    request: QueryRequest,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Server-Sent Events variant of /query/ask for progressive UIs. Events, in order:
+    "token" (SQL text as the LLM writes it; skipped on a SQL cache hit), "sql"
+    (the validated SQL, i.e. SQLGuard passed), "explain" (plan check passed, with
+    warnings), "execute" (query running), then "result" (the /query/ask body)
+    or "error" ({"status_code", "detail"}) at any point.
+    """
+    # Failures before the stream starts are plain HTTP errors, as on /query/ask
+    try:
+        with timed_stage("rate_limit"):
+            limit_status = await rate_limiter.check_rate_limit(current_user)
+        creds = await decrypt_session(request.db_token)
     except HTTPException as he:
         raise he
+    except StageTimeoutError as te:
+        raise stage_timeout_exception(te, current_user)
     except Exception as e:
         app_logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail="An unexpected error occurred")
 
+    async def events():
+        start_time = time.time()
+        try:
+            prepared = None
+            async for name, data in stream_prepare_query(creds, request.prompt, current_user):
+                if name == "token":
+                    yield sse_event("token", {"text": data})
+                else:
+                    prepared = data
+            yield sse_event("sql", {"sql": prepared.sql, "sql_cached": prepared.sql_cached})
+
+            async with admission.slot(creds, current_user, tier_for(current_user)):
+                async for name, data in run_with_events(run_query, prepared, use_cache=request.use_cache):
+                    if name == "result":
+                        column_names, rows, result_cached = data
+                    else:
+                        yield sse_event(name, data)
+        except HTTPException as he:
+            yield sse_event("error", {"status_code": he.status_code, "detail": he.detail})
+            return
+        except StageTimeoutError as te:
+            he = stage_timeout_exception(te, current_user)
+            yield sse_event("error", {"status_code": he.status_code, "detail": he.detail})
+            return
+        except Exception as e:
+            app_logger.error(f"Unexpected error: {str(e)}")
+            yield sse_event("error", {"status_code": 500, "detail": "An unexpected error occurred"})
+            return
+
+        duration = round((time.time() - start_time) * 1000, 2)
+        app_logger.info(
+            "Query Success",
+            extra={"user_id": current_user, "query": prepared.sql, "row_count": len(rows), "duration_ms": duration, "sse": True}
+        )
+        yield sse_event("result", {
+            "sql": prepared.sql,
+            "execution_time_ms": duration,
+            "sql_cached": prepared.sql_cached,
+            "result_cached": result_cached,
+            "warnings": prepared.warnings,
+            "column_names": column_names,
+            "results": [dict(zip(column_names, row)) for row in rows],
+        })
+
+    headers = dict(limit_status.headers(), **{"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+@app.post("/query/batch")
+async def ask_database_batch(
+    request: BatchQueryRequest,
+    http_request: Request,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Answers several questions against one database. The session is decrypted and
+    the schema fetched once; SQL generation and EXPLAIN + execution then run with
+    separate concurrency limits. Each item carries its own results or error.
+    With `stream`, responds with NDJSON "item" lines as items complete, then an
+    "end" line; otherwise with {"items": [...]} in request order.
+    """
+    if not request.prompts:
+        raise HTTPException(status_code=400, detail="No prompts given")
+    if len(request.prompts) > BATCH_MAX_PROMPTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_PROMPTS} prompts per batch")
+
+    try:
+        start_time = time.time()
+        # Every question counts against the rate limit
+        with timed_stage("rate_limit"):
+            limit_status = await rate_limiter.check_rate_limit(current_user, cost=len(request.prompts))
+        creds = await decrypt_session(request.db_token)
+        schema_entry = await load_schema_entry(creds)
+    except HTTPException as he:
+        raise he
+    except StageTimeoutError as te:
+        raise stage_timeout_exception(te, current_user)
+    except Exception as e:
+        app_logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred")
+
+    llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    execute_slots = asyncio.Semaphore(BATCH_EXECUTE_CONCURRENCY)
+
+    async def answer(index: int, prompt: str) -> Dict[str, Any]:
+        item_start = time.time()
+        try:
+            async with llm_slots:
+                prepared = await prepare_query(creds, prompt, current_user, schema_entry=schema_entry)
+            # Each execution also goes through admission control for the database
+            async with execute_slots, admission.slot(creds, current_user, tier_for(current_user)):
+                column_names, rows, result_cached = await run_query(prepared, use_cache=request.use_cache)
+        except HTTPException as he:
+            return {"index": index, "prompt": prompt, "status_code": he.status_code, "error": he.detail}
+        except StageTimeoutError as te:
+            he = stage_timeout_exception(te, current_user)
+            return {"index": index, "prompt": prompt, "status_code": he.status_code, "error": he.detail}
+        except Exception as e:
+            app_logger.error(f"Unexpected error in batch item: {str(e)}", extra={"user_id": current_user})
+            return {"index": index, "prompt": prompt, "status_code": 500, "error": "An unexpected error occurred"}
+
+        return {
+            "index": index,
+            "prompt": prompt,
+            "status_code": 200,
+            "sql": prepared.sql,
+            "column_names": column_names,
+            "results": [dict(zip(column_names, row)) for row in rows],
+            "execution_time_ms": round((time.time() - item_start) * 1000, 2),
+            "sql_cached": prepared.sql_cached,
+            "result_cached": result_cached,
+            "warnings": prepared.warnings,
+        }
+
+    def log_batch(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        summary = {
+            "succeeded": sum(1 for item in items if item["status_code"] == 200),
+            "failed": sum(1 for item in items if item["status_code"] != 200),
+            "execution_time_ms": round((time.time() - start_time) * 1000, 2),
+        }
+        app_logger.info("Batch Success", extra=dict(summary, user_id=current_user, batch_size=len(items)))
+        return summary
+
+    def start_items() -> List[asyncio.Future]:
+        return [asyncio.ensure_future(answer(i, prompt)) for i, prompt in enumerate(request.prompts)]
+
+    if not request.stream:
+        tasks = start_items()
+        try:
+            items = await cancel_on_disconnect(http_request.receive, asyncio.gather(*tasks))
+        except ClientDisconnected:
+            return client_disconnected_response(current_user)
+        finally:
+            for task in tasks:
+                task.cancel()
+        body = encode_json(dict(log_batch(items), items=items))
+        return Response(content=body, media_type="application/json", headers=limit_status.headers())
+
+    async def ndjson_items():
+        # Started with the body, so a client that leaves before the first chunk
+        # (when the body may never run) leaves no generations or queries behind
+        tasks = start_items()
+        items = []
+        try:
+            for next_item in asyncio.as_completed(tasks):
+                item = await next_item
+                items.append(item)
+                yield ndjson_line(dict(item, type="item"))
+            yield ndjson_line(dict(log_batch(items), type="end"))
+        finally:
+            # Client went away: stop the remaining generations and queries
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(ndjson_items(), media_type="application/x-ndjson", headers=limit_status.headers())
+
+def ndjson_line(payload: Dict[str, Any]) -> bytes:
+    return encode_json(payload) + b"\n"
+
+def sse_event(event: str, payload: Dict[str, Any]) -> bytes:
+    return b"event: " + event.encode("ascii") + b"\ndata: " + encode_json(payload) + b"\n\n"
+
+def client_disconnected_response(user_id: str) -> Response:
+    # Nobody reads this; 499 (client closed request) keeps access logs honest
+    app_logger.info("Request cancelled by client", extra={"user_id": user_id})
+    return Response(status_code=499)
+
+def stage_timeout_exception(te: StageTimeoutError, user_id: str) -> HTTPException:
+    app_logger.error(f"Stage timeout: {str(te)}", extra={"user_id": user_id, "stage": te.stage})
+    return HTTPException(status_code=504, detail=f"The {te.stage} step took too long. Please try again.")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,184 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from metrics import timed_stage, stage_timeouts, singleflight_calls, client_disconnects
+
+# Bounded pool for the blocking work that is left on the request path
+# (Fernet decryption, schema loading through the sync engine, BM25 scoring).
+blocking_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BLOCKING_POOL_SIZE", 16)),
+    thread_name_prefix="blocking",
+)
+
+# Per-stage deadlines in seconds, overridable with STAGE_TIMEOUT_<STAGE>
+STAGE_TIMEOUTS: Dict[str, float] = {
+    stage: float(os.getenv(f"STAGE_TIMEOUT_{stage.upper()}", default))
+    for stage, default in {
+        "decrypt": 2,
+        "schema": 30,
+        "retrieval": 5,
+        "llm": 30,
+        "explain": 10,
+        "result_cache": 2,
+        "execute": 60,
+        "kill": 5,
+    }.items()
+}
+
+class StageTimeoutError(Exception):
+    def __init__(self, stage: str, timeout: float):
+        self.stage = stage
+        self.timeout = timeout
+        super().__init__(f"Stage '{stage}' timed out after {timeout}s")
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Runs a blocking callable on the bounded executor without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(func, *args, **kwargs))
+
+class ClientDisconnected(Exception):
+    """The client went away before the work it was waiting for finished."""
+
+async def with_timeout(stage: str, awaitable: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """
+    Awaits `awaitable` under the configured deadline for `stage` (or `timeout`)
+    and records its latency.
+    """
+    timeout = STAGE_TIMEOUTS[stage] if timeout is None else timeout
+    try:
+        with timed_stage(stage):
+            return await asyncio.wait_for(awaitable, timeout=timeout)
+    except asyncio.TimeoutError:
+        stage_timeouts.inc(stage=stage)
+        raise StageTimeoutError(stage, timeout)
+
+async def iterate_with_timeout(
+    stage: str,
+    iterator: AsyncGenerator[Any, None],
+    timeout: Optional[float] = None,
+) -> AsyncIterator[Any]:
+    """
+    Yields the items of `iterator` under one deadline for the whole iteration
+    (the configured one for `stage`, or `timeout`), then closes it.
+    Latency is recorded by the caller, which sees the items as they arrive.
+    """
+    timeout = STAGE_TIMEOUTS[stage] if timeout is None else timeout
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(iterator.__anext__(), max(0.0, deadline - loop.time()))
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                stage_timeouts.inc(stage=stage)
+                raise StageTimeoutError(stage, timeout)
+            yield item
+    finally:
+        await iterator.aclose()
+
+async def cancel_on_disconnect(receive: Callable[[], Awaitable[dict]], awaitable: Awaitable[Any]) -> Any:
+    """
+    Awaits `awaitable` while listening on the ASGI `receive` channel (only once
+    the request body has been read). If the client disconnects first the work is
+    cancelled and ClientDisconnected is raised.
+    """
+    async def wait_for_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        work.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+    if work.done() or watcher.exception() is not None:
+        return await work
+    work.cancel()
+    client_disconnects.inc()
+    raise ClientDisconnected()
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical work: while an operation for `key` is in flight,
+    later callers await the same task instead of starting their own, and every
+    caller gets its result or exception. A caller that is cancelled only stops
+    waiting; the shared task is cancelled once no caller is left waiting for it.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, list] = {}  # {key: [task, waiters]}
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(factory())
+            call = [task, 0]
+            self._calls[key] = call
+            task.add_done_callback(functools.partial(self._finished, key))
+            self.leaders += 1
+            singleflight_calls.inc(operation=self.name, role="leader")
+        else:
+            self.coalesced += 1
+            singleflight_calls.inc(operation=self.name, role="coalesced")
+
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not task.done():
+                self.abandoned += 1
+                task.cancel()
+
+    def _finished(self, key: Hashable, task: asyncio.Future):
+        call = self._calls.get(key)
+        if call is not None and call[0] is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Marks the exception as retrieved when every waiter has gone
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+        }
+
+async def run_with_events(func: Callable[..., Awaitable[Any]], *args, **kwargs) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Runs `func(*args, on_event=callback, **kwargs)` as a task and yields each
+    (name, data) passed to the callback as it happens, then ("result", value).
+    Exceptions from `func` propagate; closing the iterator cancels the task.
+    """
+    events: asyncio.Queue = asyncio.Queue()
+    task = asyncio.ensure_future(func(*args, on_event=lambda name, data: events.put_nowait((name, data)), **kwargs))
+    try:
+        while not task.done():
+            getter = asyncio.ensure_future(events.get())
+            await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                yield getter.result()
+            else:
+                getter.cancel()
+        while not events.empty():
+            yield events.get_nowait()
+        yield "result", task.result()
+    finally:
+        task.cancel()
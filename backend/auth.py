@@ -1,18 +1,15 @@
 import os
-import requests
+import time
 from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
-from passlib.context import CryptContext
+from functools import lru_cache
+from typing import Optional, Tuple
+from jose import JWTError, jwk, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from dotenv import load_dotenv
 from pydantic import BaseModel
 
-# Load .env relative to this file's location
-base_dir = os.path.dirname(os.path.abspath(__file__))
-env_path = os.path.join(base_dir, ".env")
-load_dotenv(env_path)
+import settings
+from token_cache import auth_cache
 
 SECRET_KEY = os.getenv("SECRET_KEY", "fallback_secret_key_for_dev_only")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
@@ -22,7 +19,17 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 CLERK_ISSUER = os.getenv("CLERK_ISSUER") # e.g. https://great-hyena-92.clerk.accounts.dev
 CLERK_PEM_PUBLIC_KEY = os.getenv("CLERK_PEM_PUBLIC_KEY") # If they provide the PEM directly
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache(maxsize=1)
+def clerk_public_key():
+    # Parsed once (on first use or during warm-up) instead of on every RS256 decode
+    return jwk.construct(CLERK_PEM_PUBLIC_KEY, "RS256") if CLERK_PEM_PUBLIC_KEY else None
+
+@lru_cache(maxsize=1)
+def pwd_context():
+    # passlib + bcrypt are only needed by /auth/login
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 class Token(BaseModel):
@@ -33,10 +40,10 @@ class TokenData(BaseModel):
     username: Optional[str] = None
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return pwd_context().hash(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -48,19 +55,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
+def _verify_token(token: str) -> Optional[Tuple[str, Optional[float]]]:
+    """Returns (username, exp) for a valid token, or None."""
     # 1. Try standard JWT verification (Old Auth)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username:
-            return username
+            return username, payload.get("exp")
     except JWTError:
         pass
 
@@ -70,13 +72,14 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     # For a quick fix in dev/small apps, we can just check if it's a valid JWT from Clerk
     # if we have the public key.
     
-    if CLERK_PEM_PUBLIC_KEY:
+    public_key = clerk_public_key()
+    if public_key is not None:
         try:
             # Clerk uses RS256
-            payload = jwt.decode(token, CLERK_PEM_PUBLIC_KEY, algorithms=["RS256"])
+            payload = jwt.decode(token, public_key, algorithms=["RS256"])
             username = payload.get("sub")
             if username:
-                return username
+                return username, payload.get("exp")
         except JWTError as e:
             print(f"Clerk JWT Error: {str(e)}")
 
@@ -94,8 +97,29 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
                 # In development mode, we could trust it, but let's be safer.
                 # If ENV=development, let's allow it but log a warning.
                 if os.getenv("ENV") == "development":
-                    return unverified.get("sub", "clerk_user")
+                    return unverified.get("sub", "clerk_user"), unverified.get("exp")
         except Exception:
             pass
 
-    raise credentials_exception
+    return None
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    # Already-verified tokens are served from memory until their `exp`
+    username = auth_cache.get(token)
+    if username is not None:
+        return username
+
+    cpu_start = time.thread_time()
+    verified = _verify_token(token)
+    auth_cache.record_miss_cost(time.thread_time() - cpu_start)
+
+    if verified is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    username, exp = verified
+    auth_cache.set(token, username, expires_at=float(exp) if exp else None)
+    return username
@@ -0,0 +1,90 @@
+"""
+Result encoding benchmark: bytes and microseconds per row for each response format.
+
+    python bench_encoding.py [--rows 100 1000 10000] [--columns 20]
+
+Prints one JSON object per line (machine readable). "baseline" is the previous path:
+row dicts validated through the pydantic response model, then jsonable_encoder
+and json.dumps, as FastAPI does for response_model endpoints.
+"""
+import argparse
+import datetime
+import decimal
+import json
+import random
+import time
+from typing import Any, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from result_encoding import FORMATS, encode_result, UnsupportedFormatError
+
+class BaselineResponse(BaseModel):
+    sql: str
+    results: List[Dict[str, Any]]
+    column_names: List[str]
+    execution_time_ms: float
+
+def make_rows(n_rows: int, n_columns: int):
+    rng = random.Random(42)
+    column_names = [f"column_{i}" for i in range(n_columns)]
+    base = datetime.datetime(2024, 1, 1)
+    makers = [
+        lambda i: i,
+        lambda i: f"name_{rng.randint(0, 10_000)}",
+        lambda i: decimal.Decimal(rng.randint(0, 10_000_000)) / 100,
+        lambda i: base + datetime.timedelta(minutes=rng.randint(0, 500_000)),
+        lambda i: None if i % 7 == 0 else rng.random(),
+    ]
+    rows = [
+        tuple(makers[c % len(makers)](i) for c in range(n_columns))
+        for i in range(n_rows)
+    ]
+    return column_names, rows
+
+def encode_baseline(meta, column_names, rows) -> bytes:
+    results = [dict(zip(column_names, row)) for row in rows]
+    validated = BaselineResponse(results=results, column_names=column_names, **meta)
+    return json.dumps(jsonable_encoder(validated)).encode("utf-8")
+
+def measure(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    meta = {"sql": "SELECT ... LIMIT 100", "execution_time_ms": 12.5}
+    for n_rows in args.rows:
+        column_names, rows = make_rows(n_rows, args.columns)
+        encoders = {"baseline": lambda: encode_baseline(meta, column_names, rows)}
+        for fmt in FORMATS:
+            encoders[fmt] = lambda fmt=fmt: encode_result(fmt, meta, column_names, rows)[0]
+
+        for name, encoder in encoders.items():
+            try:
+                size = len(encoder())
+            except UnsupportedFormatError as e:
+                print(json.dumps({"format": name, "rows": n_rows, "skipped": str(e)}))
+                continue
+            seconds = measure(encoder, args.repeat)
+            print(json.dumps({
+                "format": name,
+                "rows": n_rows,
+                "columns": args.columns,
+                "bytes": size,
+                "bytes_per_row": round(size / n_rows, 1),
+                "us_per_row": round(seconds * 1e6 / n_rows, 3),
+            }))
+
+if __name__ == "__main__":
+    main()
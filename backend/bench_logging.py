@@ -0,0 +1,109 @@
+"""
+Logging overhead benchmark: time spent inside the request path per request.
+
+    python bench_logging.py [--requests 20000]
+
+Each simulated request emits the two records /query/ask logs ("Generated SQL" and
+"Query Success") with their extras. Compares the old synchronous StreamHandler +
+json.dumps setup with the queue-based pipeline (with and without INFO sampling).
+Runs once against /dev/null and once against a slow sink that sleeps on every
+write, like a container log driver under load. One JSON object per line.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from datetime import datetime
+
+from logger import BatchingQueueListener, CustomJSONFormatter, DroppingQueueHandler, SamplingFilter
+
+class LegacyJSONFormatter(logging.Formatter):
+    # The formatter logger.py used before the queue pipeline
+    def format(self, record):
+        log_data = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "module": record.module,
+        }
+        if hasattr(record, "user_id"):
+            log_data["user_id"] = record.user_id
+        if hasattr(record, "query_duration"):
+            log_data["query_duration_ms"] = record.query_duration
+        if hasattr(record, "row_count"):
+            log_data["row_count"] = record.row_count
+        return json.dumps(log_data)
+
+class SlowSink:
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def write(self, data):
+        time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+def simulate(logger: logging.Logger, n_requests: int) -> float:
+    start = time.perf_counter()
+    for i in range(n_requests):
+        logger.info("Generated SQL", extra={"user_id": f"user_{i % 50}", "sql": "SELECT id, name FROM users LIMIT 100", "sql_cached": False})
+        logger.info("Query Success", extra={"user_id": f"user_{i % 50}", "query": "SELECT id, name FROM users LIMIT 100", "row_count": 100, "duration_ms": 12.5})
+    return time.perf_counter() - start
+
+def make_logger(name: str) -> logging.Logger:
+    logger = logging.getLogger(f"bench.{name}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.handlers.clear()
+    return logger
+
+def main():
+    parser = argparse.ArgumentParser(description="Logging overhead benchmark")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--slow-write-us", type=float, default=50)
+    args = parser.parse_args()
+
+    sinks = {
+        "devnull": open(os.devnull, "w"),
+        "slow_stdout": SlowSink(args.slow_write_us / 1e6),
+    }
+    for sink_name, sink in sinks.items():
+        run(sink_name, sink, args.requests)
+
+def run(sink_name: str, sink, n_requests: int):
+    legacy = make_logger("legacy")
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(LegacyJSONFormatter())
+    legacy.addHandler(handler)
+    results = {"sync_streamhandler": (simulate(legacy, n_requests), None)}
+
+    for name, rate in (("queue_pipeline", 1.0), ("queue_pipeline_sampled_10pct", 0.1)):
+        logger = make_logger(name)
+        log_queue = queue.Queue(maxsize=1_000_000)
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(rate))
+        logger.addHandler(queue_handler)
+        listener = BatchingQueueListener(log_queue, CustomJSONFormatter(), stream=sink)
+        listener.start()
+        elapsed = simulate(logger, n_requests)
+        drain_start = time.perf_counter()
+        listener.stop()
+        results[name] = (elapsed, time.perf_counter() - drain_start)
+
+    for name, (elapsed, drain) in results.items():
+        row = {
+            "sink": sink_name,
+            "pipeline": name,
+            "requests": n_requests,
+            "us_per_request": round(elapsed * 1e6 / n_requests, 2),
+        }
+        if drain is not None:
+            row["background_drain_s"] = round(drain, 3)
+        print(json.dumps(row))
+
+if __name__ == "__main__":
+    main()
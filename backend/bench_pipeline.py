@@ -0,0 +1,345 @@
+"""
+Offline end-to-end benchmark of the /query pipeline: the real FastAPI app, in-process.
+
+    python bench_pipeline.py [--tables 10 100 1000] [--concurrency 1 8 32]
+                             [--requests 400] [--llm-latency-ms 300]
+                             [--baseline previous.jsonl --max-regression 0.2]
+
+No Groq key or MySQL needed. `llm.generate_sql` is replaced by a deterministic
+stub that sleeps --llm-latency-ms, the database is a local SQLite file (through
+aiosqlite) seeded with a synthetic schema of N tables plus one large `events`
+table, and EXPLAIN FORMAT=JSON (MySQL only) is replaced by an EXPLAIN QUERY PLAN
+round trip that always passes. Everything else (auth, rate limiting, session
+decryption, schema cache, BM25 retrieval, SQL cache, SQLGuard, execution and
+result encoding) is the production code path. Needs `pip install httpx aiosqlite`.
+
+Prints one JSON object per line:
+  {"bench": "load", ...}   requests/s and p50/p95/p99 per stage (from the
+                           Server-Timing header) per schema size and concurrency
+  {"bench": "alloc", ...}  time and tracemalloc peak of get_schema_summary,
+                           SQLGuard.validate_query and result serialization
+With --baseline (a previous run's output), p95 latencies and requests/s are
+compared and the script exits with status 1 on a regression beyond
+--max-regression.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+# The rate limiter is not what is being measured
+os.environ.setdefault("RATE_LIMIT_PER_MINUTE", str(10**9))
+
+import httpx
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import app as askdb
+import db
+import pipeline
+import schema_cache as schema_cache_module
+from explain_guard import ExplainGuard, PlanVerdict, plan_cache
+from result_encoding import FORMATS, encode_result, UnsupportedFormatError
+from sql_guard import SQLGuard
+
+DATA_DIR = os.getenv("BENCH_DATA_DIR", "/tmp")
+COLUMNS = [("id", "INT", "PRI"), ("name", "VARCHAR(64)", ""), ("amount", "DECIMAL(10,2)", ""),
+           ("created_at", "DATETIME", ""), ("parent_id", "INT", "MUL")]
+SERVER_TIMING_RE = re.compile(r"([a-z_]+);dur=([0-9.]+)")
+
+def table_name(i: int) -> str:
+    return f"entity_{i:04d}"
+
+def synthetic_schema(n_tables: int, rows_per_table: int = 200, large_rows: int = 200_000) -> Dict[str, dict]:
+    """The load_schema() structure for N tables, each with a foreign key to its predecessor."""
+    indexes = [
+        {"name": "PRIMARY", "unique": True, "columns": ["id"]},
+        {"name": "parent_id", "unique": False, "columns": ["parent_id", "created_at"]},
+    ]
+    tables = {}
+    for i in range(n_tables):
+        tables[table_name(i)] = {
+            "comment": f"Synthetic entity number {i}",
+            "rows": rows_per_table,
+            "columns": [{"name": c, "type": t, "key": k, "comment": ""} for c, t, k in COLUMNS],
+            "indexes": indexes,
+            "foreign_keys": [{"column": "parent_id", "ref_table": table_name(i - 1), "ref_column": "id"}] if i else [],
+        }
+    tables["events"] = {
+        "comment": "Large append-only event log",
+        "rows": large_rows,
+        "columns": [{"name": c, "type": t, "key": k, "comment": ""} for c, t, k in COLUMNS],
+        "indexes": indexes,
+        "foreign_keys": [{"column": "parent_id", "ref_table": table_name(0), "ref_column": "id"}],
+    }
+    return tables
+
+def seed_database(path: str, n_tables: int, rows_per_table: int, large_rows: int):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    rng = random.Random(n_tables)
+    for name in [table_name(i) for i in range(n_tables)] + ["events"]:
+        n_rows = large_rows if name == "events" else rows_per_table
+        conn.execute(
+            f"CREATE TABLE {name} (id INTEGER PRIMARY KEY, name TEXT, amount NUMERIC,"
+            " created_at TEXT, parent_id INTEGER)"
+        )
+        conn.executemany(
+            f"INSERT INTO {name} VALUES (?, ?, ?, ?, ?)",
+            (
+                (i, f"{name}_{i}", round(rng.random() * 1000, 2), f"2024-01-{1 + i % 28:02d} 12:00:00", i // 2)
+                for i in range(n_rows)
+            ),
+        )
+    conn.commit()
+    conn.close()
+
+def make_questions(n_tables: int, pool_size: int, salt: str = "") -> List[str]:
+    rng = random.Random(pool_size)
+    questions = []
+    for i in range(pool_size):
+        table = "events" if i % 5 == 0 else table_name(rng.randrange(n_tables))
+        questions.append(f"show the {table} rows with amount above {rng.randint(0, 900)} question {salt}{i}")
+    return questions
+
+def install_stubs(engines: Dict[str, object], tables_by_db: Dict[str, dict], llm_latency: float):
+    question_re = re.compile(r"show the (\w+) rows with amount above (\d+)")
+
+    async def stub_generate_sql(schema: str, question: str) -> str:
+        await asyncio.sleep(llm_latency)
+        match = question_re.search(question)
+        if not match:
+            return "INVALID_QUERY"
+        table, amount = match.groups()
+        return f"SELECT id, name, amount, created_at FROM {table} WHERE amount > {amount} ORDER BY id"
+
+    async def stub_evaluate(creds, query, conn=None) -> PlanVerdict:
+        key = f"{db.connection_fingerprint(creds)}:{query}"
+        cached = plan_cache.get(key)
+        if cached is not None:
+            return cached.model_copy(update={"cached": True})
+        (await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {query}")).fetchall()
+        verdict = PlanVerdict(is_safe=True)
+        plan_cache.set(key, verdict)
+        return verdict
+
+    pipeline.generate_sql = stub_generate_sql
+    pipeline.get_async_engine_for_creds = lambda creds: engines[creds.database]
+    ExplainGuard.evaluate = staticmethod(stub_evaluate)
+    schema_cache_module.load_schema = lambda creds: tables_by_db[creds.database]
+    db.load_schema = schema_cache_module.load_schema
+    schema_cache_module.get_schema_checksum = lambda creds: f"{creds.database}:{len(tables_by_db[creds.database])}"
+
+    # Request logs would interleave with the JSON output
+    askdb.app_logger.listener.stream = open(os.devnull, "w")
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+async def run_load(client: httpx.AsyncClient, db_token: str, jwt: str, questions: List[str],
+                   n_requests: int, concurrency: int) -> Tuple[float, Dict[str, List[float]], int]:
+    stages: Dict[str, List[float]] = {"client_total": []}
+    errors = 0
+    counter = iter(range(n_requests))
+    headers = {"Authorization": f"Bearer {jwt}"}
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            response = await client.post(
+                "/query/ask",
+                json={"db_token": db_token, "prompt": questions[i % len(questions)]},
+                headers=headers,
+            )
+            stages["client_total"].append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+                continue
+            for stage, duration in SERVER_TIMING_RE.findall(response.headers.get("server-timing", "")):
+                stages.setdefault(stage, []).append(float(duration))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, stages, errors
+
+async def bench_load(args) -> List[dict]:
+    results = []
+    engines, tables_by_db = {}, {}
+    for n_tables in args.tables:
+        name = f"bench_{n_tables}"
+        path = os.path.join(DATA_DIR, f"askdb_{name}.sqlite3")
+        seed_database(path, n_tables, args.rows_per_table, args.large_rows)
+        engines[name] = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        tables_by_db[name] = synthetic_schema(n_tables, args.rows_per_table, args.large_rows)
+    install_stubs(engines, tables_by_db, args.llm_latency_ms / 1000)
+
+    jwt = askdb.create_access_token({"sub": "bench"})
+    transport = httpx.ASGITransport(app=askdb.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for n_tables in args.tables:
+            name = f"bench_{n_tables}"
+            db_token = askdb.encrypt_data({"host": "bench", "port": 3306, "user": "bench", "password": "bench", "database": name})
+            for concurrency in args.concurrency:
+                # Fresh questions per level, so each one starts with a cold SQL cache
+                questions = make_questions(n_tables, args.prompt_pool, salt=f"c{concurrency}")
+                elapsed, stages, errors = await run_load(client, db_token, jwt, questions, args.requests, concurrency)
+                row = {
+                    "bench": "load",
+                    "tables": n_tables,
+                    "concurrency": concurrency,
+                    "requests": args.requests,
+                    "errors": errors,
+                    "rps": round(args.requests / elapsed, 1),
+                    "stages": {stage: dict(percentiles(values), n=len(values)) for stage, values in stages.items()},
+                }
+                results.append(row)
+                print(json.dumps(row), flush=True)
+    for engine in engines.values():
+        await engine.dispose()
+    return results
+
+def measure_allocations(fn, repeat: int) -> dict:
+    """Timing without tracing, then one traced call for its peak and retained memory."""
+    fn()  # warm-up: imports, regex compilation
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    baseline, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    top = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")[:3]
+    return {
+        "us_per_call": round(elapsed * 1e6 / repeat, 1),
+        "peak_kib_per_call": round((peak - baseline) / 1024, 1),
+        "top_allocations": [
+            {"where": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}", "kib": round(s.size_diff / 1024, 1)}
+            for s in top if s.size_diff > 0
+        ],
+    }
+
+def bench_allocations(args) -> List[dict]:
+    results = []
+    creds = db.DBConnection(host="bench", port=3306, user="bench", password="bench", database="alloc")
+    for n_tables in args.tables:
+        tables = synthetic_schema(n_tables, args.rows_per_table, args.large_rows)
+        db.load_schema = lambda creds, tables=tables: tables
+        results.append(dict(
+            {"bench": "alloc", "target": "get_schema_summary", "tables": n_tables},
+            **measure_allocations(lambda: db.get_schema_summary(creds), args.alloc_repeat),
+        ))
+
+    sql = "SELECT id, name, amount, created_at FROM entity_0001 WHERE amount > 10 AND name LIKE 'a%' ORDER BY id"
+    results.append(dict(
+        {"bench": "alloc", "target": "SQLGuard.validate_query", "cache": "cold"},
+        # _check is the uncached validator behind the lru_cache
+        **measure_allocations(lambda: SQLGuard._check(sql, 100), args.alloc_repeat),
+    ))
+    results.append(dict(
+        {"bench": "alloc", "target": "SQLGuard.validate_query", "cache": "warm"},
+        **measure_allocations(lambda: SQLGuard.validate_query(sql, 100), args.alloc_repeat),
+    ))
+
+    rng = random.Random(7)
+    column_names = [c for c, _, _ in COLUMNS]
+    rows = [(i, f"name_{i}", round(rng.random() * 1000, 2), "2024-01-01 12:00:00", i // 2) for i in range(1000)]
+    meta = {"sql": sql, "execution_time_ms": 1.0}
+    for fmt in FORMATS:
+        try:
+            encode_result(fmt, meta, column_names, rows)
+        except UnsupportedFormatError as e:
+            results.append({"bench": "alloc", "target": f"encode_result[{fmt}]", "skipped": str(e)})
+            continue
+        results.append(dict(
+            {"bench": "alloc", "target": f"encode_result[{fmt}]", "rows": len(rows)},
+            **measure_allocations(lambda fmt=fmt: encode_result(fmt, meta, column_names, rows), args.alloc_repeat),
+        ))
+
+    for row in results:
+        print(json.dumps(row), flush=True)
+    return results
+
+def result_key(row: dict) -> Tuple:
+    return tuple((k, row.get(k)) for k in ("bench", "target", "tables", "concurrency", "cache", "rows"))
+
+def compare_to_baseline(results: List[dict], baseline_path: str, max_regression: float) -> List[dict]:
+    with open(baseline_path) as f:
+        baseline = {result_key(row): row for row in map(json.loads, filter(str.strip, f))}
+
+    regressions = []
+    for row in results:
+        old = baseline.get(result_key(row))
+        if old is None:
+            continue
+        checks = []
+        if row["bench"] == "load":
+            checks.append(("rps", old["rps"], row["rps"], True))
+            for stage, values in row["stages"].items():
+                if "p95_ms" in values and "p95_ms" in old["stages"].get(stage, {}):
+                    checks.append((f"{stage}.p95_ms", old["stages"][stage]["p95_ms"], values["p95_ms"], False))
+        elif "us_per_call" in row and "us_per_call" in old:
+            checks.append(("us_per_call", old["us_per_call"], row["us_per_call"], False))
+            checks.append(("peak_kib_per_call", old["peak_kib_per_call"], row["peak_kib_per_call"], False))
+
+        for metric, before, after, higher_is_better in checks:
+            # Sub-millisecond stages are too noisy to gate on relative change alone
+            if not higher_is_better and after - before < 0.5:
+                continue
+            change = (before - after) / before if higher_is_better else (after - before) / max(before, 1e-9)
+            if change > max_regression:
+                regressions.append({
+                    "bench": "regression", "key": dict(result_key(row)), "metric": metric,
+                    "baseline": before, "current": after, "change": round(change, 3),
+                })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tables", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=400, help="requests per concurrency level")
+    parser.add_argument("--prompt-pool", type=int, default=100, help="distinct questions (repeats hit the SQL cache)")
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--rows-per-table", type=int, default=200)
+    parser.add_argument("--large-rows", type=int, default=200_000, help="rows in the large `events` table")
+    parser.add_argument("--alloc-repeat", type=int, default=200)
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--baseline", help="previous output (JSON lines) to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+    if not args.skip_load:
+        results += asyncio.run(bench_load(args))
+    results += bench_allocations(args)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.max_regression)
+        for row in regressions:
+            print(json.dumps(row), flush=True)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+SQLGuard microbenchmark and correctness corpus.
+
+    python bench_sql_guard.py [--iterations 2000]
+
+Runs a corpus of tricky statements through the legacy sqlparse/regex validator and
+the current tokenizer-based SQLGuard, printing one JSON object per line: the
+per-case verdicts (and whether each matches the expected outcome) followed by
+timing summaries (cold = memo cache cleared, warm = repeated statements).
+"""
+import argparse
+import json
+import re
+import time
+
+import sqlparse
+
+from sql_guard import SQLGuard
+
+# (name, sql, expected) where expected is the clean SQL or "reject"
+CORPUS = [
+    ("plain", "SELECT id, name FROM users", "SELECT id, name FROM users LIMIT 100"),
+    ("trailing_semicolon", "SELECT id FROM users;", "SELECT id FROM users LIMIT 100"),
+    ("limit_under_cap", "SELECT id FROM users LIMIT 10", "SELECT id FROM users LIMIT 10"),
+    ("limit_over_cap", "SELECT id FROM users LIMIT 5000", "SELECT id FROM users LIMIT 100"),
+    ("limit_offset_comma", "SELECT id FROM users LIMIT 0, 100000", "SELECT id FROM users LIMIT 0, 100"),
+    ("limit_offset_keyword", "SELECT id FROM users LIMIT 500 OFFSET 20", "SELECT id FROM users LIMIT 100 OFFSET 20"),
+    ("subquery_limit_only",
+     "SELECT id FROM (SELECT id FROM users ORDER BY id LIMIT 1000) AS u",
+     "SELECT id FROM (SELECT id FROM users ORDER BY id LIMIT 1000) AS u LIMIT 100"),
+    ("subquery_and_outer_limit",
+     "SELECT id FROM users WHERE id IN (SELECT user_id FROM orders LIMIT 3) LIMIT 50",
+     "SELECT id FROM users WHERE id IN (SELECT user_id FROM orders LIMIT 3) LIMIT 50"),
+    ("keyword_in_string", "SELECT id FROM logs WHERE message = 'DROP TABLE users'",
+     "SELECT id FROM logs WHERE message = 'DROP TABLE users' LIMIT 100"),
+    ("keyword_in_quoted_identifier", "SELECT `update` FROM audit",
+     "SELECT `update` FROM audit LIMIT 100"),
+    ("keyword_substring_column", "SELECT update_date FROM audit",
+     "SELECT update_date FROM audit LIMIT 100"),
+    ("escaped_quote", "SELECT id FROM t WHERE note = 'it''s; DROP TABLE t'",
+     "SELECT id FROM t WHERE note = 'it''s; DROP TABLE t' LIMIT 100"),
+    ("trailing_line_comment", "SELECT id FROM users -- newest first",
+     "SELECT id FROM users LIMIT 100"),
+    ("cte", "WITH recent AS (SELECT id FROM users) SELECT id FROM recent",
+     "WITH recent AS (SELECT id FROM users) SELECT id FROM recent LIMIT 100"),
+    ("stacked_statements", "SELECT 1; DROP TABLE users", "reject"),
+    ("delete", "DELETE FROM users", "reject"),
+    ("select_for_update", "SELECT id FROM users FOR UPDATE", "reject"),
+    ("show", "SHOW TABLES", "reject"),
+    ("executable_comment", "SELECT id FROM users /*!50000 UNION SELECT password FROM admins */", "reject"),
+    ("unterminated_string", "SELECT id FROM users WHERE name = 'bob", "reject"),
+    ("empty", "   ", "reject"),
+]
+
+def legacy_validate_query(sql: str) -> str:
+    # The sqlparse + per-keyword regex implementation SQLGuard replaced
+    if not sql or not sql.strip():
+        raise ValueError("Empty SQL query")
+    parsed = sqlparse.parse(sql)
+    if len(parsed) > 1:
+        raise ValueError("Multiple SQL statements are not allowed")
+    statement = parsed[0]
+    if statement.get_type().upper() != 'SELECT':
+        raise ValueError(f"Only SELECT queries are allowed. Found: {statement.get_type()}")
+    normalized_sql = sql.upper()
+    for keyword in SQLGuard.FORBIDDEN_KEYWORDS:
+        if re.search(r'\b' + keyword + r'\b', normalized_sql):
+            raise ValueError(f"Forbidden keyword detected: {keyword}")
+    clean_sql = sql.strip().rstrip(';')
+    limit_match = re.search(r'\bLIMIT\s+(\d+)', clean_sql, re.IGNORECASE)
+    if limit_match:
+        if int(limit_match.group(1)) > 100:
+            clean_sql = re.sub(r'\bLIMIT\s+\d+', 'LIMIT 100', clean_sql, flags=re.IGNORECASE)
+    else:
+        clean_sql += " LIMIT 100"
+    return clean_sql
+
+def verdict(validator, sql: str) -> str:
+    try:
+        return validator(sql)
+    except ValueError:
+        return "reject"
+
+def time_per_call(validator, iterations: int, clear=None) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        if clear:
+            clear()
+        for _, sql, _ in CORPUS:
+            verdict(validator, sql)
+    return (time.perf_counter() - start) * 1e6 / (iterations * len(CORPUS))
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLGuard microbenchmark")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    correct = {"legacy": 0, "current": 0}
+    for name, sql, expected in CORPUS:
+        legacy = verdict(legacy_validate_query, sql)
+        current = verdict(SQLGuard.validate_query, sql)
+        correct["legacy"] += legacy == expected
+        correct["current"] += current == expected
+        print(json.dumps({
+            "case": name,
+            "expected": expected,
+            "legacy": legacy,
+            "current": current,
+            "legacy_ok": legacy == expected,
+            "current_ok": current == expected,
+        }))
+
+    results = {
+        "legacy": time_per_call(legacy_validate_query, args.iterations),
+        "current_cold": time_per_call(SQLGuard.validate_query, args.iterations, clear=SQLGuard._validate.cache_clear),
+        "current_warm": time_per_call(SQLGuard.validate_query, args.iterations),
+    }
+    for name, us in results.items():
+        implementation = "legacy" if name == "legacy" else "current"
+        print(json.dumps({
+            "summary": name,
+            "us_per_query": round(us, 2),
+            "correct": correct[implementation],
+            "cases": len(CORPUS),
+        }))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Cold-start benchmark: how long a fresh process takes to import the app and to
+answer its first request.
+
+    python bench_startup.py [--runs 5] [--top 15]
+                            [--baseline previous.jsonl --max-regression 0.2]
+
+Every measurement runs in a new interpreter, so nothing is already imported.
+Prints one JSON object per line:
+  {"bench": "import", ...}         median/max wall time of `import app`
+  {"bench": "importtime", ...}     the slowest modules by cumulative import time
+                                   (python -X importtime, one run)
+  {"bench": "first_request", ...}  uvicorn spawn until GET / returns 200
+With --baseline (a previous run's output), the medians are compared and the
+script exits with status 1 on a regression beyond --max-regression.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# Cold start is what is being measured, not the warm-up that follows it
+ENV = dict(os.environ, WARMUP_ON_STARTUP="false")
+
+def time_import() -> float:
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, env=ENV, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1]) * 1000
+
+def import_profile(top: int) -> List[Dict]:
+    """Top-level modules by cumulative import time (microseconds -> ms)."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"], cwd=BACKEND_DIR, env=ENV, capture_output=True, text=True, check=True)
+    modules = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, raw_name = line.split("|")
+        # Nesting is shown as two spaces per level; keep `app` and what it imports directly
+        depth = (len(raw_name) - len(raw_name.lstrip()) - 1) // 2
+        if depth <= 1:
+            modules.append({"module": raw_name.strip(), "cumulative_ms": round(int(cumulative) / 1000, 1)})
+    modules.sort(key=lambda m: m["cumulative_ms"], reverse=True)
+    return modules[:top]
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def time_first_request(timeout: float = 30) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return (time.perf_counter() - start) * 1000
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"server did not answer within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def summarize(bench: str, samples: List[float]) -> Dict:
+    return {"bench": bench, "runs": len(samples), "median_ms": round(statistics.median(samples), 1), "max_ms": round(max(samples), 1)}
+
+def compare_to_baseline(results: List[dict], baseline_path: str, max_regression: float) -> List[dict]:
+    with open(baseline_path) as f:
+        baseline = {row["bench"]: row for row in map(json.loads, filter(str.strip, f))}
+
+    regressions = []
+    for row in results:
+        old = baseline.get(row["bench"])
+        if old is None or "median_ms" not in row or "median_ms" not in old:
+            continue
+        change = (row["median_ms"] - old["median_ms"]) / max(old["median_ms"], 1e-9)
+        if change > max_regression:
+            regressions.append({
+                "bench": "regression", "key": row["bench"], "metric": "median_ms",
+                "baseline": old["median_ms"], "current": row["median_ms"], "change": round(change, 3),
+            })
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="modules to list from -X importtime")
+    parser.add_argument("--baseline", help="previous output (JSON lines) to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = [
+        summarize("import", [time_import() for _ in range(args.runs)]),
+        {"bench": "importtime", "modules": import_profile(args.top)},
+        summarize("first_request", [time_first_request() for _ in range(args.runs)]),
+    ]
+    for row in results:
+        print(json.dumps(row), flush=True)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.max_regression)
+        for row in regressions:
+            print(json.dumps(row), flush=True)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
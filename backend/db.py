@@ -1,12 +1,21 @@
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import BaseModel
-from typing import Optional
-import mysql.connector
+from typing import Optional, Dict, Any, List, Tuple
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import ssl
+import threading
+import time
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+import settings
+
+class ReplicaEndpoint(BaseModel):
+    host: str
+    port: int = 3306
 
 class DBConnection(BaseModel):
     host: str
@@ -15,6 +24,8 @@ class DBConnection(BaseModel):
     password: str
     database: str
     ssl_mode: Optional[str] = "REQUIRED"
+    # Read replicas sharing the primary's user, password and database (see replicas.py)
+    replicas: List[ReplicaEndpoint] = []
 
 def init_ssl_ca():
     """Ensures ca.pem exists if provided via env var"""
@@ -38,11 +49,30 @@ def get_db_url(creds: DBConnection) -> str:
             url += f"?ssl_ca={ca_path}"
     return url
 
+def get_async_db_url(creds: DBConnection) -> Tuple[str, Dict[str, Any]]:
+    """
+    URL and connect_args for the aiomysql driver. aiomysql expects an SSLContext
+    rather than the ssl_ca query parameter understood by PyMySQL.
+    """
+    user = quote_plus(creds.user.strip())
+    password = quote_plus(creds.password.strip())
+    host = creds.host.strip()
+    url = f"mysql+aiomysql://{user}:{password}@{host}:{creds.port}/{creds.database.strip()}"
+    connect_args = {}
+    if creds.ssl_mode == "REQUIRED":
+        ca_path = init_ssl_ca()
+        if ca_path:
+            connect_args["ssl"] = ssl.create_default_context(cafile=ca_path)
+    return url, connect_args
+
 def get_direct_mysql_connection():
     """
     Returns a raw mysql-connector connection using environment variables.
     As requested by the user.
     """
+    # Rarely used, so mysql-connector is only imported here
+    import mysql.connector
+
     try:
         ca_path = init_ssl_ca()
         conn = mysql.connector.connect(
@@ -59,12 +89,195 @@ def get_direct_mysql_connection():
         print(f"Error connecting to MySQL: {e}")
         return None
 
-def get_engine_for_creds(creds: DBConnection):
-    try:
+def connection_fingerprint(creds: DBConnection) -> str:
+    """
+    Stable digest of the connection fields, used as the engine registry key.
+    Replicas are left out: caches keyed by it belong to the logical database.
+    """
+    payload = "\x1f".join([
+        creds.host.strip(),
+        str(creds.port),
+        creds.user.strip(),
+        creds.password.strip(),
+        creds.database.strip(),
+        str(creds.ssl_mode),
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def target_key(creds: DBConnection) -> str:
+    """Human readable target name ("host:port/database") used for pool overrides."""
+    return f"{creds.host.strip()}:{creds.port}/{creds.database.strip()}"
+
+class EngineRegistry:
+    """
+    Process-wide cache of SQLAlchemy engines keyed by connection fingerprint.
+    Each entry holds a sync engine and, on first use, an asyncio engine for the same
+    target. Keeps at most `max_engines` targets alive (LRU) and disposes pools that
+    have been idle for longer than `idle_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        max_engines: int = 32,
+        idle_ttl: float = 900,
+        pool_size: int = 5,
+        max_overflow: int = 5,
+        pool_overrides: Optional[Dict[str, Dict[str, int]]] = None,
+    ):
+        self.max_engines = max_engines
+        self.idle_ttl = idle_ttl
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        # {"host:port/database": {"pool_size": 10, "max_overflow": 20}}
+        self.pool_overrides = pool_overrides or {}
+        self._engines = OrderedDict()  # {fingerprint: {"engine", "async_engine", "last_used"}}
+        self._lock = threading.Lock()
+        self._dispose_tasks = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_pool_limits(self, target: str, pool_size: int, max_overflow: int):
+        """Overrides pool sizing for one target database ("host:port/database")."""
+        with self._lock:
+            self.pool_overrides[target] = {"pool_size": pool_size, "max_overflow": max_overflow}
+
+    def _pool_limits(self, creds: DBConnection) -> Dict[str, int]:
+        override = self.pool_overrides.get(target_key(creds), {})
+        return {
+            "pool_size": int(override.get("pool_size", self.pool_size)),
+            "max_overflow": int(override.get("max_overflow", self.max_overflow)),
+        }
+
+    def _create_engine(self, creds: DBConnection):
         url = get_db_url(creds)
         # Pool recycle 3600 to avoid stale connections
-        engine = create_engine(url, pool_recycle=3600, pool_pre_ping=True)
-        return engine
+        return create_engine(
+            url,
+            pool_recycle=3600,
+            pool_pre_ping=True,
+            **self._pool_limits(creds),
+        )
+
+    def _create_async_engine(self, creds: DBConnection):
+        # Imported on first use: sqlalchemy.ext.asyncio pulls in the ORM
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        url, connect_args = get_async_db_url(creds)
+        return create_async_engine(
+            url,
+            pool_recycle=3600,
+            pool_pre_ping=True,
+            connect_args=connect_args,
+            **self._pool_limits(creds),
+        )
+
+    def _dispose(self, entry: Dict[str, Any]):
+        entry["engine"].dispose()
+        async_engine = entry.get("async_engine")
+        if async_engine is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No loop in this thread: drop the pool without awaiting connection close
+            async_engine.sync_engine.dispose(close=False)
+            return
+        task = loop.create_task(async_engine.dispose())
+        self._dispose_tasks.add(task)
+        task.add_done_callback(self._dispose_tasks.discard)
+
+    def _evict_idle(self, now: float):
+        expired = [
+            key for key, entry in self._engines.items()
+            if now - entry["last_used"] > self.idle_ttl
+        ]
+        for key in expired:
+            self._dispose(self._engines.pop(key))
+            self.evictions += 1
+
+    def _entry(self, creds: DBConnection) -> Dict[str, Any]:
+        """Returns the (possibly new) registry entry for `creds`. Caller holds the lock."""
+        key = connection_fingerprint(creds)
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        entry = self._engines.get(key)
+        if entry is not None:
+            entry["last_used"] = now
+            self._engines.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = {"engine": self._create_engine(creds), "async_engine": None, "last_used": now}
+        self._engines[key] = entry
+
+        while len(self._engines) > self.max_engines:
+            _, old_entry = self._engines.popitem(last=False)
+            self._dispose(old_entry)
+            self.evictions += 1
+
+        return entry
+
+    def get(self, creds: DBConnection):
+        with self._lock:
+            return self._entry(creds)["engine"]
+
+    def get_async(self, creds: DBConnection):
+        with self._lock:
+            entry = self._entry(creds)
+            if entry["async_engine"] is None:
+                entry["async_engine"] = self._create_async_engine(creds)
+            return entry["async_engine"]
+
+    def dispose_all(self):
+        with self._lock:
+            for entry in self._engines.values():
+                self._dispose(entry)
+            self._engines.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pools = []
+            for entry in self._engines.values():
+                engine = entry["engine"]
+                pool_stats = {
+                    "target": f"{engine.url.host}:{engine.url.port}/{engine.url.database}",
+                    "size": engine.pool.size(),
+                    "checked_out": engine.pool.checkedout(),
+                    "overflow": engine.pool.overflow(),
+                    "idle_seconds": round(time.monotonic() - entry["last_used"], 1),
+                }
+                if entry["async_engine"] is not None:
+                    pool_stats["async_checked_out"] = entry["async_engine"].pool.checkedout()
+                pools.append(pool_stats)
+            return {
+                "engines": len(self._engines),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pools": pools,
+            }
+
+# Global instance
+engine_registry = EngineRegistry(
+    max_engines=int(os.getenv("DB_ENGINE_CACHE_SIZE", 32)),
+    idle_ttl=float(os.getenv("DB_ENGINE_IDLE_TTL", 900)),
+    pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 5)),
+    pool_overrides=json.loads(os.getenv("DB_POOL_OVERRIDES", "{}")),
+)
+
+def get_engine_for_creds(creds: DBConnection):
+    try:
+        return engine_registry.get(creds)
+    except Exception as e:
+        raise ValueError(f"Failed to create engine: {str(e)}")
+
+def get_async_engine_for_creds(creds: DBConnection):
+    try:
+        return engine_registry.get_async(creds)
     except Exception as e:
         raise ValueError(f"Failed to create engine: {str(e)}")
 
@@ -77,19 +290,160 @@ def test_connection(creds: DBConnection) -> bool:
     except Exception as e:
         raise ValueError(f"Connection failed: {str(e)}")
 
-def get_schema_summary(creds: DBConnection) -> str:
-    """Returns a simplified schema string for the LLM"""
+# TABLE_ROWS is the storage engine's estimate (InnoDB samples it), which is
+# all the prompt needs to tell small tables from large ones
+SCHEMA_TABLES_SQL = text("""
+    SELECT TABLE_NAME, TABLE_COMMENT, TABLE_ROWS
+    FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = :db AND TABLE_TYPE = 'BASE TABLE'
+    ORDER BY TABLE_NAME
+""")
+
+SCHEMA_COLUMNS_SQL = text("""
+    SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.COLUMN_KEY, c.COLUMN_COMMENT
+    FROM information_schema.COLUMNS c
+    JOIN information_schema.TABLES t
+      ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+    WHERE c.TABLE_SCHEMA = :db AND t.TABLE_TYPE = 'BASE TABLE'
+    ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+""")
+
+SCHEMA_FOREIGN_KEYS_SQL = text("""
+    SELECT TABLE_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+    FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = :db AND REFERENCED_TABLE_NAME IS NOT NULL
+    ORDER BY TABLE_NAME, ORDINAL_POSITION
+""")
+
+SCHEMA_INDEXES_SQL = text("""
+    SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME
+    FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = :db
+    ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+""")
+
+# Cheap change detector: table count, newest CREATE_TIME (bumped by most ALTERs),
+# total column count (catches instant ADD/DROP COLUMN) and index column count
+# (in-place ADD/DROP INDEX leaves CREATE_TIME alone).
+SCHEMA_CHECKSUM_SQL = text("""
+    SELECT
+        COUNT(*),
+        MAX(CREATE_TIME),
+        (SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = :db),
+        (SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = :db)
+    FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = :db
+""")
+
+# UPDATE_TIME is NULL for tables not modified since the server started (InnoDB)
+TABLE_UPDATE_TIMES_SQL = text("""
+    SELECT TABLE_NAME, UPDATE_TIME
+    FROM information_schema.TABLES
+    WHERE TABLE_SCHEMA = :db AND TABLE_NAME IN :tables
+""").bindparams(bindparam("tables", expanding=True))
+
+def load_schema(creds: DBConnection) -> Dict[str, Dict[str, Any]]:
+    """
+    Loads tables, columns, indexes and foreign keys with bulk information_schema queries.
+    Returns {table_name: {"comment": str, "rows": int (estimate),
+                          "columns": [{"name", "type", "key", "comment"}],
+                          "indexes": [{"name", "unique", "columns"}],
+                          "foreign_keys": [{"column", "ref_table", "ref_column"}]}}
+    Index columns are in index order; the primary key is the index named PRIMARY.
+    """
     engine = get_engine_for_creds(creds)
-    inspector = inspect(engine)
-    
-    schema_str = ""
-    
-    for table_name in inspector.get_table_names():
-        schema_str += f"Table: {table_name}\nColumns:\n"
-        columns = inspector.get_columns(table_name)
-        for col in columns:
-            col_info = f" - {col['name']} ({col['type']})"
-            schema_str += f"{col_info}\n"
-        schema_str += "\n"
-        
-    return schema_str
+    database = creds.database.strip()
+
+    tables: Dict[str, Dict[str, Any]] = {}
+    with engine.connect() as conn:
+        for table_name, comment, rows in conn.execute(SCHEMA_TABLES_SQL, {"db": database}):
+            tables[table_name] = {
+                "comment": comment or "",
+                "rows": int(rows or 0),
+                "columns": [],
+                "indexes": [],
+                "foreign_keys": [],
+            }
+
+        for table_name, name, col_type, key, comment in conn.execute(SCHEMA_COLUMNS_SQL, {"db": database}):
+            if table_name in tables:
+                tables[table_name]["columns"].append({
+                    "name": name,
+                    "type": str(col_type).upper(),
+                    "key": key or "",
+                    "comment": comment or "",
+                })
+
+        indexes: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for table_name, index_name, non_unique, column in conn.execute(SCHEMA_INDEXES_SQL, {"db": database}):
+            if table_name not in tables or column is None:
+                continue  # functional key parts have no column
+            index = indexes.get((table_name, index_name))
+            if index is None:
+                index = indexes[(table_name, index_name)] = {"name": index_name, "unique": not int(non_unique), "columns": []}
+                tables[table_name]["indexes"].append(index)
+            index["columns"].append(column)
+
+        for table_name, column, ref_table, ref_column in conn.execute(SCHEMA_FOREIGN_KEYS_SQL, {"db": database}):
+            if table_name in tables:
+                tables[table_name]["foreign_keys"].append({
+                    "column": column,
+                    "ref_table": ref_table,
+                    "ref_column": ref_column,
+                })
+
+    return tables
+
+def get_schema_checksum(creds: DBConnection) -> str:
+    """Returns a short digest that changes when tables or columns are added, dropped or altered."""
+    engine = get_engine_for_creds(creds)
+    with engine.connect() as conn:
+        row = conn.execute(SCHEMA_CHECKSUM_SQL, {"db": creds.database.strip()}).one()
+    return hashlib.sha256(repr(tuple(row)).encode("utf-8")).hexdigest()[:16]
+
+def approximate_rows(rows: int) -> str:
+    """Row estimate rounded to one significant figure ("~3M"), so small drifts don't change the prompt."""
+    rounded = int(float(f"{rows:.1g}"))
+    for scale, suffix in ((10**9, "B"), (10**6, "M"), (10**3, "K")):
+        if rounded >= scale:
+            return f"~{rounded // scale}{suffix}"
+    return f"~{rounded}"
+
+def format_schema_summary(tables: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Renders the schema in the plain-text layout used by the LLM prompt:
+    approximate row counts, and per column PK / UNIQUE / IDX (first column of an
+    index, so usable for lookups) and foreign key tags. Multi-column indexes are
+    listed after the columns.
+    """
+    lines = []
+    for table_name, table in tables.items():
+        indexes = table.get("indexes", [])
+        leading = {index["columns"][0] for index in indexes}
+        single = {
+            index["columns"][0]: "PK" if index["name"] == "PRIMARY" else "UNIQUE" if index["unique"] else "IDX"
+            for index in indexes
+            if len(index["columns"]) == 1
+        }
+        references = {fk["column"]: f"-> {fk['ref_table']}.{fk['ref_column']}" for fk in table.get("foreign_keys", [])}
+
+        rows = f" ({approximate_rows(table['rows'])} rows)" if "rows" in table else ""
+        lines.append(f"Table: {table_name}{rows}")
+        lines.append("Columns:")
+        for col in table["columns"]:
+            tags = [single.get(col["name"]) or ("IDX" if col["name"] in leading else None), references.get(col["name"])]
+            tags = " ".join(tag for tag in tags if tag)
+            lines.append(f" - {col['name']} ({col['type']})" + (f" {tags}" if tags else ""))
+        composite = [
+            ("PK " if index["name"] == "PRIMARY" else "UNIQUE " if index["unique"] else "") + f"({', '.join(index['columns'])})"
+            for index in indexes
+            if len(index["columns"]) > 1
+        ]
+        if composite:
+            lines.append(f"Indexes: {'; '.join(composite)}")
+        lines.append("")
+    return "\n".join(lines) + "\n" if lines else ""
+
+def get_schema_summary(creds: DBConnection) -> str:
+    """Returns a simplified schema string for the LLM (uncached, see schema_cache)"""
+    return format_schema_summary(load_schema(creds))
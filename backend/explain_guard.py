@@ -1,21 +1,215 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Tuple, Optional, List, Dict, Any
+
+from pydantic import BaseModel
 from sqlalchemy import text
-from typing import Tuple, Optional
-from db import get_engine_for_creds, DBConnection
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncConnection
+
+from db import get_async_engine_for_creds, DBConnection, connection_fingerprint
+from replicas import replica_router
+from sql_guard import uses_aggregates
+
+# Plan policy. Actions are "reject", "warn" or "ignore".
+MAX_ROWS_EXAMINED = int(os.getenv("EXPLAIN_MAX_ROWS_EXAMINED", 50_000_000))
+FULL_SCAN_ROWS = int(os.getenv("EXPLAIN_FULL_SCAN_ROWS", 1_000_000))
+FULL_SCAN_ACTION = os.getenv("EXPLAIN_FULL_SCAN_ACTION", "reject")
+FILESORT_ACTION = os.getenv("EXPLAIN_FILESORT_ACTION", "warn")
+TEMPORARY_ACTION = os.getenv("EXPLAIN_TEMPORARY_ACTION", "warn")
+
+class PlanVerdict(BaseModel):
+    is_safe: bool
+    error: Optional[str] = None
+    warnings: List[str] = []
+    rows_examined: int = 0
+    # "table:access_type:key" per table in plan order, to tell whether two plans differ
+    access: List[str] = []
+    cached: bool = False
+
+class PlanVerdictCache:
+    """LRU of plan verdicts keyed by database fingerprint + SQL, with a TTL."""
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {key: (verdict, expires_at)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[PlanVerdict]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and cached[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            if cached:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, verdict: PlanVerdict):
+        with self._lock:
+            self._entries[key] = (verdict, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+# Global instance
+plan_cache = PlanVerdictCache(
+    max_entries=int(os.getenv("EXPLAIN_CACHE_SIZE", 2048)),
+    ttl=float(os.getenv("EXPLAIN_CACHE_TTL", 300)),
+)
+
+def _walk(node: Any, visit):
+    if isinstance(node, dict):
+        visit(node)
+        for value in node.values():
+            _walk(value, visit)
+    elif isinstance(node, list):
+        for value in node:
+            _walk(value, visit)
+
+def _num(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
 
 class ExplainGuard:
     @staticmethod
-    def check_query_safety(creds: DBConnection, query: str) -> Tuple[bool, Optional[str]]:
+    def analyze_plan(plan: Dict[str, Any], sql: Optional[str] = None) -> PlanVerdict:
         """
-        Runs EXPLAIN on the query.
-        Returns (is_safe, error_message).
+        Applies the plan policy to MySQL `EXPLAIN FORMAT=JSON` output of `sql`.
+        Rows examined are estimated per nested loop as
+        sum(rows produced so far * rows examined per scan).
+        """
+        tables: List[Dict[str, Any]] = []
+        flags = {"filesort": False, "temporary": False, "grouping": False}
+        rows_examined = 0.0
+        in_loop = set()  # ids of nested-loop steps, costed by their loop
+
+        def visit(node: Dict[str, Any]):
+            nonlocal rows_examined
+            if node.get("using_filesort"):
+                flags["filesort"] = True
+            if node.get("using_temporary_table"):
+                flags["temporary"] = True
+            if "grouping_operation" in node or "duplicates_removal" in node:
+                flags["grouping"] = True
+            if isinstance(node.get("table"), dict):
+                tables.append(node["table"])
+                if id(node) not in in_loop:
+                    # A lone table (query block without a join)
+                    rows_examined += _num(node["table"].get("rows_examined_per_scan", node["table"].get("rows")))
+            loop = node.get("nested_loop")
+            if isinstance(loop, list):
+                produced = 1.0
+                for step in loop:
+                    if not isinstance(step, dict):
+                        continue
+                    in_loop.add(id(step))
+                    table = step.get("table", {})
+                    per_scan = _num(table.get("rows_examined_per_scan", table.get("rows")))
+                    rows_examined += produced * per_scan
+                    produced = _num(table.get("rows_produced_per_join", per_scan)) or produced
+
+        _walk(plan, visit)
+        rows_examined = int(rows_examined)
+
+        # Without sorting/grouping an unfiltered single-table scan stops at the
+        # LIMIT, so size thresholds only warn for those plans. With a condition
+        # that filters rows out, the scan may read the whole table to fill it.
+        # Aggregates without GROUP BY have no grouping node in the JSON plan but
+        # read every row too, so those plans are judged from the SQL (unknown
+        # SQL is treated as aggregating).
+        short_circuits = (
+            len(tables) == 1
+            and not any(flags.values())
+            and sql is not None
+            and not uses_aggregates(sql)
+            and ("attached_condition" not in tables[0] or _num(tables[0].get("filtered")) >= 99)
+        )
+
+        errors: List[str] = []
+        warnings: List[str] = []
+
+        def apply(action: str, message: str):
+            if action == "reject" and not short_circuits:
+                errors.append(message)
+            elif action in ("reject", "warn"):
+                warnings.append(message)
+
+        if rows_examined > MAX_ROWS_EXAMINED:
+            apply("reject", f"Estimated {rows_examined:,} rows examined exceeds the limit of {MAX_ROWS_EXAMINED:,}")
+        for table in tables:
+            scanned = int(_num(table.get("rows_examined_per_scan", table.get("rows"))))
+            if table.get("access_type") == "ALL" and scanned >= FULL_SCAN_ROWS:
+                apply(FULL_SCAN_ACTION, f"Full table scan on {table.get('table_name', '?')} (~{scanned:,} rows)")
+        if flags["filesort"]:
+            apply(FILESORT_ACTION, "Plan uses filesort")
+        if flags["temporary"]:
+            apply(TEMPORARY_ACTION, "Plan uses a temporary table")
+
+        return PlanVerdict(
+            is_safe=not errors,
+            error="; ".join(errors) or None,
+            warnings=warnings,
+            rows_examined=rows_examined,
+            access=[f"{t.get('table_name', '?')}:{t.get('access_type', '?')}:{t.get('key', '')}" for t in tables],
+        )
+
+    @staticmethod
+    async def evaluate(
+        creds: DBConnection,
+        query: str,
+        conn: Optional["AsyncConnection"] = None,
+    ) -> PlanVerdict:
+        """
+        Runs EXPLAIN FORMAT=JSON on the query (on `conn` when given, so the check
+        shares the pooled connection used for execution) and applies the plan policy.
+        Verdicts are cached per database + SQL, so repeated queries skip the round trip.
         """
-        engine = get_engine_for_creds(creds)
-        
+        key = f"{connection_fingerprint(creds)}:{query}"
+        cached = plan_cache.get(key)
+        if cached is not None:
+            return cached.model_copy(update={"cached": True})
+
+        explain_sql = text(f"EXPLAIN FORMAT=JSON {query}")
         try:
-            with engine.connect() as conn:
-                # Run EXPLAIN
-                explain_sql = f"EXPLAIN {query}"
-                conn.execute(text(explain_sql))
-                return True, None
+            if conn is None:
+                async with get_async_engine_for_creds(replica_router.route(creds)).connect() as own_conn:
+                    plan = json.loads((await own_conn.execute(explain_sql)).scalar())
+            else:
+                plan = json.loads((await conn.execute(explain_sql)).scalar())
         except Exception as e:
-            return False, f"Query failed validation: {str(e)}"
+            # Not cached: the failure may be transient (connection loss, lock wait)
+            return PlanVerdict(is_safe=False, error=f"Query failed validation: {str(e)}")
+
+        verdict = ExplainGuard.analyze_plan(plan, query)
+        plan_cache.set(key, verdict)
+        return verdict
+
+    @staticmethod
+    async def check_query_safety(
+        creds: DBConnection,
+        query: str,
+        conn: Optional["AsyncConnection"] = None,
+    ) -> Tuple[bool, Optional[str]]:
+        """
+        Runs EXPLAIN on the query.
+        Returns (is_safe, error_message).
+        """
+        verdict = await ExplainGuard.evaluate(creds, query, conn)
+        return verdict.is_safe, verdict.error
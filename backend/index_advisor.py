@@ -0,0 +1,183 @@
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+from metrics import registry
+from sql_guard import tokenize, referenced_tables
+
+index_checks = registry.counter(
+    "askdb_index_checks_total", "Generated SQL checked for predicates on unindexed columns of large tables", ["outcome"]
+)
+
+_SKIP = ("ws", "comment", "hint")
+# Clauses whose column references are predicates an index could serve
+_PREDICATE_CLAUSES = {"WHERE", "ON"}
+_OTHER_CLAUSES = {
+    "SELECT", "FROM", "JOIN", "STRAIGHT_JOIN", "GROUP", "HAVING", "ORDER", "LIMIT",
+    "UNION", "USING", "WINDOW", "INNER", "LEFT", "RIGHT", "CROSS", "NATURAL",
+}
+# Words after a table name that are not its alias
+_NOT_ALIAS = _PREDICATE_CLAUSES | _OTHER_CLAUSES | {"AS", "FOR", "LOCK", "INTO", "OUTER", "FORCE", "USE", "IGNORE", "PARTITION"}
+
+def _name(kind: str, value: str) -> str:
+    return value[1:-1].replace("``", "`") if kind == "ident" else value
+
+def _aliases(tokens: List[tuple]) -> Dict[str, str]:
+    """{alias or table name (lowercase): table name} for the tables after FROM / JOIN."""
+    aliases: Dict[str, str] = {}
+    in_from = [False]  # per parenthesis depth
+    expect_table = False
+    table: Optional[str] = None  # last table name, waiting for its alias
+    for i, (kind, value) in enumerate(tokens):
+        upper = value.upper() if kind == "word" else None
+        if expect_table and (kind == "ident" or (kind == "word" and upper not in _NOT_ALIAS)):
+            if i + 1 < len(tokens) and tokens[i + 1][1] == ".":
+                continue  # schema prefix
+            table = _name(kind, value)
+            aliases[table.lower()] = table
+            expect_table = False
+            continue
+        if table is not None and (kind == "ident" or (kind == "word" and upper not in _NOT_ALIAS)):
+            aliases[_name(kind, value).lower()] = table
+            table = None
+            continue
+        if upper == "AS" or (kind == "punct" and value == "."):
+            continue
+        table = None
+        expect_table = False
+
+        if kind == "punct":
+            if value == "(":
+                in_from.append(False)
+            elif value == ")" and len(in_from) > 1:
+                in_from.pop()
+            elif value == "," and in_from[-1]:
+                expect_table = True
+        elif upper in ("FROM", "JOIN", "STRAIGHT_JOIN"):
+            in_from[-1] = True
+            expect_table = True
+        elif upper in _NOT_ALIAS:
+            in_from[-1] = False
+    return aliases
+
+def predicate_columns(sql: str, tables: Dict[str, Dict[str, Any]]) -> Dict[str, Set[str]]:
+    """
+    Best-effort {table: columns} referenced in WHERE and JOIN ... ON conditions,
+    including those of subqueries. Names are resolved through table aliases, or,
+    when unqualified, to the only referenced table that has such a column; names
+    that don't resolve to a schema column (keywords, functions, select aliases)
+    are ignored.
+    """
+    tokens = [(kind, value) for kind, value in tokenize(sql) if kind not in _SKIP]
+    columns = {
+        name: {column["name"].lower(): column["name"] for column in table["columns"]}
+        for name, table in tables.items()
+    }
+    by_lower = {name.lower(): name for name in tables}
+    aliases = {alias: by_lower[table.lower()] for alias, table in _aliases(tokens).items() if table.lower() in by_lower}
+    in_scope = [by_lower[t.lower()] for t in referenced_tables(sql) if t.lower() in by_lower]
+
+    found: Dict[str, Set[str]] = {}
+    clause = [None]  # per parenthesis depth
+    for i, (kind, value) in enumerate(tokens):
+        if kind == "punct":
+            if value == "(":
+                clause.append(clause[-1])
+            elif value == ")" and len(clause) > 1:
+                clause.pop()
+            continue
+        if kind == "word" and value.upper() in _PREDICATE_CLAUSES | _OTHER_CLAUSES:
+            clause[-1] = value.upper()
+            continue
+        if clause[-1] not in _PREDICATE_CLAUSES or kind not in ("word", "ident"):
+            continue
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if following in (".", "("):
+            continue  # qualifier (handled with its column) or function name
+        column = _name(kind, value).lower()
+        if i >= 2 and tokens[i - 1][1] == ".":
+            candidates = [aliases.get(_name(*tokens[i - 2]).lower())]
+        else:
+            candidates = [table for table in in_scope if column in columns[table]]
+            if len(candidates) != 1:
+                continue
+        table = candidates[0]
+        if table is not None and column in columns[table]:
+            found.setdefault(table, set()).add(columns[table][column])
+    return found
+
+class IndexAdvisor:
+    """
+    Flags generated SQL that filters or joins a large table (an estimated
+    `min_rows` rows or more) only on columns that don't lead any of its indexes,
+    so no index can narrow the rows read. With `rewrite` enabled the pipeline
+    asks the LLM once for an index-friendly version, which is kept only when
+    its EXPLAIN plan is no worse; stats record how often that changed the plan.
+    """
+
+    def __init__(self, min_rows: int = 100_000, rewrite: bool = False):
+        self.min_rows = min_rows
+        self.rewrite = rewrite
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.flagged = 0
+        self.rewrites_requested = 0
+        self.rewrites_adopted = 0
+        self.plan_changes = 0
+        self.rows_examined_saved = 0
+
+    def check(self, sql: str, tables: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """[{"table", "columns", "rows"}] for each large table with no indexed predicate column."""
+        findings = []
+        for table_name, used in predicate_columns(sql, tables).items():
+            table = tables[table_name]
+            if table.get("rows", 0) < self.min_rows:
+                continue
+            leading = {index["columns"][0] for index in table.get("indexes", [])}
+            if not used & leading:
+                findings.append({"table": table_name, "columns": sorted(used), "rows": table["rows"]})
+
+        with self._lock:
+            self.checked += 1
+            self.flagged += bool(findings)
+        index_checks.inc(outcome="flagged" if findings else "clean")
+        return findings
+
+    @staticmethod
+    def describe(findings: List[Dict[str, Any]]) -> str:
+        return "; ".join(
+            f"{f['table']} (about {f['rows']:,} rows) is filtered or joined only on unindexed {', '.join(f['columns'])}"
+            for f in findings
+        )
+
+    def record_rewrite(self, outcome: str, plan_changed: bool = False, rows_saved: int = 0):
+        """
+        `outcome` is "adopted", "unchanged" (the LLM returned the same query),
+        "rejected" (guard failure, worse or unsafe plan) or "failed" (LLM or EXPLAIN timeout/error).
+        """
+        with self._lock:
+            self.rewrites_requested += 1
+            self.rewrites_adopted += outcome == "adopted"
+            self.plan_changes += plan_changed
+            self.rows_examined_saved += max(0, rows_saved)
+        index_checks.inc(outcome=f"rewrite_{outcome}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "min_rows": self.min_rows,
+                "rewrite": self.rewrite,
+                "checked": self.checked,
+                "flagged": self.flagged,
+                "rewrites_requested": self.rewrites_requested,
+                "rewrites_adopted": self.rewrites_adopted,
+                "plan_changes": self.plan_changes,
+                "plan_change_rate": round(self.plan_changes / self.rewrites_requested, 3) if self.rewrites_requested else 0.0,
+                "rows_examined_saved": self.rows_examined_saved,
+            }
+
+# Global instance
+index_advisor = IndexAdvisor(
+    min_rows=int(os.getenv("INDEX_CHECK_MIN_ROWS", 100_000)),
+    rewrite=os.getenv("INDEX_CHECK_REWRITE", "false").lower() == "true",
+)
@@ -1,9 +1,17 @@
+import abc
+import asyncio
 import os
-import json
-from groq import Groq
-from dotenv import load_dotenv
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import settings
+
+from metrics import llm_attempts, llm_attempt_latency, llm_tokens
+from sql_guard import tokenize
 
-load_dotenv()
 
 SYSTEM_PROMPT_TEMPLATE = """You are a MySQL Expert.
 Your task is to generate a SQL query to answer the user's question, given the following database schema.
@@ -23,46 +31,515 @@ USER QUESTION: {question}
 
 SQL:"""
 
-def get_client():
-    # Hot-reload env vars for easier local dev
-    load_dotenv(override=True)
-    api_key = os.getenv("GROQ_API_KEY")
-    if api_key:
-        api_key = api_key.strip()
-        print(f"DEBUG: Loaded API Key: {api_key[:4]}...{api_key[-4:]}")
-    else:
-        print("DEBUG: No API Key found")
+INDEX_REWRITE_PROMPT_TEMPLATE = """You are a MySQL Expert.
+The query below answers the user's question, but {problems}, so MySQL has to read every row of those tables.
+
+SCHEMA (IDX/PK/UNIQUE mark columns an index can look up; row counts are estimates):
+{schema}
+
+USER QUESTION: {question}
+
+QUERY:
+{sql}
+
+Rewrite the query so indexed columns narrow the rows read, for example by filtering or joining on
+an indexed column, turning functions on indexed columns into ranges (created_at >= '2024-01-01'
+instead of YEAR(created_at) = 2024), or reaching the table through an indexed foreign key.
+The result MUST stay exactly the same. If that is not possible, return the query unchanged.
+Follow the same rules: one MySQL SELECT, no explanation or markdown, keep the LIMIT.
+
+SQL:"""
+
+class LLMError(Exception):
+    """Provider failure; `retryable` for rate limits, 5xx, timeouts and connection errors."""
+
+    def __init__(self, message: str, retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+class Completion:
+    def __init__(self, text: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+class LLMProvider(abc.ABC):
+    """Backend interface: one chat completion attempt, bounded by `timeout` seconds."""
+
+    name = "provider"
+
+    @abc.abstractmethod
+    async def complete(self, messages: List[Dict[str, str]], timeout: float) -> Completion:
+        """One attempt; raises on failure so LLMClient can retry or hedge."""
+
+    async def stream(self, messages: List[Dict[str, str]], timeout: float) -> AsyncIterator[Completion]:
+        """
+        Yields text deltas as Completions; token counts, when the provider reports
+        them, arrive on the last one. Closing the generator stops the generation.
+        """
+        yield await self.complete(messages, timeout)
+
+    async def aclose(self):
+        pass
+
+class GroqProvider(LLMProvider):
+    """
+    Groq chat completions over one long-lived AsyncGroq client, whose httpx pool
+    keeps connections alive between questions. The SDK's own retries are off;
+    LLMClient decides when to retry.
+    """
+
+    name = "groq"
+
+    def __init__(self, api_key: str, model: str, temperature: float = 0.1, max_connections: int = 20):
+        # The groq SDK is the slowest import in the app, so it is loaded with the provider
+        import groq
+        import httpx
+
+        self._groq = groq
+        self._httpx = httpx
+        self.model = model
+        self.temperature = temperature
+        self.client = groq.AsyncGroq(
+            api_key=api_key,
+            max_retries=0,
+            http_client=groq.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    keepalive_expiry=120,
+                ),
+            ),
+        )
+
+    async def complete(self, messages: List[Dict[str, str]], timeout: float) -> Completion:
+        groq = self._groq
+        try:
+            completion = await self.client.chat.completions.create(
+                messages=messages,
+                model=self.model,
+                temperature=self.temperature,
+                timeout=timeout,
+            )
+        except groq.RateLimitError as e:
+            retry_after = e.response.headers.get("retry-after")
+            raise LLMError(str(e), retryable=True, retry_after=float(retry_after) if retry_after else None)
+        except groq.InternalServerError as e:
+            raise LLMError(str(e), retryable=True)
+        except (groq.APITimeoutError, groq.APIConnectionError) as e:
+            raise LLMError(str(e), retryable=True)
+        except groq.APIStatusError as e:
+            raise LLMError(str(e), retryable=e.status_code >= 500)
+
+        usage = completion.usage
+        return Completion(
+            completion.choices[0].message.content,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        )
+
+    async def stream(self, messages: List[Dict[str, str]], timeout: float) -> AsyncIterator[Completion]:
+        groq = self._groq
+        try:
+            stream = await self.client.chat.completions.create(
+                messages=messages,
+                model=self.model,
+                temperature=self.temperature,
+                timeout=timeout,
+                stream=True,
+            )
+        except groq.RateLimitError as e:
+            retry_after = e.response.headers.get("retry-after")
+            raise LLMError(str(e), retryable=True, retry_after=float(retry_after) if retry_after else None)
+        except (groq.InternalServerError, groq.APITimeoutError, groq.APIConnectionError) as e:
+            raise LLMError(str(e), retryable=True)
+        except groq.APIStatusError as e:
+            raise LLMError(str(e), retryable=e.status_code >= 500)
+
+        try:
+            async for chunk in stream:
+                usage = getattr(getattr(chunk, "x_groq", None), "usage", None)
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if usage:
+                    yield Completion(
+                        text or "",
+                        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+                    )
+                elif text:
+                    # About one token per content chunk until usage arrives
+                    yield Completion(text, completion_tokens=1)
+        except (groq.APITimeoutError, groq.APIConnectionError, self._httpx.TransportError) as e:
+            raise LLMError(str(e), retryable=True)
+        finally:
+            # Dropping the response stops the generation server-side
+            await stream.close()
+
+    async def aclose(self):
+        await self.client.close()
+
+class StubProvider(LLMProvider):
+    """Local backend for tests and benchmarks: answers with fixed SQL after a fixed latency."""
 
+    name = "stub"
+
+    def __init__(self, sql: str = "SELECT 1", latency: float = 0.0):
+        self.sql = sql
+        self.latency = latency
+
+    async def complete(self, messages: List[Dict[str, str]], timeout: float) -> Completion:
+        if self.latency > timeout:
+            await asyncio.sleep(timeout)
+            raise LLMError("Stub LLM timed out", retryable=True)
+        await asyncio.sleep(self.latency)
+        prompt_chars = sum(len(m["content"]) for m in messages)
+        return Completion(self.sql, prompt_tokens=prompt_chars // 4, completion_tokens=len(self.sql) // 4)
+
+    async def stream(self, messages: List[Dict[str, str]], timeout: float) -> AsyncIterator[Completion]:
+        # Roughly one token per 4 characters, with the latency spread across them
+        chunks = [self.sql[i:i + 4] for i in range(0, len(self.sql), 4)] or [""]
+        if self.latency > timeout:
+            await asyncio.sleep(timeout)
+            raise LLMError("Stub LLM timed out", retryable=True)
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield Completion(chunk, completion_tokens=1)
+
+class LLMClient:
+    """
+    Long-lived front end for an LLMProvider. Each attempt gets at most
+    `attempt_timeout` seconds and the whole call `deadline` seconds. Rate limits,
+    5xx and timeouts are retried with full-jitter exponential backoff (or the
+    server's Retry-After). With `hedge_percentile` set, a second attempt is started
+    when the first one runs past that percentile of recent latencies, and the
+    first answer wins.
+    The provider can be given directly or as `provider_factory`, which is called
+    on first use (or by warm_up) so that building it stays off the import path.
+    """
+
+    def __init__(
+        self,
+        provider: Optional[LLMProvider] = None,
+        attempt_timeout: float = 15,
+        deadline: float = 25,
+        max_retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4,
+        hedge_percentile: float = 0,
+        hedge_min_samples: int = 20,
+        provider_factory: Optional[Callable[[], Optional[LLMProvider]]] = None,
+    ):
+        self._provider = provider
+        self._provider_factory = provider_factory
+        self._provider_lock = threading.Lock()
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = deque(maxlen=500)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def provider(self) -> Optional[LLMProvider]:
+        if self._provider_factory is not None:
+            with self._provider_lock:
+                if self._provider_factory is not None:
+                    self._provider = self._provider_factory()
+                    self._provider_factory = None
+        return self._provider
+
+    def warm_up(self):
+        """Builds the provider ahead of the first question."""
+        self.provider
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_percentile:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(self.hedge_percentile * len(ordered)))]
+
+    async def _attempt(self, messages: List[Dict[str, str]], timeout: float) -> Completion:
+        provider = self.provider
+        start = time.perf_counter()
+        with self._lock:
+            self.attempts += 1
+        try:
+            completion = await asyncio.wait_for(provider.complete(messages, timeout), timeout)
+        except asyncio.TimeoutError:
+            llm_attempts.inc(provider=provider.name, outcome="timeout")
+            raise LLMError(f"LLM attempt timed out after {timeout:.2f}s", retryable=True)
+        except LLMError as e:
+            llm_attempts.inc(provider=provider.name, outcome="retryable_error" if e.retryable else "error")
+            raise
+        elapsed = time.perf_counter() - start
+        llm_attempts.inc(provider=provider.name, outcome="success")
+        llm_attempt_latency.observe(elapsed, provider=provider.name)
+        with self._lock:
+            self._latencies.append(elapsed)
+        return completion
+
+    async def _hedged_attempt(self, messages: List[Dict[str, str]], timeout: float) -> Completion:
+        delay = self.hedge_delay()
+        if delay is None or delay >= timeout:
+            return await self._attempt(messages, timeout)
+
+        primary = asyncio.ensure_future(self._attempt(messages, timeout))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        with self._lock:
+            self.hedges += 1
+        hedge = asyncio.ensure_future(self._attempt(messages, max(timeout - delay, 0.001)))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def complete(self, messages: List[Dict[str, str]]) -> Completion:
+        if self.provider is None:
+            raise ValueError("GROQ_API_KEY is not set. Please check your .env file.")
+
+        with self._lock:
+            self.calls += 1
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    self.failures += 1
+                raise LLMError(f"LLM deadline of {self.deadline}s exceeded")
+            try:
+                completion = await self._hedged_attempt(messages, min(self.attempt_timeout, remaining))
+                break
+            except LLMError as e:
+                backoff = e.retry_after or random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if not e.retryable or attempt >= self.max_retries or time.monotonic() + backoff >= deadline:
+                    with self._lock:
+                        self.failures += 1
+                    raise
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                await asyncio.sleep(backoff)
+
+        llm_tokens.inc(completion.prompt_tokens, provider=self.provider.name, kind="prompt")
+        llm_tokens.inc(completion.completion_tokens, provider=self.provider.name, kind="completion")
+        with self._lock:
+            self.prompt_tokens += completion.prompt_tokens
+            self.completion_tokens += completion.completion_tokens
+        return completion
+
+    async def stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """
+        Streams text deltas. Failures before the first delta are retried like
+        complete(); once text has been yielded an error is final. Each delta must
+        arrive within `attempt_timeout`, and the whole stream within `deadline`.
+        Closing the generator early stops the provider's generation.
+        """
+        if self.provider is None:
+            raise ValueError("GROQ_API_KEY is not set. Please check your .env file.")
+
+        provider = self.provider
+        with self._lock:
+            self.calls += 1
+        deadline = time.monotonic() + self.deadline
+        prompt_tokens = completion_tokens = 0
+        attempt = 0
+        received = False
+        try:
+            while True:
+                with self._lock:
+                    self.attempts += 1
+                start = time.perf_counter()
+                deltas = provider.stream(messages, self.attempt_timeout)
+                try:
+                    while True:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise LLMError(f"LLM deadline of {self.deadline}s exceeded")
+                        try:
+                            delta = await asyncio.wait_for(deltas.__anext__(), min(self.attempt_timeout, remaining))
+                        except StopAsyncIteration:
+                            break
+                        except asyncio.TimeoutError:
+                            llm_attempts.inc(provider=provider.name, outcome="timeout")
+                            raise LLMError("LLM stream stalled", retryable=True)
+                        if delta.prompt_tokens:
+                            # Usage reported by the provider replaces the running estimate
+                            prompt_tokens, completion_tokens = delta.prompt_tokens, delta.completion_tokens
+                        else:
+                            completion_tokens += delta.completion_tokens
+                        if delta.text:
+                            if not received:
+                                llm_attempt_latency.observe(time.perf_counter() - start, provider=provider.name)
+                            received = True
+                            yield delta.text
+                    llm_attempts.inc(provider=provider.name, outcome="success")
+                    return
+                except LLMError as e:
+                    backoff = e.retry_after or random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                    if received or not e.retryable or attempt >= self.max_retries or time.monotonic() + backoff >= deadline:
+                        with self._lock:
+                            self.failures += 1
+                        raise
+                    attempt += 1
+                    with self._lock:
+                        self.retries += 1
+                    await asyncio.sleep(backoff)
+                finally:
+                    await deltas.aclose()
+        finally:
+            if not prompt_tokens:
+                # Stopped before the provider reported usage: estimate from the prompt
+                prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+            llm_tokens.inc(prompt_tokens, provider=provider.name, kind="prompt")
+            llm_tokens.inc(completion_tokens, provider=provider.name, kind="completion")
+            with self._lock:
+                self.prompt_tokens += prompt_tokens
+                self.completion_tokens += completion_tokens
+
+    async def aclose(self):
+        if self._provider is not None:
+            await self._provider.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = sorted(self._latencies)
+            def pick(q):
+                return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1) if ordered else None
+            return {
+                "provider": self._provider.name if self._provider else None,
+                "calls": self.calls,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "failures": self.failures,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "latency_p50_ms": pick(0.5),
+                "latency_p95_ms": pick(0.95),
+            }
+
+def _build_provider() -> Optional[LLMProvider]:
+    if os.getenv("LLM_PROVIDER", "groq") == "stub":
+        return StubProvider(
+            sql=os.getenv("LLM_STUB_SQL", "SELECT 1"),
+            latency=float(os.getenv("LLM_STUB_LATENCY_MS", 0)) / 1000,
+        )
+    api_key = (os.getenv("GROQ_API_KEY") or "").strip()
     if not api_key:
         return None
-    return Groq(api_key=api_key)
+    return GroqProvider(
+        api_key,
+        model=os.getenv("LLM_MODEL", "llama-3.3-70b-versatile"),
+        max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", 20)),
+    )
 
-def generate_sql(schema: str, question: str) -> str:
-    client = get_client()
-    if not client:
-        # Return a safer error or raise one that can be caught
-        raise ValueError("GROQ_API_KEY is not set. Please check your .env file.")
+# Global instance; the provider (and the groq SDK) is built on first use or warm-up
+llm_client = LLMClient(
+    provider_factory=_build_provider,
+    attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT", 15)),
+    deadline=float(os.getenv("LLM_DEADLINE", 25)),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+    hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", 0)),
+    hedge_min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20)),
+)
 
+def build_messages(schema: str, question: str) -> List[Dict[str, str]]:
     prompt = SYSTEM_PROMPT_TEMPLATE.format(schema=schema, question=question)
+    return [
+        {
+            "role": "system",
+            "content": "You are a specialized SQL generation assistant."
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
 
-    completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": "You are a specialized SQL generation assistant."
-            },
-            {
-                "role": "user",
-                "content": prompt
-            }
-        ],
-        model="llama-3.3-70b-versatile",
-        temperature=0.1,
-    )
-    
-    response = completion.choices[0].message.content.strip()
-    
+def clean_sql_output(text: str) -> str:
     # Clean up markdown if present (defense in depth)
-    response = response.replace("```sql", "").replace("```", "").strip()
-    
-    return response
+    return text.strip().replace("```sql", "").replace("```", "").strip()
+
+def rejected_early(text: str) -> bool:
+    """
+    True once streamed output is certain to be refused whatever follows:
+    INVALID_QUERY, or a word, number or quoted token after a statement
+    terminator (SQLGuard rejects stacked statements). Text inside an
+    unterminated quote or comment is not judged.
+    """
+    cleaned = clean_sql_output(text)
+    if cleaned.startswith("INVALID_QUERY"):
+        return True
+    ended = False
+    for kind, value in tokenize(cleaned):
+        if kind == "open_comment" or (kind == "punct" and value in ("'", '"', "`")):
+            return False
+        if ended and kind in ("word", "ident", "number", "string"):
+            return True
+        if kind == "punct" and value == ";":
+            ended = True
+    return False
+
+async def generate_sql(schema: str, question: str) -> str:
+    completion = await llm_client.complete(build_messages(schema, question))
+    return clean_sql_output(completion.text)
+
+async def rewrite_sql_for_indexes(schema: str, question: str, sql: str, problems: str) -> str:
+    """Asks once for an index-friendly version of `sql`, with `problems` describing the unindexed predicates."""
+    prompt = INDEX_REWRITE_PROMPT_TEMPLATE.format(schema=schema, question=question, sql=sql, problems=problems)
+    messages = [
+        {"role": "system", "content": "You are a specialized SQL generation assistant."},
+        {"role": "user", "content": prompt},
+    ]
+    completion = await llm_client.complete(messages)
+    return clean_sql_output(completion.text)
+
+async def stream_sql(schema: str, question: str) -> AsyncIterator[str]:
+    """
+    Streams the generated SQL as it is produced. Callers take clean_sql_output()
+    of the concatenated output, exactly as generate_sql does, so SQLGuard judges
+    the same text for streamed and non-streamed answers. Generation stops early
+    only once the output can no longer pass (see rejected_early).
+    """
+    text = ""
+    deltas = llm_client.stream(build_messages(schema, question))
+    try:
+        async for delta in deltas:
+            text += delta
+            yield delta
+            if rejected_early(text):
+                break
+    finally:
+        await deltas.aclose()
@@ -1,40 +1,160 @@
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+import random
 import sys
-import json
+import threading
 from datetime import datetime
-from typing import Any
+from typing import Any, List, Optional, TextIO
+
+import orjson
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Renamed for backwards compatibility with existing log queries
+_FIELD_ALIASES = {"query_duration": "query_duration_ms"}
 
 class CustomJSONFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord) -> str:
         log_data = {
-            "timestamp": datetime.utcnow().isoformat(),
+            # When the record was made, not when the writer thread got to it
+            "timestamp": datetime.utcfromtimestamp(record.created).isoformat(),
             "level": record.levelname,
             "message": record.getMessage(),
             "module": record.module,
         }
-        
-        # Add extra fields if they exist
-        if hasattr(record, "user_id"):
-            log_data["user_id"] = record.user_id
-        if hasattr(record, "query_duration"):
-            log_data["query_duration_ms"] = record.query_duration
-        if hasattr(record, "row_count"):
-            log_data["row_count"] = record.row_count
-            
-        return json.dumps(log_data)
+
+        # Add every extra field passed by the caller
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                log_data[_FIELD_ALIASES.get(key, key)] = value
+
+        return orjson.dumps(log_data, default=str).decode("utf-8")
+
+class SamplingFilter(logging.Filter):
+    """Keeps a `rate` fraction of INFO (and lower) records; warnings and errors always pass."""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller: records are dropped (and counted) when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Cheaper than the stock prepare(): no copy and no full format() on the
+        # caller's side, only what can't safely cross threads is resolved here
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.msg = f"{record.msg}\n{record.exc_text}"
+            record.exc_info = None
+            record.exc_text = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class BatchingQueueListener:
+    """
+    Background writer for a QueueHandler. Waits for a record, drains up to
+    `batch_size` more without blocking, then formats them and writes the whole
+    batch to the stream with a single write + flush.
+    """
+
+    _STOP = None
+
+    def __init__(self, log_queue: queue.Queue, formatter: logging.Formatter, stream: Optional[TextIO] = None, batch_size: int = 256):
+        self.queue = log_queue
+        self.formatter = formatter
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self.queue.put(self._STOP)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            batch: List[Any] = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = self._STOP in batch
+            lines = []
+            for record in batch:
+                if record is self._STOP:
+                    continue
+                try:
+                    lines.append(self.formatter.format(record))
+                except Exception:
+                    # Never let one bad record kill the writer thread
+                    pass
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except Exception:
+                    pass
+            if stopping:
+                return
 
 def setup_logger(name: str = "app"):
     logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    
-    handler = logging.StreamHandler(sys.stdout)
-    formatter = CustomJSONFormatter()
-    handler.setFormatter(formatter)
-    
+
     # Avoid duplicate handlers
-    if not logger.handlers:
-        logger.addHandler(handler)
-        
+    if logger.handlers:
+        return logger
+
+    log_queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10_000)))
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(float(os.getenv("LOG_INFO_SAMPLE_RATE", 1.0))))
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    listener = BatchingQueueListener(
+        log_queue,
+        CustomJSONFormatter(),
+        batch_size=int(os.getenv("LOG_BATCH_SIZE", 256)),
+    )
+    listener.start()
+    # Flush whatever is still queued on interpreter exit
+    atexit.register(listener.stop)
+    logger.listener = listener
+
     return logger
 
+def logging_stats(logger: logging.Logger) -> dict:
+    dropped = sum(getattr(h, "dropped", 0) for h in logger.handlers)
+    pending = sum(h.queue.qsize() for h in logger.handlers if isinstance(h, logging.handlers.QueueHandler))
+    return {"dropped": dropped, "pending": pending}
+
 app_logger = setup_logger("ask_your_db")
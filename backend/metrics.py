@@ -0,0 +1,238 @@
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Minimal Prometheus text-format (0.0.4) metrics: counters, histograms and
+# scrape-time collectors for values that already live elsewhere (pool sizes,
+# cache counters).
+
+Sample = Tuple[Dict[str, str], float]
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}  # {labels: [bucket counts..., sum, count]}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, state):
+                    bucket_labels = dict(labels, le=_format_value(bound))
+                    lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {_format_value(count)}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(state[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {_format_value(state[-1])}")
+        return lines
+
+# A collector returns [(name, type, help, [(labels, value), ...]), ...] at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), **kwargs) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+# Global registry and the pipeline's metrics
+registry = MetricsRegistry()
+
+stage_latency = registry.histogram(
+    "askdb_stage_duration_seconds", "Latency of each /query pipeline stage", ["stage"]
+)
+http_latency = registry.histogram(
+    "askdb_http_request_duration_seconds", "HTTP request latency by route", ["route", "method", "status"]
+)
+stage_timeouts = registry.counter(
+    "askdb_stage_timeouts_total", "Pipeline stages that exceeded their deadline", ["stage"]
+)
+guard_rejections = registry.counter(
+    "askdb_guard_rejections_total", "Queries rejected by SQLGuard or ExplainGuard", ["guard"]
+)
+llm_errors = registry.counter(
+    "askdb_llm_errors_total", "LLM generation failures", ["kind"]
+)
+llm_attempts = registry.counter(
+    "askdb_llm_attempts_total", "LLM completion attempts by outcome", ["provider", "outcome"]
+)
+llm_attempt_latency = registry.histogram(
+    "askdb_llm_attempt_duration_seconds", "Latency of single LLM completion attempts", ["provider"]
+)
+llm_tokens = registry.counter(
+    "askdb_llm_tokens_total", "LLM tokens used", ["provider", "kind"]
+)
+query_cancellations = registry.counter(
+    "askdb_query_cancellations_total", "Queries stopped before completing, by reason", ["reason"]
+)
+kill_queries = registry.counter(
+    "askdb_kill_queries_total", "KILL QUERY statements sent for abandoned or overdue queries", ["outcome"]
+)
+client_disconnects = registry.counter(
+    "askdb_client_disconnects_total", "Requests whose client went away before the response was ready"
+)
+singleflight_calls = registry.counter(
+    "askdb_singleflight_calls_total", "Calls to a coalesced operation, by whether they ran it or joined one in flight", ["operation", "role"]
+)
+
+class RequestTimings:
+    """Per-request stage durations, rendered as a Server-Timing header."""
+
+    def __init__(self):
+        self.stages: List[Tuple[str, float]] = []
+        self.start = time.perf_counter()
+
+    def add(self, stage: str, duration_ms: float):
+        self.stages.append((stage, duration_ms))
+
+    def server_timing(self) -> str:
+        totals: Dict[str, float] = {}
+        for stage, duration_ms in self.stages:
+            totals[stage] = totals.get(stage, 0.0) + duration_ms
+        entries = [f"{stage};dur={duration_ms:.1f}" for stage, duration_ms in totals.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(entries)
+
+current_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar("current_timings", default=None)
+
+def record_stage(stage: str, seconds: float):
+    stage_latency.observe(seconds, stage=stage)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds * 1000)
+
+@contextmanager
+def timed_stage(stage: str):
+    """Times a block (sync or inside a coroutine) as a pipeline stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+class TimingMiddleware:
+    """
+    ASGI middleware: gives every HTTP request a RequestTimings, adds the
+    Server-Timing header when the response starts and records request latency.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timings.reset(token)
+            # The router stores the matched endpoint in the (shared) scope
+            endpoint = scope.get("endpoint")
+            http_latency.observe(
+                time.perf_counter() - timings.start,
+                route=getattr(endpoint, "__name__", "unmatched"),
+                method=scope.get("method", ""),
+                status=str(status_code),
+            )
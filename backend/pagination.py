@@ -0,0 +1,278 @@
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from crypto_utils import encrypt_data, decrypt_data
+from sql_guard import Token, tokenize, referenced_tables
+
+# Continuation cursors for results cut off by the row cap. A cursor is a Fernet
+# token (like db_token) holding the validated SQL without its LIMIT, so a page is
+# fetched without the LLM, schema or guard stages. Pages use keyset form when the
+# ordering is unique (it covers the table's primary key), bounded OFFSET otherwise.
+
+CURSOR_TTL = float(os.getenv("PAGINATION_CURSOR_TTL", 900))
+MAX_OFFSET = int(os.getenv("PAGINATION_MAX_OFFSET", 10000))
+
+_SKIP = ("ws", "comment")
+# Clauses that make keyset predicates on the output rows unsafe
+_NOT_KEYSET = {"GROUP", "HAVING", "DISTINCT", "UNION", "WINDOW", "INTO", "FOR", "LOCK", "JOIN", "STRAIGHT_JOIN"}
+
+def _significant(tokens: Sequence[Token]) -> List[int]:
+    return [i for i, token in enumerate(tokens) if token.kind not in _SKIP]
+
+def _name(token: Token) -> str:
+    return token.value[1:-1].replace("``", "`") if token.kind == "ident" else token.value
+
+def split_limit(sql: str) -> Optional[Tuple[str, Optional[int], int]]:
+    """
+    (sql without its outermost LIMIT clause, count, offset). Count is None when
+    there is no top-level LIMIT. None when the statement can't be split safely.
+    """
+    tokens = tokenize(sql)
+    significant = _significant(tokens)
+    while significant and tokens[significant[-1]].value == ";":
+        significant.pop()
+    if not significant:
+        return None
+
+    depth = 0
+    limit_at = None  # position in `significant`
+    for position, i in enumerate(significant):
+        kind, value = tokens[i]
+        if kind == "punct":
+            depth += value == "("
+            depth -= value == ")"
+        elif kind == "word" and depth == 0 and value.upper() == "LIMIT":
+            limit_at = position
+    if limit_at is None:
+        return "".join(t.value for t in tokens[:significant[-1] + 1]), None, 0
+
+    # LIMIT count | LIMIT offset, count | LIMIT count OFFSET offset, and nothing after
+    args = [tokens[i] for i in significant[limit_at + 1:]]
+    numbers = [a for a in args if a.kind == "number"]
+    if len(args) == 1 and len(numbers) == 1:
+        count, offset = int(float(args[0].value)), 0
+    elif len(args) == 3 and len(numbers) == 2 and args[1].value == ",":
+        count, offset = int(float(args[2].value)), int(float(args[0].value))
+    elif len(args) == 3 and len(numbers) == 2 and args[1].value.upper() == "OFFSET":
+        count, offset = int(float(args[0].value)), int(float(args[2].value))
+    else:
+        return None
+    return "".join(t.value for t in tokens[:significant[limit_at]]).rstrip(), count, offset
+
+def _select_aliases(select_list: List[Token]) -> set:
+    """
+    Lowercased output aliases in a select list, with or without AS: the last
+    name of an item that is more than a (qualified) column reference.
+    """
+    items: List[List[Token]] = [[]]
+    depth = 0
+    for token in select_list:
+        depth += token.value == "("
+        depth -= token.value == ")"
+        if depth == 0 and token.value == ",":
+            items.append([])
+        else:
+            items[-1].append(token)
+
+    aliases = set()
+    for item in items:
+        if len(item) >= 2 and item[-1].kind in ("word", "ident") and item[-2].value != ".":
+            aliases.add(_name(item[-1]).lower())
+    return aliases
+
+def keyset_template(
+    base_sql: str,
+    primary_keys: Dict[str, List[str]],
+    column_names: List[str],
+) -> Optional[Tuple[str, List[int]]]:
+    """
+    Rewrites a LIMIT-less single-table SELECT whose ORDER BY covers the table's
+    primary key into `... WHERE (order cols) > (:k0, ...) [AND (where)] ORDER BY ...`.
+    Returns (template, result column index of each order column), or None when
+    the ordering isn't unique or the query shape isn't supported.
+    """
+    tokens = tokenize(base_sql)
+    significant = _significant(tokens)
+    if not significant or tokens[significant[0]].value.upper() != "SELECT":
+        return None
+    tables = referenced_tables(base_sql)
+    primary_keys = {table.lower(): columns for table, columns in primary_keys.items()}
+    if len(tables) != 1 or tables[0].lower() not in primary_keys:
+        return None
+
+    depth = 0
+    where_at = order_at = from_at = None  # indices in `tokens`
+    for position, i in enumerate(significant):
+        kind, value = tokens[i]
+        if kind == "punct":
+            depth += value == "("
+            depth -= value == ")"
+            if depth == 0 and value == "," and from_at is not None and where_at is None and order_at is None:
+                return None  # comma join
+            continue
+        if kind != "word" or depth:
+            continue
+        upper = value.upper()
+        if upper in _NOT_KEYSET:
+            return None
+        if upper == "FROM" and from_at is None:
+            from_at = i
+        elif upper == "WHERE":
+            where_at = i
+        elif upper == "ORDER" and position + 1 < len(significant) and tokens[significant[position + 1]].value.upper() == "BY":
+            order_at, order_by_at = i, significant[position + 1]
+    if order_at is None or from_at is None:
+        return None
+
+    # ORDER BY items: [qualifier .] column [ASC | DESC], all in one direction
+    items: List[List[Token]] = [[]]
+    for i in significant:
+        if i <= order_by_at:
+            continue
+        token = tokens[i]
+        if token.value == ",":
+            items.append([])
+        else:
+            items[-1].append(token)
+    expressions, names, directions = [], [], set()
+    for item in items:
+        direction = "ASC"
+        if item and item[-1].value.upper() in ("ASC", "DESC"):
+            direction = item.pop().value.upper()
+        if len(item) == 3 and item[1].value == "." and item[0].kind in ("word", "ident"):
+            pass
+        elif len(item) != 1:
+            return None
+        if item[-1].kind not in ("word", "ident"):
+            return None
+        expressions.append("".join(t.value for t in item))
+        names.append(_name(item[-1]).lower())
+        directions.add(direction)
+    if len(directions) != 1:
+        return None
+    descending = directions == {"DESC"}
+
+    pk = [column.lower() for column in primary_keys[tables[0].lower()]]
+    if not pk or not set(pk) <= set(names):
+        return None
+    # NULLs sort last in descending order, where a keyset predicate would skip them
+    if descending and not set(names) <= set(pk):
+        return None
+
+    # Last-seen values are read from the result, so each order column must be an
+    # output column and not an alias for something else
+    lowered = [name.lower() for name in column_names]
+    aliases = _select_aliases([tokens[i] for i in significant[1:] if i < from_at and tokens[i].kind != "hint"])
+    if any(name not in lowered or name in aliases for name in names):
+        return None
+    key_indexes = [lowered.index(name) for name in names]
+
+    operator = "<" if descending else ">"
+    if len(expressions) == 1:
+        predicate = f"{expressions[0]} {operator} :k0"
+    else:
+        placeholders = ", ".join(f":k{n}" for n in range(len(expressions)))
+        predicate = f"({', '.join(expressions)}) {operator} ({placeholders})"
+
+    head = "".join(t.value for t in tokens[:where_at if where_at is not None else order_at]).rstrip()
+    tail = "".join(t.value for t in tokens[order_at:])
+    if where_at is None:
+        return f"{head} WHERE {predicate} {tail}", key_indexes
+    condition = "".join(t.value for t in tokens[where_at + 1:order_at]).strip()
+    return f"{head} WHERE {predicate} AND ({condition}) {tail}", key_indexes
+
+def _key_value(value: Any) -> Any:
+    # Cursor values go through JSON; dates and decimals compare fine as strings
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        raise ValueError("binary key")
+    return str(value)
+
+def first_cursor(
+    sql: str,
+    generated_sql: str,
+    page_size: int,
+    column_names: List[str],
+    rows: List[tuple],
+    user_id: str,
+    db_fingerprint: str,
+    primary_keys: Optional[Dict[str, List[str]]] = None,
+) -> Optional[str]:
+    """
+    Cursor for the page after `rows`, or None when the row cap didn't cut the
+    result short (fewer rows, or the question itself asked for fewer rows).
+    A generated LIMIT equal to the page size is the default the system prompt
+    asks the LLM for, so it is read as "no limit" rather than as the question's.
+    """
+    if len(rows) < page_size:
+        return None
+    split = split_limit(sql)
+    requested = split_limit(generated_sql)
+    if split is None or requested is None:
+        return None
+    base_sql, _, offset = split
+    wanted = requested[1]
+    if wanted == page_size:
+        wanted = None
+    if wanted is not None and wanted < page_size:
+        return None
+
+    state = {
+        "user": user_id,
+        "db": db_fingerprint,
+        "exp": time.time() + CURSOR_TTL,
+        "sql": base_sql,
+        "page": page_size,
+        "remaining": None if wanted is None else wanted - len(rows),
+        "offset": offset,
+        "keyset": None,
+        "keys": [],
+        "last": [],
+    }
+    template = keyset_template(base_sql, primary_keys or {}, column_names)
+    if template is not None:
+        state["keyset"], state["keys"] = template
+    return _advance(state, rows)
+
+def _advance(state: Dict[str, Any], rows: List[tuple]) -> Optional[str]:
+    if state["remaining"] is not None and state["remaining"] <= 0:
+        return None
+    state["offset"] += len(rows)
+    if state["keyset"] is not None:
+        try:
+            state["last"] = [_key_value(rows[-1][i]) for i in state["keys"]]
+        except ValueError:
+            state["keyset"] = None
+        if None in state["last"]:
+            state["keyset"] = None
+    if state["keyset"] is None and state["offset"] > MAX_OFFSET:
+        return None
+    return encrypt_data(state)
+
+def read_cursor(cursor: str, user_id: str, db_fingerprint: str) -> Dict[str, Any]:
+    """Decrypts and checks a cursor; raises ValueError when it is invalid, expired or someone else's."""
+    state = decrypt_data(cursor)
+    if state.get("user") != user_id or state.get("db") != db_fingerprint:
+        raise ValueError("Cursor does not belong to this session")
+    if state.get("exp", 0) < time.time():
+        raise ValueError("Cursor expired")
+    return state
+
+def page_query(state: Dict[str, Any]) -> Tuple[str, Dict[str, Any], int]:
+    """(sql, bind parameters, row count) for the page a cursor points at."""
+    count = state["page"] if state["remaining"] is None else min(state["page"], state["remaining"])
+    if state["keyset"] is not None:
+        params = {f"k{n}": value for n, value in enumerate(state["last"])}
+        return f"{state['keyset']} LIMIT {count}", params, count
+    return f"{state['sql']} LIMIT {count} OFFSET {state['offset']}", {}, count
+
+def next_cursor(state: Dict[str, Any], rows: List[tuple], count: int) -> Optional[str]:
+    """Cursor for the page after `rows` (fetched with page_query), or None on the last page."""
+    if len(rows) < count:
+        return None
+    if state["remaining"] is not None:
+        state["remaining"] -= len(rows)
+    state["exp"] = time.time() + CURSOR_TTL
+    return _advance(state, rows)
@@ -0,0 +1,626 @@
+# Stages of the question -> SQL -> rows pipeline shared by the /query endpoints.
+# Each stage raises HTTPException for user-facing failures and StageTimeoutError
+# when its deadline passes.
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+from sqlalchemy import text
+
+if TYPE_CHECKING:
+    # sqlalchemy.ext.asyncio is imported when the first async engine is built
+    from sqlalchemy.ext.asyncio import AsyncConnection
+
+from logger import app_logger
+from db import DBConnection, connection_fingerprint, get_async_engine_for_creds, TABLE_UPDATE_TIMES_SQL
+from schema_cache import schema_cache
+from schema_retrieval import schema_retriever
+from sql_cache import sql_cache, make_cache_key
+from llm import generate_sql, stream_sql, clean_sql_output, rewrite_sql_for_indexes
+from sql_guard import SQLGuard, referenced_tables, with_max_execution_time
+from explain_guard import ExplainGuard, PlanVerdict
+from index_advisor import index_advisor
+from crypto_utils import decrypt_data
+from token_cache import session_cache
+from result_cache import result_cache
+from replicas import replica_router
+import pagination
+from async_utils import STAGE_TIMEOUTS, run_blocking, with_timeout, iterate_with_timeout, StageTimeoutError, SingleFlight
+from metrics import timed_stage, guard_rejections, llm_errors, stage_timeouts, query_cancellations, kill_queries
+
+DEFAULT_ROW_LIMIT = 100
+# Users allowed to stream larger results (comma separated user ids)
+TRUSTED_USERS = {u.strip() for u in os.getenv("TRUSTED_USERS", "").split(",") if u.strip()}
+TRUSTED_STREAM_ROW_LIMIT = int(os.getenv("TRUSTED_STREAM_ROW_LIMIT", 10000))
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 500))
+
+# Execution deadline (seconds) per user tier. Users are "trusted" (TRUSTED_USERS)
+# or "default" unless USER_TIERS ({"user_id": "tier"}) says otherwise.
+USER_TIERS: Dict[str, str] = json.loads(os.getenv("USER_TIERS", "{}"))
+EXECUTION_TIMEOUTS: Dict[str, float] = dict(
+    {"default": STAGE_TIMEOUTS["execute"], "trusted": STAGE_TIMEOUTS["execute"]},
+    **json.loads(os.getenv("EXECUTION_TIMEOUTS", "{}")),
+)
+# The server-side limit (MAX_EXECUTION_TIME) fires first; the client-side deadline
+# and KILL QUERY are the backstop for databases that ignore the hint
+EXECUTION_DEADLINE_GRACE = float(os.getenv("EXECUTION_DEADLINE_GRACE", 1))
+# MySQL ER_QUERY_TIMEOUT and MariaDB ER_STATEMENT_TIMEOUT
+SERVER_TIMEOUT_ERRORS = {3024, 1969}
+
+# In-flight deduplication of schema loads, SQL generation and query execution
+schema_flight = SingleFlight("schema")
+llm_flight = SingleFlight("llm")
+query_flight = SingleFlight("execute")
+
+class PreparedQuery(BaseModel):
+    creds: DBConnection
+    sql: str
+    generated_sql: str
+    cache_key: str
+    sql_cached: bool = False
+    warnings: List[str] = []
+    execution_timeout: float = STAGE_TIMEOUTS["execute"]
+    # (sql, generated_sql) of an index-friendly rewrite that verify_plan adopts if its plan is no worse
+    index_rewrite: Optional[Tuple[str, str]] = None
+
+def row_limit_for(user_id: str, streaming: bool = False) -> int:
+    if streaming and user_id in TRUSTED_USERS:
+        return TRUSTED_STREAM_ROW_LIMIT
+    return DEFAULT_ROW_LIMIT
+
+def tier_for(user_id: str) -> str:
+    return USER_TIERS.get(user_id) or ("trusted" if user_id in TRUSTED_USERS else "default")
+
+def execution_timeout_for(user_id: str) -> float:
+    return float(EXECUTION_TIMEOUTS.get(tier_for(user_id), EXECUTION_TIMEOUTS["default"]))
+
+def _load_session(db_token: str) -> DBConnection:
+    cpu_start = time.thread_time()
+    creds = DBConnection(**decrypt_data(db_token))
+    session_cache.record_miss_cost(time.thread_time() - cpu_start)
+    return creds
+
+async def decrypt_session(db_token: str) -> DBConnection:
+    # Parsed sessions are cached by token digest, skipping Fernet and validation
+    creds = session_cache.get(db_token)
+    if creds is not None:
+        return creds
+
+    try:
+        creds = await with_timeout("decrypt", run_blocking(_load_session, db_token))
+    except StageTimeoutError:
+        raise
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid database session. Please reconnect.")
+
+    session_cache.set(db_token, creds)
+    return creds
+
+async def load_schema_entry(creds: DBConnection) -> dict:
+    """Schema cache entry for the database (cached, revalidated with a checksum query)."""
+    try:
+        return await schema_flight.do(
+            connection_fingerprint(creds),
+            lambda: with_timeout("schema", run_blocking(schema_cache.get_entry, creds)),
+        )
+    except StageTimeoutError:
+        raise
+    except Exception as e:
+         raise HTTPException(status_code=400, detail=f"Failed to fetch schema: {str(e)}")
+
+async def _generate(
+    creds: DBConnection, schema_entry: dict, prompt: str, max_limit: int
+) -> Tuple[str, Optional[Tuple[str, str]]]:
+    """(generated SQL, index rewrite for verify_plan to compare, or None)."""
+    # Prune the schema to the tables relevant to this question
+    schema_summary = await with_timeout(
+        "retrieval", run_blocking(schema_retriever.select, schema_entry, prompt)
+    )
+
+    llm_start = time.time()
+    try:
+        generated_sql = await with_timeout("llm", generate_sql(schema_summary, prompt))
+    except StageTimeoutError:
+        llm_errors.inc(kind="timeout")
+        raise
+    except Exception:
+        llm_errors.inc(kind="error")
+        raise
+    sql_cache.record_llm_latency((time.time() - llm_start) * 1000)
+    _reject_invalid(generated_sql)
+    return generated_sql, await _review_indexes(schema_entry, schema_summary, prompt, generated_sql, max_limit)
+
+async def _review_indexes(
+    schema_entry: dict,
+    schema_summary: str,
+    prompt: str,
+    generated_sql: str,
+    max_limit: int,
+) -> Optional[Tuple[str, str]]:
+    """
+    Checks freshly generated SQL for large tables filtered only on unindexed
+    columns. With rewrites enabled the LLM gets one chance to fix that; a
+    rewrite that passes SQLGuard is returned as (sql, generated_sql) for
+    verify_plan, which compares the plans inside the admission slot. None
+    keeps the original.
+    """
+    findings = index_advisor.check(generated_sql, schema_entry["tables"])
+    if not findings:
+        return None
+    problems = index_advisor.describe(findings)
+    app_logger.info("Predicates on unindexed columns", extra={"sql": generated_sql, "findings": findings})
+    if not index_advisor.rewrite:
+        return None
+    try:
+        original_sql = SQLGuard.validate_query(generated_sql, max_limit=max_limit)
+    except ValueError:
+        return None  # rejected in _guard
+
+    try:
+        rewritten = await with_timeout(
+            "llm", rewrite_sql_for_indexes(schema_summary, prompt, generated_sql, problems)
+        )
+    except Exception as e:
+        llm_errors.inc(kind="timeout" if isinstance(e, StageTimeoutError) else "error")
+        index_advisor.record_rewrite("failed")
+        app_logger.warning(f"Index rewrite failed: {str(e)}")
+        return None
+    try:
+        rewritten_sql = SQLGuard.validate_query(rewritten, max_limit=max_limit)
+    except ValueError as e:
+        index_advisor.record_rewrite("rejected")
+        app_logger.info(f"Index rewrite rejected: {str(e)}", extra={"sql": rewritten})
+        return None
+    if rewritten_sql == original_sql:
+        index_advisor.record_rewrite("unchanged")
+        return None
+    return rewritten_sql, rewritten
+
+async def _compare_rewrite(prepared: PreparedQuery, before: PlanVerdict, conn: "AsyncConnection") -> PlanVerdict:
+    """
+    EXPLAINs the index rewrite on `conn` and switches `prepared` to it when its
+    plan is safe and examines no more rows than `before`, the original's.
+    Returns the verdict of the SQL that will run.
+    """
+    rewritten_sql, rewritten = prepared.index_rewrite
+    prepared.index_rewrite = None
+    try:
+        after = await with_timeout("explain", ExplainGuard.evaluate(prepared.creds, rewritten_sql, conn))
+    except StageTimeoutError as e:
+        index_advisor.record_rewrite("failed")
+        app_logger.warning(f"Index rewrite failed: {str(e)}")
+        return before
+    if not after.is_safe or (before.is_safe and after.rows_examined > before.rows_examined):
+        index_advisor.record_rewrite("rejected")
+        app_logger.info("Index rewrite not used", extra={"sql": rewritten, "rows_examined": after.rows_examined, "error": after.error})
+        return before
+
+    plan_changed = after.access != before.access or after.rows_examined != before.rows_examined
+    index_advisor.record_rewrite("adopted", plan_changed, before.rows_examined - after.rows_examined)
+    app_logger.info(
+        "Index rewrite used",
+        extra={"sql": rewritten, "plan_changed": plan_changed, "rows_examined": [before.rows_examined, after.rows_examined]},
+    )
+    prepared.sql, prepared.generated_sql = rewritten_sql, rewritten
+    return after
+
+def _reject_invalid(generated_sql: str):
+    if "INVALID_QUERY" in generated_sql:
+         llm_errors.inc(kind="invalid_query")
+         raise HTTPException(status_code=400, detail="Cannot answer this question with the available schema or request is unsafe.")
+
+async def _guard(
+    creds: DBConnection,
+    generated_sql: str,
+    cache_key: str,
+    sql_cached: bool,
+    user_id: str,
+    max_limit: int,
+    index_rewrite: Optional[Tuple[str, str]] = None,
+) -> PreparedQuery:
+    app_logger.info("Generated SQL", extra={"user_id": user_id, "sql": generated_sql, "sql_cached": sql_cached})
+
+    # SQL Validation (Static)
+    try:
+        with timed_stage("sql_guard"):
+            clean_sql = SQLGuard.validate_query(generated_sql, max_limit=max_limit)
+    except ValueError as ve:
+         guard_rejections.inc(guard="sql")
+         if sql_cached:
+             await sql_cache.invalidate(cache_key)
+         app_logger.warning(f"SQL Guard blocked query: {str(ve)}")
+         raise HTTPException(status_code=400, detail=f"Safety violation: {str(ve)}")
+
+    return PreparedQuery(
+        creds=creds,
+        sql=clean_sql,
+        generated_sql=generated_sql,
+        cache_key=cache_key,
+        sql_cached=sql_cached,
+        execution_timeout=execution_timeout_for(user_id),
+        index_rewrite=index_rewrite,
+    )
+
+async def prepare_query(
+    creds: DBConnection,
+    prompt: str,
+    user_id: str,
+    max_limit: int = DEFAULT_ROW_LIMIT,
+    schema_entry: Optional[dict] = None,
+) -> PreparedQuery:
+    """
+    Schema lookup (unless `schema_entry` is given), SQL generation (or cache hit)
+    and SQLGuard. The EXPLAIN check runs later in verify_plan, on the connection
+    that will execute the query.
+    """
+    if schema_entry is None:
+        schema_entry = await load_schema_entry(creds)
+
+    # LLM Generation (skipped when this question was already answered for this schema)
+    cache_key = make_cache_key(schema_entry["summary_hash"], prompt)
+    generated_sql = await sql_cache.get(cache_key)
+    sql_cached = generated_sql is not None
+    index_rewrite = None
+
+    if not sql_cached:
+        # Identical questions in flight for the same schema and row cap share one generation
+        generated_sql, index_rewrite = await llm_flight.do(
+            (cache_key, max_limit), lambda: _generate(creds, schema_entry, prompt, max_limit)
+        )
+
+    return await _guard(creds, generated_sql, cache_key, sql_cached, user_id, max_limit, index_rewrite)
+
+async def stream_prepare_query(
+    creds: DBConnection,
+    prompt: str,
+    user_id: str,
+    max_limit: int = DEFAULT_ROW_LIMIT,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Streaming prepare_query: yields ("token", text) while the LLM writes the SQL
+    (nothing on a SQL cache hit), then ("prepared", PreparedQuery). The whole
+    output is validated, as in prepare_query, under the same "llm" deadline.
+    """
+    schema_entry = await load_schema_entry(creds)
+    cache_key = make_cache_key(schema_entry["summary_hash"], prompt)
+    generated_sql = await sql_cache.get(cache_key)
+    sql_cached = generated_sql is not None
+    index_rewrite = None
+
+    if not sql_cached:
+        schema_summary = await with_timeout(
+            "retrieval", run_blocking(schema_retriever.select, schema_entry, prompt)
+        )
+
+        llm_start = time.time()
+        text = ""
+        try:
+            with timed_stage("llm"):
+                async for delta in iterate_with_timeout("llm", stream_sql(schema_summary, prompt)):
+                    text += delta
+                    yield "token", delta
+        except StageTimeoutError:
+            llm_errors.inc(kind="timeout")
+            raise
+        except Exception:
+            llm_errors.inc(kind="error")
+            raise
+        sql_cache.record_llm_latency((time.time() - llm_start) * 1000)
+        generated_sql = clean_sql_output(text)
+        _reject_invalid(generated_sql)
+        index_rewrite = await _review_indexes(schema_entry, schema_summary, prompt, generated_sql, max_limit)
+
+    yield "prepared", await _guard(creds, generated_sql, cache_key, sql_cached, user_id, max_limit, index_rewrite)
+
+async def open_connection(creds: DBConnection) -> "AsyncConnection":
+    """
+    Pooled connection to the host replica_router picks for `creds`. A replica that
+    can't be reached is marked down and the next choice tried, down to the primary.
+    The caller closes it.
+    """
+    tried = []
+    while True:
+        host = replica_router.route(creds, exclude=tried)
+        conn = get_async_engine_for_creds(host).connect()
+        try:
+            return await conn.start()
+        except Exception as e:
+            if replica_router.is_primary(host, creds):
+                raise
+            replica_router.mark_down(host, e)
+            tried.append(connection_fingerprint(host))
+
+@asynccontextmanager
+async def connect(creds: DBConnection) -> AsyncIterator["AsyncConnection"]:
+    """Pooled connection used for both the EXPLAIN check and execution."""
+    conn = await open_connection(creds)
+    try:
+        yield conn
+    finally:
+        await conn.close()
+
+async def verify_plan(prepared: PreparedQuery, conn: "AsyncConnection") -> PreparedQuery:
+    """
+    Deep validation (EXPLAIN) on `conn`, choosing between the SQL and its index
+    rewrite when there is one; stores the generated SQL in the cache once it passes.
+    """
+    verdict = await with_timeout("explain", ExplainGuard.evaluate(prepared.creds, prepared.sql, conn))
+    if prepared.index_rewrite is not None:
+        verdict = await _compare_rewrite(prepared, verdict, conn)
+    if not verdict.is_safe:
+         guard_rejections.inc(guard="explain")
+         if prepared.sql_cached:
+             await sql_cache.invalidate(prepared.cache_key)
+         app_logger.warning(f"Explain Guard blocked query: {verdict.error}")
+         raise HTTPException(status_code=400, detail=f"Query failed safety check (EXPLAIN analysis): {verdict.error}")
+
+    if verdict.warnings:
+        app_logger.warning("Explain Guard warnings", extra={"sql": prepared.sql, "warnings": verdict.warnings})
+
+    # Only SQL that passed both guards is cached
+    if not prepared.sql_cached:
+        await sql_cache.set(prepared.cache_key, prepared.generated_sql)
+
+    prepared.warnings = verdict.warnings
+    return prepared
+
+# Strong references to KILL QUERY tasks started from cancelled requests
+_kill_tasks: set = set()
+
+async def _server_thread_id(conn: "AsyncConnection") -> Optional[int]:
+    """MySQL connection id of `conn`, for KILL QUERY; None on other databases."""
+    if conn.dialect.name != "mysql":
+        return None
+    raw = await conn.get_raw_connection()
+    # Sent in the handshake, so usually no round trip is needed
+    thread_id = getattr(raw.driver_connection, "server_thread_id", None)
+    if thread_id:
+        return thread_id[0]
+    return (await conn.execute(text("SELECT CONNECTION_ID()"))).scalar()
+
+def _is_server_timeout(error: Exception) -> bool:
+    args = getattr(getattr(error, "orig", error), "args", ())
+    return bool(args) and args[0] in SERVER_TIMEOUT_ERRORS
+
+async def kill_query(conn: "AsyncConnection", thread_id: int):
+    """Stops the statement running on MySQL thread `thread_id` from a separate pooled connection."""
+    async def kill():
+        async with conn.engine.connect() as side:
+            await side.execute(text(f"KILL QUERY {int(thread_id)}"))
+    try:
+        await with_timeout("kill", kill())
+        kill_queries.inc(outcome="ok")
+    except Exception as e:
+        kill_queries.inc(outcome="failed")
+        app_logger.warning(f"KILL QUERY failed: {str(e)}", extra={"thread_id": thread_id})
+
+async def _abandon(conn: "AsyncConnection", thread_id: Optional[int], reason: str, wait: bool = True):
+    """
+    Drops a connection whose statement did not finish (it may be mid-result) and
+    kills the statement on the server. With `wait=False` the kill runs in the
+    background, so a cancellation is not held up by it.
+    """
+    query_cancellations.inc(reason=reason)
+    await conn.invalidate()
+    if thread_id is None:
+        return
+    if wait:
+        await kill_query(conn, thread_id)
+    else:
+        task = asyncio.ensure_future(kill_query(conn, thread_id))
+        _kill_tasks.add(task)
+        task.add_done_callback(_kill_tasks.discard)
+
+async def execute_query(
+    conn: "AsyncConnection",
+    sql: str,
+    timeout: float = STAGE_TIMEOUTS["execute"],
+    params: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[str], List[tuple]]:
+    """
+    Runs validated SQL and returns (column_names, rows) with rows as plain tuples
+    in column order, ready for result_encoding.
+    The statement carries a MAX_EXECUTION_TIME hint of `timeout`; if it is still
+    running shortly after that, or the caller is cancelled, it is killed on the
+    server and the connection is discarded.
+    """
+    thread_id = await _server_thread_id(conn)
+
+    async def execute():
+        result = await conn.execute(text(with_max_execution_time(sql, int(timeout * 1000))), params or {})
+        return list(result.keys()), [tuple(row) for row in result]
+
+    try:
+        return await with_timeout("execute", execute(), timeout=timeout + EXECUTION_DEADLINE_GRACE)
+    except StageTimeoutError:
+        await _abandon(conn, thread_id, "deadline")
+        raise StageTimeoutError("execute", timeout)
+    except asyncio.CancelledError:
+        await _abandon(conn, thread_id, "cancelled", wait=False)
+        raise
+    except Exception as e:
+         if _is_server_timeout(e):
+             query_cancellations.inc(reason="server_deadline")
+             stage_timeouts.inc(stage="execute")
+             raise StageTimeoutError("execute", timeout)
+         app_logger.error(f"Execution error: {str(e)}")
+         raise HTTPException(status_code=500, detail=f"Database execution error: {str(e)}")
+
+async def _table_update_marker(conn: "AsyncConnection", creds: DBConnection, tables: Tuple[str, ...]) -> str:
+    result = await conn.execute(TABLE_UPDATE_TIMES_SQL, {"db": creds.database.strip(), "tables": list(tables)})
+    return repr(sorted((name, str(updated)) for name, updated in result))
+
+async def cached_result(prepared: PreparedQuery) -> Optional[Tuple[List[str], List[tuple]]]:
+    """
+    Result cache lookup for validated SQL. Entries that track table UPDATE_TIME are
+    revalidated with one information_schema query per check interval; any failure
+    there is treated as a miss.
+    """
+    if result_cache.ttl_for(prepared.creds) <= 0:
+        return None
+    key = result_cache.make_key(prepared.creds, prepared.sql)
+    entry = result_cache.get(key)
+    if entry is None:
+        return None
+
+    if result_cache.needs_check(entry):
+        async def check():
+            async with connect(prepared.creds) as conn:
+                return await _table_update_marker(conn, prepared.creds, entry["tables"])
+        try:
+            marker = await with_timeout("result_cache", check())
+        except Exception as e:
+            app_logger.warning(f"Result cache revalidation failed: {str(e)}")
+            return None
+        if marker != entry["update_marker"]:
+            result_cache.invalidate(key)
+            return None
+        result_cache.mark_checked(entry)
+
+    result_cache.record_hit(entry)
+    if not prepared.sql_cached:
+        # The SQL already passed ExplainGuard when this result was stored
+        await sql_cache.set(prepared.cache_key, prepared.generated_sql)
+    return entry["column_names"], entry["rows"]
+
+async def run_query(
+    prepared: PreparedQuery,
+    use_cache: bool = True,
+    on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+) -> Tuple[List[str], List[tuple], bool]:
+    """
+    Result cache, or EXPLAIN check + execution on one pooled connection (storing
+    the result when caching is enabled for the database).
+    `on_event(name, data)` is told when the plan check has passed ("explain") and
+    execution starts ("execute"); a caller that joined another request's run
+    gets neither. Returns (column_names, rows, result_cached).
+    """
+    def notify(name: str, data: Dict[str, Any]):
+        if on_event is not None:
+            on_event(name, data)
+
+    if use_cache:
+        cached = await cached_result(prepared)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+    ttl = result_cache.ttl_for(prepared.creds) if use_cache else 0
+    ran = False
+
+    async def explain_and_execute():
+        nonlocal ran
+        ran = True
+        tables, marker = (), None
+        start = time.perf_counter()
+        async with connect(prepared.creds) as conn:
+            await verify_plan(prepared, conn)
+            notify("explain", {"warnings": prepared.warnings})
+            if ttl > 0 and result_cache.track_update_time:
+                tables = referenced_tables(prepared.sql)
+                if tables:
+                    # Read before execution, so writes racing the query invalidate the entry
+                    marker = await with_timeout("result_cache", _table_update_marker(conn, prepared.creds, tables))
+            notify("execute", {"status": "running"})
+            column_names, rows = await execute_query(conn, prepared.sql, prepared.execution_timeout)
+
+        if ttl > 0:
+            result_cache.set(
+                result_cache.make_key(prepared.creds, prepared.sql), column_names, rows, ttl,
+                tables=tables, update_marker=marker, cost_ms=(time.perf_counter() - start) * 1000,
+            )
+        return column_names, rows, prepared.warnings
+
+    # Identical SQL in flight on the same database runs once, shared only by
+    # callers with the same execution timeout and result caching
+    column_names, rows, warnings = await query_flight.do(
+        (result_cache.make_key(prepared.creds, prepared.sql), prepared.execution_timeout, use_cache),
+        explain_and_execute,
+    )
+    if not ran:
+        # Joined another request's run: its plan check covers this SQL too
+        prepared.warnings = warnings
+        if not prepared.sql_cached:
+            await sql_cache.set(prepared.cache_key, prepared.generated_sql)
+    return column_names, rows, False
+
+def first_page_cursor(prepared: PreparedQuery, column_names: List[str], rows: List[tuple], user_id: str) -> Optional[str]:
+    """Continuation cursor when the row cap cut this result short, else None."""
+    # Primary keys (for keyset pages) come from the cached schema, never a fresh load
+    entry = schema_cache.peek(prepared.creds)
+    primary_keys = {
+        name: [column["name"] for column in table["columns"] if column["key"] == "PRI"]
+        for name, table in (entry["tables"] if entry else {}).items()
+    }
+    return pagination.first_cursor(
+        prepared.sql, prepared.generated_sql, row_limit_for(user_id), column_names, rows,
+        user_id, connection_fingerprint(prepared.creds), primary_keys,
+    )
+
+async def fetch_page(
+    creds: DBConnection,
+    cursor: str,
+    user_id: str,
+) -> Tuple[str, List[str], List[tuple], Optional[str]]:
+    """
+    The page a cursor from first_page_cursor (or a previous page) points at:
+    (sql, column_names, rows, next_cursor). The SQL was validated when the cursor
+    was made, so neither the LLM nor the guards run again.
+    """
+    try:
+        state = pagination.read_cursor(cursor, user_id, connection_fingerprint(creds))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {str(e)}")
+
+    sql, params, count = pagination.page_query(state)
+    async with connect(creds) as conn:
+        column_names, rows = await execute_query(conn, sql, execution_timeout_for(user_id), params)
+    return sql, column_names, rows, pagination.next_cursor(state, rows, count)
+
+async def stream_query_rows(
+    conn: "AsyncConnection",
+    sql: str,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    timeout: float = STAGE_TIMEOUTS["execute"],
+) -> AsyncIterator[Tuple[List[str], List[tuple]]]:
+    """
+    Runs validated SQL on a server-side (unbuffered) cursor and yields
+    (column_names, rows) chunks, starting with an empty chunk. Each chunk is only
+    fetched after the consumer has taken the previous one, so a slow client slows
+    the cursor down instead of buffering rows in memory.
+    Takes ownership of `conn` and closes it. If the consumer stops early the
+    connection is invalidated rather than drained, which would read every
+    remaining row, and the statement is killed on the server.
+    `timeout` caps the statement through MAX_EXECUTION_TIME only: row fetching is
+    paced by the client.
+    """
+    completed = False
+    thread_id = None
+    try:
+        thread_id = await _server_thread_id(conn)
+        result = await conn.stream(text(with_max_execution_time(sql, int(timeout * 1000))))
+        column_names = list(result.keys())
+        # Column metadata goes out before the first row is fetched
+        yield column_names, []
+        async for partition in result.partitions(chunk_size):
+            yield column_names, [tuple(row) for row in partition]
+        completed = True
+    except (GeneratorExit, asyncio.CancelledError):
+        # Consumer stopped (client gone): the statement may still be running
+        completed = True
+        await _abandon(conn, thread_id, "stream_closed", wait=False)
+        raise
+    except Exception as e:
+        if _is_server_timeout(e):
+            query_cancellations.inc(reason="server_deadline")
+            stage_timeouts.inc(stage="execute")
+            raise StageTimeoutError("execute", timeout)
+        raise
+    finally:
+        if not completed:
+            await conn.invalidate()
+        await conn.close()
@@ -1,31 +1,205 @@
+import abc
+import math
+import os
+import sqlite3
+import threading
 import time
-from fastapi import HTTPException, Request, status
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from fastapi import HTTPException, status
+
+from async_utils import run_blocking
+
+# Sliding-window counter: each key keeps the start of its current fixed window and
+# the request counts of the current and previous windows. The rate over the last
+# `window_size` seconds is estimated as previous * (1 - elapsed / window) + current,
+# which is O(1) per check regardless of the limit.
+State = Tuple[float, int, int]  # (window_start, previous_count, current_count)
+
+def _roll(state: Optional[State], now: float, window: float) -> State:
+    window_start = now - (now % window)
+    if state is None:
+        return window_start, 0, 0
+    start, previous, current = state
+    if window_start == start:
+        return state
+    if window_start - start == window:
+        return window_start, current, 0
+    return window_start, 0, 0
+
+def _acquire(state: Optional[State], now: float, window: float, limit: int, cost: int = 1) -> Tuple[State, bool, float, float]:
+    """Returns (new_state, allowed, used, retry_after) for a request counting as `cost` requests."""
+    window_start, previous, current = _roll(state, now, window)
+    weight = 1 - (now - window_start) / window
+    used = previous * weight + current
+
+    if used + cost <= limit:
+        return (window_start, previous, current + cost), True, used + cost, 0.0
+
+    # Time until the decaying previous window frees a slot, or the next window starts
+    if current + cost > limit or previous == 0:
+        retry_after = window_start + window - now
+    else:
+        target_weight = (limit - cost - current) / previous
+        retry_after = (weight - target_weight) * window
+    return (window_start, previous, current), False, used, max(retry_after, 0.0)
+
+class RateLimitStatus:
+    def __init__(self, limit: int, remaining: int, reset_after: float, retry_after: float = 0.0):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_after = reset_after
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if self.retry_after:
+            headers["Retry-After"] = str(max(1, math.ceil(self.retry_after)))
+        return headers
+
+class RateLimitBackend(abc.ABC):
+    """Storage interface: atomically applies `_acquire` to the state stored for `key`."""
+
+    # Backends doing I/O are called on the blocking pool, off the event loop
+    blocking = False
+
+    @abc.abstractmethod
+    def acquire(self, key: str, now: float, window: float, limit: int, cost: int = 1) -> Tuple[bool, float, float]:
+        """Returns (allowed, used, retry_after)."""
+
+class MemoryBackend(RateLimitBackend):
+    """In-process backend. Idle keys are evicted, and at most `max_keys` are kept (LRU)."""
+
+    def __init__(self, max_keys: int = 100_000, idle_ttl: float = 120):
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self._states = OrderedDict()  # {key: (state, last_seen)}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+
+    def acquire(self, key: str, now: float, window: float, limit: int, cost: int = 1) -> Tuple[bool, float, float]:
+        with self._lock:
+            entry = self._states.get(key)
+            state, allowed, used, retry_after = _acquire(entry[0] if entry else None, now, window, limit, cost)
+            self._states[key] = (state, now)
+            self._states.move_to_end(key)
+            self._evict(now)
+            return allowed, used, retry_after
+
+    def _evict(self, now: float):
+        while len(self._states) > self.max_keys:
+            self._states.popitem(last=False)
+        if now - self._last_sweep < self.idle_ttl:
+            return
+        self._last_sweep = now
+        # Entries are in last-seen order, so idle ones sit at the front
+        while self._states:
+            key, (_, last_seen) = next(iter(self._states.items()))
+            if now - last_seen <= self.idle_ttl:
+                break
+            del self._states[key]
+
+class SQLiteBackend(RateLimitBackend):
+    """
+    Shared backend for several uvicorn workers on one host. Each check is a single
+    IMMEDIATE transaction on a WAL-mode SQLite file, so the read-modify-write is
+    atomic across processes. A check may wait on the file lock (up to 5s), so it
+    runs on the blocking pool.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str, idle_ttl: float = 120):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limits ("
+            " key TEXT PRIMARY KEY, window_start REAL, previous INTEGER, current INTEGER, last_seen REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, key: str, now: float, window: float, limit: int, cost: int = 1) -> Tuple[bool, float, float]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT window_start, previous, current FROM rate_limits WHERE key = ?", (key,)
+            ).fetchone()
+            state, allowed, used, retry_after = _acquire(tuple(row) if row else None, now, window, limit, cost)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (key, window_start, previous, current, last_seen)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, state[0], state[1], state[2], now),
+            )
+            if now - self._last_sweep > self.idle_ttl:
+                self._last_sweep = now
+                conn.execute("DELETE FROM rate_limits WHERE last_seen < ?", (now - self.idle_ttl,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, used, retry_after
 
 class RateLimiter:
-    def __init__(self, requests_per_minute: int = 10):
+    def __init__(self, requests_per_minute: int = 10, backend: Optional[RateLimitBackend] = None):
         self.requests_per_minute = requests_per_minute
         self.window_size = 60  # seconds
-        self.requests = {}  # In-memory storage: {user_id: [timestamps]}
-
-    def check_rate_limit(self, user_id: str):
-        current_time = time.time()
-        
-        if user_id not in self.requests:
-            self.requests[user_id] = []
-        
-        # Filter out timestamps older than the window
-        self.requests[user_id] = [
-            t for t in self.requests[user_id] 
-            if current_time - t < self.window_size
-        ]
-        
-        if len(self.requests[user_id]) >= self.requests_per_minute:
+        self.backend = backend or MemoryBackend(idle_ttl=2 * self.window_size)
+
+    async def check_rate_limit(self, user_id: str, cost: int = 1) -> RateLimitStatus:
+        """
+        Counts `cost` requests (e.g. one per question in a batch) or raises 429.
+        A cost above the per-minute limit could never be admitted, so it is
+        rejected with 400 instead of a Retry-After that can't succeed.
+        """
+        if cost > self.requests_per_minute:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"This request counts as {cost} requests, more than the limit of {self.requests_per_minute} per minute.",
+            )
+        now = time.time()
+        args = (user_id, now, self.window_size, self.requests_per_minute, cost)
+        if self.backend.blocking:
+            allowed, used, retry_after = await run_blocking(self.backend.acquire, *args)
+        else:
+            allowed, used, retry_after = self.backend.acquire(*args)
+        limit_status = RateLimitStatus(
+            limit=self.requests_per_minute,
+            remaining=max(0, int(self.requests_per_minute - used)),
+            reset_after=self.window_size - (now % self.window_size),
+            retry_after=retry_after,
+        )
+
+        if not allowed:
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded. Please wait a moment."
+                detail="Rate limit exceeded. Please wait a moment.",
+                headers=limit_status.headers(),
             )
-            
-        self.requests[user_id].append(current_time)
+
+        return limit_status
+
+def _build_backend() -> RateLimitBackend:
+    if os.getenv("RATE_LIMIT_BACKEND", "memory") == "sqlite":
+        return SQLiteBackend(os.getenv("RATE_LIMIT_SQLITE_PATH", "/tmp/askdb_rate_limits.sqlite3"))
+    return MemoryBackend(max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000)))
 
 # Global instance
-rate_limiter = RateLimiter(requests_per_minute=20)
+rate_limiter = RateLimiter(
+    requests_per_minute=int(os.getenv("RATE_LIMIT_PER_MINUTE", 20)),
+    backend=_build_backend(),
+)
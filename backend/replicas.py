@@ -0,0 +1,232 @@
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from async_utils import blocking_executor
+from db import DBConnection, connection_fingerprint, target_key, get_engine_for_creds
+from logger import app_logger
+from metrics import registry
+
+db_host_statements = registry.counter(
+    "askdb_db_host_statements_total", "Statements run per routed database host", ["target", "role"]
+)
+db_host_errors = registry.counter(
+    "askdb_db_host_errors_total", "Connection-level errors per routed database host", ["target", "role"]
+)
+replica_failovers = registry.counter(
+    "askdb_replica_failovers_total", "Reads sent to the primary because no replica was usable"
+)
+
+def _url_key(url) -> Tuple:
+    return (url.host, url.port, url.database, url.username)
+
+class ReplicaRouter:
+    """
+    Picks the host for read traffic on databases whose session lists replicas
+    (all traffic is reads under SQLGuard). Among healthy replicas two are drawn at
+    random and the one with the lower EWMA statement latency wins; when none is
+    usable the read fails over to the primary.
+    Health is checked lazily (at most every `check_interval` seconds per host, on
+    the blocking pool): SELECT 1, plus the replication delay when `max_lag` is
+    set, which takes replicas further behind than that out of rotation.
+    Statement latency and connection errors are observed through engine events,
+    installed the first time a replica set is routed.
+    """
+
+    def __init__(self, check_interval: float = 10, max_lag: float = 0, ewma_alpha: float = 0.2):
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.ewma_alpha = ewma_alpha
+        self._hosts: Dict[str, Dict[str, Any]] = {}  # {host fingerprint: state}
+        self._by_url: Dict[Tuple, Dict[str, Any]] = {}  # {(host, port, db, user): state}
+        self._lock = threading.Lock()
+        self._listening = False
+        self.failovers = 0
+
+    def _host(self, creds: DBConnection, role: str, host: Optional[str] = None, port: Optional[int] = None) -> Dict[str, Any]:
+        # Caller holds the lock
+        host_creds = creds.model_copy(update={
+            "host": (host or creds.host).strip(),
+            "port": port or creds.port,
+            "replicas": [],
+        })
+        key = connection_fingerprint(host_creds)
+        state = self._hosts.get(key)
+        if state is None:
+            state = {
+                "key": key,
+                "creds": host_creds,
+                "target": target_key(host_creds),
+                "role": role,
+                "healthy": True,  # until a check or an error says otherwise
+                "lag": None,
+                "ewma_ms": None,
+                "routed": 0,
+                "statements": 0,
+                "errors": 0,
+                "checked_at": 0.0,
+                "checking": False,
+            }
+            self._hosts[key] = state
+            self._by_url[(host_creds.host, host_creds.port, host_creds.database.strip(), host_creds.user.strip())] = state
+        return state
+
+    def route(self, creds: DBConnection, exclude: Iterable[str] = ()) -> DBConnection:
+        """
+        Credentials of the host to read from: `creds` itself without replicas,
+        else the best usable replica not in `exclude` (host fingerprints), else
+        the primary.
+        """
+        if not creds.replicas:
+            return creds
+        if not self._listening:
+            self._listen()
+
+        now = time.monotonic()
+        with self._lock:
+            candidates = []
+            for endpoint in creds.replicas:
+                state = self._host(creds, "replica", endpoint.host, endpoint.port)
+                self._maybe_check(state, now)
+                if state["healthy"] and state["key"] not in exclude:
+                    candidates.append(state)
+            if candidates:
+                # Power of two choices; hosts without samples yet are tried first
+                pair = random.sample(candidates, min(2, len(candidates)))
+                chosen = min(pair, key=lambda s: s["ewma_ms"] or 0.0)
+            else:
+                chosen = self._host(creds, "primary")
+                self._maybe_check(chosen, now)
+                self.failovers += 1
+                replica_failovers.inc()
+            chosen["routed"] += 1
+            return chosen["creds"]
+
+    def is_primary(self, host_creds: DBConnection, creds: DBConnection) -> bool:
+        return connection_fingerprint(host_creds) == connection_fingerprint(creds)
+
+    def mark_down(self, host_creds: DBConnection, error: Exception):
+        """Takes a host out of rotation until its next successful health check."""
+        with self._lock:
+            state = self._hosts.get(connection_fingerprint(host_creds))
+            if state is None:
+                return
+            state["healthy"] = False
+            state["errors"] += 1
+            state["checked_at"] = time.monotonic()
+        db_host_errors.inc(target=state["target"], role=state["role"])
+        app_logger.warning(f"Database host marked down: {str(error)}", extra={"target": state["target"], "role": state["role"]})
+
+    def _maybe_check(self, state: Dict[str, Any], now: float):
+        # Caller holds the lock
+        if state["checking"] or now - state["checked_at"] < self.check_interval:
+            return
+        state["checking"] = True
+        blocking_executor.submit(self._check, state)
+
+    def _check(self, state: Dict[str, Any]):
+        healthy, lag = True, None
+        try:
+            with get_engine_for_creds(state["creds"]).connect() as conn:
+                conn.execute(text("SELECT 1"))
+                if self.max_lag and state["role"] == "replica":
+                    lag = self._replication_lag(conn)
+        except Exception as e:
+            healthy = False
+            app_logger.warning(f"Database health check failed: {str(e)}", extra={"target": state["target"], "role": state["role"]})
+
+        with self._lock:
+            was_healthy = state["healthy"]
+            state["lag"] = lag
+            state["healthy"] = healthy and (lag is None or lag <= self.max_lag)
+            state["checked_at"] = time.monotonic()
+            state["checking"] = False
+        if state["healthy"] != was_healthy:
+            app_logger.info(
+                "Database host " + ("back in rotation" if state["healthy"] else "out of rotation"),
+                extra={"target": state["target"], "role": state["role"], "lag": lag},
+            )
+
+    @staticmethod
+    def _replication_lag(conn) -> Optional[float]:
+        """Seconds behind the source (inf when replication is stopped), None when unknown."""
+        for statement, column in (
+            ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),  # MySQL 8.0.22+
+            ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),
+        ):
+            try:
+                row = conn.execute(text(statement)).mappings().first()
+            except Exception:
+                continue
+            if row is None:
+                return None
+            value = row.get(column)
+            return math.inf if value is None else float(value)
+        return None
+
+    def _listen(self):
+        with self._lock:
+            if self._listening:
+                return
+            event.listen(Engine, "before_cursor_execute", self._before_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_execute)
+            event.listen(Engine, "handle_error", self._on_error)
+            self._listening = True
+
+    @staticmethod
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._routed_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        state = self._by_url.get(_url_key(conn.engine.url))
+        start = getattr(context, "_routed_start", None)
+        if state is None or start is None:
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            state["statements"] += 1
+            previous = state["ewma_ms"]
+            state["ewma_ms"] = elapsed_ms if previous is None else previous + self.ewma_alpha * (elapsed_ms - previous)
+        db_host_statements.inc(target=state["target"], role=state["role"])
+
+    def _on_error(self, context):
+        if not context.is_disconnect or context.engine is None:
+            return
+        state = self._by_url.get(_url_key(context.engine.url))
+        if state is not None:
+            self.mark_down(state["creds"], context.original_exception)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "failovers": self.failovers,
+                "hosts": [
+                    {
+                        "target": state["target"],
+                        "role": state["role"],
+                        "healthy": state["healthy"],
+                        # inf (replication stopped) is reported as not running
+                        "lag_seconds": state["lag"] if state["lag"] is None or math.isfinite(state["lag"]) else None,
+                        "replication_running": state["lag"] is None or math.isfinite(state["lag"]),
+                        "latency_ewma_ms": None if state["ewma_ms"] is None else round(state["ewma_ms"], 2),
+                        "routed": state["routed"],
+                        "statements": state["statements"],
+                        "errors": state["errors"],
+                    }
+                    for state in self._hosts.values()
+                ],
+            }
+
+# Global instance
+replica_router = ReplicaRouter(
+    check_interval=float(os.getenv("REPLICA_CHECK_INTERVAL", 10)),
+    max_lag=float(os.getenv("REPLICA_MAX_LAG", 0)),
+    ewma_alpha=float(os.getenv("REPLICA_EWMA_ALPHA", 0.2)),
+)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from db import DBConnection, connection_fingerprint, target_key
+
+# Row sizes are estimated from a sample for large results
+_SIZE_SAMPLE_ROWS = 200
+
+def estimate_size(column_names: List[str], rows: List[tuple]) -> int:
+    """Approximate in-memory size (bytes) of a result: list, row tuples and their values."""
+    size = sys.getsizeof(rows) + sum(sys.getsizeof(name) for name in column_names)
+    if not rows:
+        return size
+    step = max(1, len(rows) // _SIZE_SAMPLE_ROWS)
+    sample = rows[::step]
+    sample_size = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in sample)
+    return size + sample_size * len(rows) // len(sample)
+
+class ResultCache:
+    """
+    Query results keyed by database fingerprint + validated SQL, so a hit skips
+    both the EXPLAIN check and execution. Entries expire after a per-database TTL
+    (0 disables caching for that database) and are evicted LRU once the estimated
+    size of all results exceeds `max_bytes`.
+    With `track_update_time`, an entry also remembers information_schema UPDATE_TIME
+    of the tables it reads; once every `check_interval` seconds a hit is revalidated
+    against it (the query itself lives in pipeline.py).
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        default_ttl: float = 0,
+        ttl_overrides: Optional[Dict[str, float]] = None,
+        max_entry_bytes: Optional[int] = None,
+        track_update_time: bool = False,
+        check_interval: float = 5,
+    ):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttl_overrides = ttl_overrides or {}  # {"host:port/db": ttl}
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 8
+        self.track_update_time = track_update_time
+        self.check_interval = check_interval
+        self._entries = OrderedDict()  # {key: entry}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.too_large = 0
+        self.db_ms_saved = 0.0
+
+    def ttl_for(self, creds: DBConnection) -> float:
+        return self.ttl_overrides.get(target_key(creds), self.default_ttl)
+
+    @staticmethod
+    def make_key(creds: DBConnection, sql: str) -> str:
+        return f"{connection_fingerprint(creds)}:{hashlib.sha256(sql.encode('utf-8')).hexdigest()}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry["expires_at"] > now:
+                    self._entries.move_to_end(key)
+                    return entry
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def needs_check(self, entry: Dict[str, Any]) -> bool:
+        return (
+            self.track_update_time
+            and bool(entry["tables"])
+            and time.monotonic() - entry["checked_at"] >= self.check_interval
+        )
+
+    def mark_checked(self, entry: Dict[str, Any]):
+        with self._lock:
+            entry["checked_at"] = time.monotonic()
+
+    def record_hit(self, entry: Dict[str, Any]):
+        with self._lock:
+            self.hits += 1
+            self.db_ms_saved += entry["cost_ms"]
+
+    def set(
+        self,
+        key: str,
+        column_names: List[str],
+        rows: List[tuple],
+        ttl: float,
+        tables: Tuple[str, ...] = (),
+        update_marker: Optional[str] = None,
+        cost_ms: float = 0.0,
+    ) -> bool:
+        """Stores a result; returns False when it is too large to cache."""
+        if ttl <= 0:
+            return False
+        size = estimate_size(column_names, rows)
+        if size > self.max_entry_bytes:
+            with self._lock:
+                self.too_large += 1
+            return False
+
+        now = time.monotonic()
+        entry = {
+            "column_names": column_names,
+            "rows": rows,
+            "size": size,
+            "tables": tables,
+            "update_marker": update_marker,
+            "cost_ms": cost_ms,
+            "expires_at": now + ttl,
+            "checked_at": now,
+        }
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = entry
+            self._bytes += size
+            self.stores += 1
+            while self._bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+        return True
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if self._drop(key):
+                self.invalidations += 1
+
+    def _drop(self, key: str) -> bool:
+        # Caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry["size"]
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "too_large": self.too_large,
+                "db_ms_saved": round(self.db_ms_saved, 2),
+            }
+
+# Global instance (RESULT_CACHE_TTL=0, the default, leaves it off unless a
+# database is enabled through RESULT_CACHE_TTL_OVERRIDES)
+result_cache = ResultCache(
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    default_ttl=float(os.getenv("RESULT_CACHE_TTL", 0)),
+    ttl_overrides=json.loads(os.getenv("RESULT_CACHE_TTL_OVERRIDES", "{}")),
+    max_entry_bytes=int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES") or 0) or None,
+    track_update_time=os.getenv("RESULT_CACHE_CHECK_UPDATE_TIME", "false").lower() == "true",
+    check_interval=float(os.getenv("RESULT_CACHE_CHECK_INTERVAL", 5)),
+)
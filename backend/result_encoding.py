@@ -0,0 +1,110 @@
+import datetime
+import decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+
+# Response formats for /query/ask results:
+#   rows     - {"results": [{col: value}, ...]} (the original shape, default)
+#   columnar - {"columns": [[values of col 0], [values of col 1], ...]}
+#   msgpack  - columnar payload packed with MessagePack
+#   arrow    - Arrow IPC stream, query metadata in the schema metadata
+FORMATS = ("rows", "columnar", "msgpack", "arrow")
+
+MEDIA_TYPES = {
+    "rows": "application/json",
+    "columnar": "application/json",
+    "msgpack": "application/x-msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+_ACCEPT_FORMATS = {
+    "application/x-msgpack": "msgpack",
+    "application/msgpack": "msgpack",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.askdb.columnar+json": "columnar",
+}
+
+class UnsupportedFormatError(ValueError):
+    pass
+
+def negotiate_format(requested: Optional[str], accept: Optional[str]) -> str:
+    """An explicit `format` field wins; otherwise the first recognised Accept media type."""
+    if requested:
+        if requested not in FORMATS:
+            raise UnsupportedFormatError(f"Unknown result format '{requested}'. Use one of: {', '.join(FORMATS)}")
+        return requested
+    for media_type in (accept or "").split(","):
+        fmt = _ACCEPT_FORMATS.get(media_type.split(";")[0].strip().lower())
+        if fmt:
+            return fmt
+    return "rows"
+
+def _default(value: Any) -> Any:
+    # Mirrors FastAPI's jsonable_encoder for the types MySQL drivers return
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+def encode_json(payload: Any) -> bytes:
+    return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return _default(value)
+
+def _columns(rows: Sequence[Sequence[Any]], width: int) -> List[List[Any]]:
+    if not rows:
+        return [[] for _ in range(width)]
+    return [list(column) for column in zip(*rows)]
+
+def encode_result(
+    fmt: str,
+    meta: Dict[str, Any],
+    column_names: List[str],
+    rows: Sequence[Sequence[Any]],
+) -> Tuple[bytes, str]:
+    """
+    Encodes raw DBAPI rows (tuples in column order) plus response metadata
+    (sql, execution_time_ms, ...) straight to bytes. Returns (body, media_type).
+    """
+    if fmt == "rows":
+        payload = dict(meta, column_names=column_names, results=[dict(zip(column_names, row)) for row in rows])
+        return encode_json(payload), MEDIA_TYPES[fmt]
+
+    if fmt == "columnar":
+        payload = dict(meta, column_names=column_names, columns=_columns(rows, len(column_names)))
+        return encode_json(payload), MEDIA_TYPES[fmt]
+
+    if fmt == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            raise UnsupportedFormatError("MessagePack output requires the 'msgpack' package")
+        payload = dict(meta, column_names=column_names, columns=_columns(rows, len(column_names)))
+        return msgpack.packb(payload, default=_msgpack_default, use_bin_type=True), MEDIA_TYPES[fmt]
+
+    if fmt == "arrow":
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise UnsupportedFormatError("Arrow output requires the optional 'pyarrow' package")
+        columns = _columns(rows, len(column_names))
+        table = pa.Table.from_arrays(
+            [pa.array(values) for values in columns],
+            names=column_names,
+            metadata={key: encode_json(value) for key, value in meta.items()},
+        )
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), MEDIA_TYPES[fmt]
+
+    raise UnsupportedFormatError(f"Unknown result format '{fmt}'")
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from db import DBConnection, connection_fingerprint, load_schema, get_schema_checksum, format_schema_summary
+from replicas import replica_router
+
+class SchemaCache:
+    """
+    Caches schema summaries per database fingerprint.
+    An entry is served straight from memory until `check_interval` elapses; after that
+    a single checksum query decides whether the schema has to be reloaded. Entries older
+    than `ttl` are always reloaded.
+    """
+
+    def __init__(self, ttl: float = 3600, check_interval: float = 60, max_entries: int = 64):
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # {fingerprint: entry}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.invalidations = 0
+
+    def _load(self, host: DBConnection, key: str, checksum: Optional[str] = None) -> Dict[str, Any]:
+        # Checksum and schema both come from `host`, so replicas lagging by
+        # different amounts can't pair a schema with another one's checksum
+        if checksum is None:
+            checksum = get_schema_checksum(host)
+        tables = load_schema(host)
+        summary = format_schema_summary(tables)
+        now = time.monotonic()
+        entry = {
+            "tables": tables,
+            "summary": summary,
+            "summary_hash": hashlib.sha256(summary.encode("utf-8")).hexdigest(),
+            "checksum": checksum,
+            "loaded_at": now,
+            "checked_at": now,
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get_entry(self, creds: DBConnection) -> Dict[str, Any]:
+        key = connection_fingerprint(creds)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry["loaded_at"] < self.ttl and now - entry["checked_at"] < self.check_interval:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        host = replica_router.route(creds)
+        if entry and now - entry["loaded_at"] < self.ttl:
+            # Stale check window: one cheap query decides whether to reload
+            checksum = get_schema_checksum(host)
+            if checksum == entry["checksum"]:
+                with self._lock:
+                    entry["checked_at"] = now
+                    self.hits += 1
+                    self.revalidations += 1
+                return entry
+            with self._lock:
+                self.invalidations += 1
+                self.misses += 1
+            return self._load(host, key, checksum)
+
+        with self._lock:
+            self.misses += 1
+        return self._load(host, key)
+
+    def get_summary(self, creds: DBConnection) -> str:
+        return self.get_entry(creds)["summary"]
+
+    def peek(self, creds: DBConnection) -> Optional[Dict[str, Any]]:
+        """Cached entry as is (no revalidation, no load, no counters), or None."""
+        with self._lock:
+            return self._entries.get(connection_fingerprint(creds))
+
+    def refresh(self, creds: DBConnection) -> Dict[str, Any]:
+        """Drops any cached entry and reloads the schema immediately."""
+        key = connection_fingerprint(creds)
+        with self._lock:
+            self._entries.pop(key, None)
+            self.invalidations += 1
+        return self._load(replica_router.route(creds), key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "invalidations": self.invalidations,
+            }
+
+# Global instance
+schema_cache = SchemaCache(
+    ttl=float(os.getenv("SCHEMA_CACHE_TTL", 3600)),
+    check_interval=float(os.getenv("SCHEMA_CHECK_INTERVAL", 60)),
+    max_entries=int(os.getenv("SCHEMA_CACHE_SIZE", 64)),
+)
@@ -0,0 +1,179 @@
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Any, List, Set
+
+from db import format_schema_summary
+
+_IDENTIFIER_SPLIT = re.compile(r"[^A-Za-z0-9]+")
+_CAMEL_SPLIT = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits free text and identifiers into lowercase terms.
+    snake_case and camelCase identifiers are split into their parts, and the joined
+    identifier is kept as well so exact table/column names still score highest.
+    """
+    terms = []
+    for word in _IDENTIFIER_SPLIT.split(text or ""):
+        if not word:
+            continue
+        parts = _CAMEL_SPLIT.findall(word)
+        if len(parts) > 1:
+            terms.append(word.lower())
+        for part in parts:
+            terms.append(_stem(part.lower()))
+    return terms
+
+def _stem(term: str) -> str:
+    # Crude plural folding so "customers" matches a "customer" table
+    if len(term) > 3 and term.endswith("ies"):
+        return term[:-3] + "y"
+    if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+        return term[:-1]
+    return term
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token) used for prompt budgeting."""
+    return len(text) // 4 + 1
+
+class SchemaIndex:
+    """BM25 index over table names, column names and comments of one schema."""
+
+    TABLE_NAME_WEIGHT = 3
+
+    def __init__(self, tables: Dict[str, Dict[str, Any]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_terms: Dict[str, Counter] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        doc_freq = Counter()
+
+        for table_name, table in tables.items():
+            terms = tokenize(table_name) * self.TABLE_NAME_WEIGHT
+            terms += tokenize(table.get("comment", ""))
+            for col in table["columns"]:
+                terms += tokenize(col["name"])
+                terms += tokenize(col.get("comment", ""))
+            counts = Counter(terms)
+            self.doc_terms[table_name] = counts
+            self.doc_lengths[table_name] = len(terms)
+            doc_freq.update(counts.keys())
+
+        n_docs = len(self.doc_terms) or 1
+        self.avg_length = (sum(self.doc_lengths.values()) / n_docs) or 1
+        self.idf = {
+            term: math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+
+    def search(self, query: str) -> List[tuple]:
+        """Returns [(table_name, score)] for tables with a positive score, best first."""
+        query_terms = set(tokenize(query))
+        scores = []
+        for table_name, counts in self.doc_terms.items():
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[table_name] / self.avg_length)
+            score = 0.0
+            for term in query_terms:
+                tf = counts.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((table_name, score))
+        scores.sort(key=lambda item: item[1], reverse=True)
+        return scores
+
+class SchemaRetriever:
+    """
+    Picks the schema context for a question: the top-k BM25 matches plus tables one
+    foreign-key hop away, added in rank order until the token budget is spent.
+    Small schemas that already fit the budget are passed through unchanged.
+    """
+
+    def __init__(self, top_k: int = 8, token_budget: int = 3000):
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.pruned_requests = 0
+        self.tokens_full = 0
+        self.tokens_sent = 0
+
+    def _get_index(self, entry: Dict[str, Any]) -> SchemaIndex:
+        index = entry.get("index")
+        if index is None:
+            index = SchemaIndex(entry["tables"])
+            entry["index"] = index
+        return index
+
+    @staticmethod
+    def _neighbours(tables: Dict[str, Dict[str, Any]], selected: List[str]) -> List[str]:
+        selected_set: Set[str] = set(selected)
+        found: List[str] = []
+        for table_name, table in tables.items():
+            for fk in table.get("foreign_keys", []):
+                if table_name in selected_set and fk["ref_table"] not in selected_set:
+                    candidate = fk["ref_table"]
+                elif fk["ref_table"] in selected_set and table_name not in selected_set:
+                    candidate = table_name
+                else:
+                    continue
+                if candidate in tables and candidate not in found:
+                    found.append(candidate)
+        return found
+
+    def select(self, entry: Dict[str, Any], question: str) -> str:
+        """Returns the schema text to embed in the prompt for `question`."""
+        full_summary = entry["summary"]
+        full_tokens = estimate_tokens(full_summary)
+
+        if full_tokens <= self.token_budget:
+            self._record(full_tokens, full_tokens, pruned=False)
+            return full_summary
+
+        tables = entry["tables"]
+        ranked = [name for name, _ in self._get_index(entry).search(question)]
+        primary = ranked[:self.top_k]
+        candidates = primary + self._neighbours(tables, primary)
+        # Nothing matched lexically: fall back to schema order so the prompt is never empty
+        if not candidates:
+            candidates = list(tables)
+
+        chosen: Dict[str, Dict[str, Any]] = {}
+        used = 0
+        for table_name in candidates:
+            cost = estimate_tokens(format_schema_summary({table_name: tables[table_name]}))
+            if used + cost > self.token_budget and chosen:
+                continue
+            chosen[table_name] = tables[table_name]
+            used += cost
+
+        summary = format_schema_summary(chosen)
+        self._record(full_tokens, estimate_tokens(summary), pruned=True)
+        return summary
+
+    def _record(self, full_tokens: int, sent_tokens: int, pruned: bool):
+        with self._lock:
+            self.requests += 1
+            self.tokens_full += full_tokens
+            self.tokens_sent += sent_tokens
+            if pruned:
+                self.pruned_requests += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "pruned_requests": self.pruned_requests,
+                "prompt_tokens_full": self.tokens_full,
+                "prompt_tokens_sent": self.tokens_sent,
+                "prompt_tokens_saved": self.tokens_full - self.tokens_sent,
+            }
+
+# Global instance
+schema_retriever = SchemaRetriever(
+    top_k=int(os.getenv("SCHEMA_TOP_K", 8)),
+    token_budget=int(os.getenv("SCHEMA_TOKEN_BUDGET", 3000)),
+)
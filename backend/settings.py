@@ -0,0 +1,11 @@
+import os
+
+from dotenv import load_dotenv
+
+# The one place .env is read. Importing this module (first thing in app.py, and
+# in the modules that read configuration at import time) loads it exactly once;
+# variables already set in the environment win.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ENV_PATH = os.path.join(BASE_DIR, ".env")
+
+load_dotenv(ENV_PATH if os.path.exists(ENV_PATH) else None)
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from async_utils import run_blocking
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_prompt(prompt: str) -> str:
+    """Case-folds, strips punctuation and collapses whitespace."""
+    prompt = _PUNCTUATION.sub(" ", prompt.casefold())
+    return _WHITESPACE.sub(" ", prompt).strip()
+
+def make_cache_key(schema_hash: str, prompt: str) -> str:
+    return hashlib.sha256(f"{schema_hash}\x1f{normalize_prompt(prompt)}".encode("utf-8")).hexdigest()
+
+class SQLCache:
+    """
+    Two-tier cache of generated SQL keyed by schema hash + normalized prompt.
+    The memory tier is an LRU with a TTL; the optional SQLite tier (enabled by
+    `db_path`) survives restarts and refills the memory tier on a hit. Its reads
+    and writes run on the blocking pool, serialized on their own lock so memory
+    hits never wait for disk I/O.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600,
+        db_path: Optional[str] = None,
+        disk_ttl: float = 7 * 24 * 3600,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_ttl = disk_ttl
+        self._memory = OrderedDict()  # {key: (sql, expires_at)}
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._disk = None
+        if db_path:
+            self._disk = sqlite3.connect(db_path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS sql_cache (key TEXT PRIMARY KEY, sql TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._disk.commit()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.llm_calls = 0
+        self.llm_time_ms = 0.0
+
+    def _remember(self, key: str, sql: str, now: float):
+        self._memory[key] = (sql, now + self.ttl)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached:
+                sql, expires_at = cached
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return sql
+                del self._memory[key]
+
+        if self._disk is not None:
+            row = await run_blocking(
+                self._disk_execute,
+                "SELECT sql FROM sql_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.disk_ttl),
+            )
+            if row:
+                with self._lock:
+                    self._remember(key, row[0], now)
+                    self.disk_hits += 1
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def set(self, key: str, sql: str):
+        """Stores SQL that already passed SQLGuard and ExplainGuard."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, sql, now)
+            self.stores += 1
+        if self._disk is not None:
+            await run_blocking(
+                self._disk_execute,
+                "INSERT OR REPLACE INTO sql_cache (key, sql, created_at) VALUES (?, ?, ?)",
+                (key, sql, now),
+            )
+
+    async def invalidate(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+        if self._disk is not None:
+            await run_blocking(self._disk_execute, "DELETE FROM sql_cache WHERE key = ?", (key,))
+
+    def _disk_execute(self, statement: str, params: tuple) -> Optional[tuple]:
+        """Runs one statement on the SQLite tier (blocking); returns the first row of a SELECT."""
+        with self._disk_lock:
+            row = self._disk.execute(statement, params).fetchone()
+            if not statement.startswith("SELECT"):
+                self._disk.commit()
+            return row
+
+    def record_llm_latency(self, duration_ms: float):
+        """Tracks LLM latency on misses so hits can be converted into time saved."""
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_time_ms += duration_ms
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            avg_llm_ms = self.llm_time_ms / self.llm_calls if self.llm_calls else 0.0
+            return {
+                "entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "avg_llm_ms": round(avg_llm_ms, 2),
+                "llm_ms_saved": round(hits * avg_llm_ms, 2),
+            }
+
+# Global instance
+sql_cache = SQLCache(
+    max_entries=int(os.getenv("SQL_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("SQL_CACHE_TTL", 3600)),
+    db_path=os.getenv("SQL_CACHE_PATH") or None,
+    disk_ttl=float(os.getenv("SQL_CACHE_DISK_TTL", 7 * 24 * 3600)),
+)
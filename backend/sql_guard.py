@@ -1,63 +1,222 @@
-import sqlparse
 import re
+from collections import namedtuple
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+Token = namedtuple("Token", ["kind", "value"])
+
+# One precompiled pattern for the whole lexer. Order matters: hints and comments
+# before punctuation, quoted forms before words.
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<hint>/\*\+.*?\*/)
+  | (?P<exec_comment>/\*!.*?\*/)
+  | (?P<comment>/\*.*?\*/|--(?=\s|$)[^\n]*|\#[^\n]*)
+  | (?P<open_comment>/\*)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<ident>`(?:[^`]|``)*`)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\.\d+)
+  | (?P<word>[A-Za-z_$@][A-Za-z0-9_$@]*)
+  | (?P<punct>.)
+""", re.VERBOSE | re.DOTALL)
+
+def tokenize(sql: str) -> List[Token]:
+    """Splits SQL into tokens; strings, quoted identifiers and comments stay single tokens."""
+    return [Token(m.lastgroup, m.group()) for m in _TOKEN_RE.finditer(sql)]
 
 class SQLGuard:
     FORBIDDEN_KEYWORDS = {
-        'DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'TRUNCATE', 
+        'DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'TRUNCATE',
         'GRANT', 'REVOKE', 'CREATE', 'REPLACE', 'UPSCALE'
     }
 
     @staticmethod
-    def validate_query(sql: str) -> str:
+    def validate_query(sql: str, max_limit: int = 100) -> str:
         """
-        Validates and sanitizes the SQL query. 
+        Validates and sanitizes the SQL query.
         Returns the sanitized SQL if valid, or raises ValueError.
         """
+        clean_sql, error = SQLGuard._validate(sql, max_limit)
+        if error:
+            raise ValueError(error)
+        return clean_sql
+
+    @staticmethod
+    @lru_cache(maxsize=2048)
+    def _validate(sql: str, max_limit: int) -> Tuple[Optional[str], Optional[str]]:
+        # Memoized verdict: (clean_sql, None) or (None, error message)
+        try:
+            return SQLGuard._check(sql, max_limit), None
+        except ValueError as e:
+            return None, str(e)
+
+    @staticmethod
+    def _check(sql: str, max_limit: int) -> str:
         if not sql or not sql.strip():
             raise ValueError("Empty SQL query")
 
-        # 1. Parse SQL
-        parsed = sqlparse.parse(sql)
-        if len(parsed) > 1:
-            raise ValueError("Multiple SQL statements are not allowed")
-        
-        statement = parsed[0]
-        
-        # 2. Check statement type (MUST be SELECT)
-        if statement.get_type().upper() != 'SELECT':
-            raise ValueError(f"Only SELECT queries are allowed. Found: {statement.get_type()}")
-
-        # 3. Check for forbidden keywords in the raw string to be safe
-        # (Though parser check is good, a regex catch-all provides depth defense)
-        normalized_sql = sql.upper()
-        for keyword in SQLGuard.FORBIDDEN_KEYWORDS:
-            # We look for word boundaries to avoid matching substrings (e.e. UPDATE_DATE column)
-            if re.search(r'\b' + keyword + r'\b', normalized_sql):
-                raise ValueError(f"Forbidden keyword detected: {keyword}")
-
-        # 4. Enforce LIMIT
-        # We need to check if LIMIT exists and is <= 100. If not, inject/replace it.
-        # Parsing LIMIT is tricky with sqlparse, sometimes easier with regex for simple enforcement
-        
-        # Simple heuristic: remove trailing semicolon
-        clean_sql = sql.strip().rstrip(';')
-        
-        limit_match = re.search(r'\bLIMIT\s+(\d+)', clean_sql, re.IGNORECASE)
-        
-        if limit_match:
-            limit_val = int(limit_match.group(1))
-            if limit_val > 100:
-                # Replace with LIMIT 100
-                # We replace the last occurrence to be safe or just rebuild
-                clean_sql = re.sub(r'\bLIMIT\s+\d+', 'LIMIT 100', clean_sql, flags=re.IGNORECASE)
-        else:
-            # Append LIMIT 100
-            clean_sql += " LIMIT 100"
-            
-        return clean_sql
+        tokens = tokenize(sql)
+        out: List[Token] = []
+        depth = 0
+        first_word = None
+        statement_ended = False
+        top_level_limit = None  # index in `out` of the outermost LIMIT keyword
+
+        # Single pass: statement type, forbidden keywords, statement separators,
+        # parenthesis depth and the position of the outermost LIMIT
+        for token in tokens:
+            kind = token.kind
+            if kind == "exec_comment":
+                raise ValueError("Executable comments (/*! ... */) are not allowed")
+            if kind == "open_comment":
+                raise ValueError("Unterminated comment")
+            if kind in ("ws", "comment"):
+                # Comments are dropped so an appended LIMIT can't end up inside one
+                if out and out[-1].kind != "ws":
+                    out.append(token if kind == "ws" else Token("ws", " "))
+                continue
+            if statement_ended:
+                raise ValueError("Multiple SQL statements are not allowed")
+
+            if kind == "punct":
+                if token.value in ("'", '"', "`"):
+                    raise ValueError("Unterminated quoted string or identifier")
+                if token.value == ";":
+                    if depth != 0:
+                        raise ValueError("Unbalanced parentheses")
+                    statement_ended = True
+                    continue
+                if token.value == "(":
+                    depth += 1
+                elif token.value == ")":
+                    depth -= 1
+                    if depth < 0:
+                        raise ValueError("Unbalanced parentheses")
+            elif kind == "word":
+                upper = token.value.upper()
+                if first_word is None:
+                    first_word = upper
+                if upper in SQLGuard.FORBIDDEN_KEYWORDS:
+                    raise ValueError(f"Forbidden keyword detected: {upper}")
+                if upper == "LIMIT" and depth == 0:
+                    top_level_limit = len(out)
+            out.append(token)
+
+        if depth != 0:
+            raise ValueError("Unbalanced parentheses")
+
+        # Check statement type (MUST be SELECT; WITH ... SELECT is a SELECT too)
+        if first_word not in ("SELECT", "WITH"):
+            raise ValueError(f"Only SELECT queries are allowed. Found: {first_word or 'UNKNOWN'}")
+
+        while out and out[-1].kind == "ws":
+            out.pop()
+
+        if top_level_limit is None:
+            return "".join(t.value for t in out) + f" LIMIT {max_limit}"
+
+        # Enforce the row cap on the outermost LIMIT only. Forms:
+        #   LIMIT count | LIMIT offset, count | LIMIT count OFFSET offset
+        args = [i for i in range(top_level_limit + 1, len(out)) if out[i].kind != "ws"]
+        if not args or out[args[0]].kind != "number":
+            raise ValueError("LIMIT must be a numeric literal")
+        count_index = args[0]
+        if len(args) >= 3 and out[args[1]].value == ",":
+            if out[args[2]].kind != "number":
+                raise ValueError("LIMIT must be a numeric literal")
+            count_index = args[2]
+
+        if int(float(out[count_index].value)) > max_limit:
+            out[count_index] = Token("number", str(max_limit))
+        return "".join(t.value for t in out)
 
     @staticmethod
     def is_destructive(sql: str) -> bool:
         """Double check for destructive patterns"""
         normalized = sql.upper()
         return any(x in normalized for x in ['DROP ', 'DELETE ', 'UPDATE ', 'INSERT ', 'ALTER ', 'TRUNCATE '])
+
+@lru_cache(maxsize=2048)
+def with_max_execution_time(sql: str, timeout_ms: int) -> str:
+    """
+    Adds a MAX_EXECUTION_TIME optimizer hint to validated SQL, so MySQL aborts
+    the statement itself once `timeout_ms` has passed. MySQL only honours it
+    after the statement's first SELECT keyword, which for CTEs and parenthesized
+    UNIONs is inside parentheses. Being first, it wins over any hint the SQL
+    already has. Returns `sql` unchanged when it has no SELECT at all.
+    """
+    position = 0
+    for kind, value in tokenize(sql):
+        position += len(value)
+        if kind == "word" and value.upper() == "SELECT":
+            return f"{sql[:position]} /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */{sql[position:]}"
+    return sql
+
+# Aggregate functions; a query using one reads every row it matches, whatever its LIMIT
+AGGREGATE_FUNCTIONS = {
+    "COUNT", "SUM", "AVG", "MIN", "MAX", "GROUP_CONCAT", "JSON_ARRAYAGG", "JSON_OBJECTAGG",
+    "BIT_AND", "BIT_OR", "BIT_XOR", "STD", "STDDEV", "STDDEV_POP", "STDDEV_SAMP",
+    "VARIANCE", "VAR_POP", "VAR_SAMP",
+}
+
+@lru_cache(maxsize=2048)
+def uses_aggregates(sql: str) -> bool:
+    """True when the SQL calls an aggregate function anywhere (including subqueries)."""
+    tokens = [t for t in tokenize(sql) if t.kind not in ("ws", "comment", "hint")]
+    return any(
+        kind == "word" and value.upper() in AGGREGATE_FUNCTIONS and tokens[i + 1].value == "("
+        for i, (kind, value) in enumerate(tokens[:-1])
+    )
+
+# Keywords that end a FROM clause's table list
+_FROM_CLAUSE_END = {
+    "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "UNION", "ON", "USING", "WINDOW",
+    "FOR", "LOCK", "INTO", "INNER", "LEFT", "RIGHT", "CROSS", "NATURAL", "JOIN", "STRAIGHT_JOIN",
+}
+
+@lru_cache(maxsize=2048)
+def referenced_tables(sql: str) -> Tuple[str, ...]:
+    """
+    Best-effort list of the table names after FROM / JOIN (including comma joins
+    and CTE names), unquoted and without the schema prefix, in first-seen order.
+    """
+    tables: List[str] = []
+    in_from = [False]  # per parenthesis depth
+    expect_table = False
+    after_table = False
+
+    for token in tokenize(sql):
+        kind, value = token
+        if kind in ("ws", "comment", "hint"):
+            continue
+        upper = value.upper() if kind == "word" else None
+
+        if kind == "punct" and value == "." and after_table:
+            # schema.table: the next name replaces the schema
+            expect_table = True
+            tables.pop()
+            after_table = False
+            continue
+        after_table = False
+
+        if expect_table and (kind == "ident" or (kind == "word" and upper not in _FROM_CLAUSE_END)):
+            tables.append(value[1:-1].replace("``", "`") if kind == "ident" else value)
+            expect_table = False
+            after_table = True
+            continue
+        expect_table = False
+
+        if kind == "punct":
+            if value == "(":
+                in_from.append(False)
+            elif value == ")" and len(in_from) > 1:
+                in_from.pop()
+            elif value == "," and in_from[-1]:
+                expect_table = True
+        elif upper in ("FROM", "JOIN", "STRAIGHT_JOIN"):
+            in_from[-1] = True
+            expect_table = True
+        elif upper in _FROM_CLAUSE_END or upper == "SELECT":
+            in_from[-1] = False
+
+    return tuple(dict.fromkeys(tables))
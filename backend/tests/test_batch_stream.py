@@ -0,0 +1,37 @@
+import asyncio
+
+import app as app_module
+from db import DBConnection
+
+CREDS = DBConnection(host="h", port=3306, user="u", password="p", database="d")
+
+def test_streamed_batch_starts_work_with_the_body(monkeypatch):
+    started = []
+
+    async def decrypt_session(db_token):
+        return CREDS
+
+    async def load_schema_entry(creds):
+        return {"tables": {}, "summary": "", "summary_hash": "h"}
+
+    async def prepare_query(creds, prompt, user_id, schema_entry=None):
+        started.append(prompt)
+        raise app_module.HTTPException(status_code=400, detail="unanswerable")
+
+    monkeypatch.setattr(app_module, "decrypt_session", decrypt_session)
+    monkeypatch.setattr(app_module, "load_schema_entry", load_schema_entry)
+    monkeypatch.setattr(app_module, "prepare_query", prepare_query)
+
+    async def run():
+        request = app_module.BatchQueryRequest(db_token="t", prompts=["a", "b"], stream=True)
+        response = await app_module.ask_database_batch(request, http_request=None, current_user="batch-user")
+        await asyncio.sleep(0.01)
+        # A client that disconnects now never runs the body, so nothing may have started
+        before_body = list(started)
+        lines = [line async for line in response.body_iterator]
+        return before_body, lines
+
+    before_body, lines = asyncio.run(run())
+    assert before_body == []
+    assert sorted(started) == ["a", "b"]
+    assert len(lines) == 3
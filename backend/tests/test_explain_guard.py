@@ -0,0 +1,48 @@
+import pytest
+
+from explain_guard import ExplainGuard, FULL_SCAN_ROWS
+
+def single_table_plan(**table):
+    return {"query_block": {"select_id": 1, "table": dict({"table_name": "events", "access_type": "ALL"}, **table)}}
+
+def test_filtered_full_scan_is_rejected():
+    # SELECT ... FROM events WHERE unindexed_col = 'x' LIMIT 100
+    plan = single_table_plan(
+        rows_examined_per_scan=200_000_000,
+        filtered="0.00",
+        attached_condition="(`db`.`events`.`unindexed_col` = 'x')",
+    )
+    verdict = ExplainGuard.analyze_plan(plan)
+    assert not verdict.is_safe
+    assert "Full table scan on events" in verdict.error
+
+def test_unfiltered_scan_stops_at_the_limit():
+    plan = single_table_plan(rows_examined_per_scan=200_000_000, filtered="100.00")
+    verdict = ExplainGuard.analyze_plan(plan, "SELECT id FROM events LIMIT 100")
+    assert verdict.is_safe
+    assert any("Full table scan" in warning for warning in verdict.warnings)
+
+def test_condition_that_keeps_every_row_still_short_circuits():
+    plan = single_table_plan(rows_examined_per_scan=FULL_SCAN_ROWS * 2, filtered="100.00", attached_condition="(1)")
+    assert ExplainGuard.analyze_plan(plan, "SELECT id FROM events WHERE 1 LIMIT 100").is_safe
+
+def test_small_filtered_scan_passes():
+    plan = single_table_plan(rows_examined_per_scan=500, filtered="10.00", attached_condition="(`x` = 1)")
+    verdict = ExplainGuard.analyze_plan(plan)
+    assert verdict.is_safe and not verdict.warnings
+
+@pytest.mark.parametrize("sql", [
+    "SELECT SUM(amount) FROM events LIMIT 100",
+    "SELECT COUNT(*) FROM events WHERE unindexed_col > 0 LIMIT 100",
+    "SELECT id FROM events WHERE amount > (SELECT AVG (amount) FROM events) LIMIT 100",
+])
+def test_aggregate_over_a_large_table_is_rejected(sql):
+    # No GROUP BY, so the plan has no grouping node, but every row is read
+    plan = single_table_plan(rows_examined_per_scan=200_000_000, filtered="100.00")
+    verdict = ExplainGuard.analyze_plan(plan, sql)
+    assert not verdict.is_safe
+    assert "Full table scan on events" in verdict.error
+
+def test_plan_without_its_sql_is_not_exempted():
+    plan = single_table_plan(rows_examined_per_scan=200_000_000, filtered="100.00")
+    assert not ExplainGuard.analyze_plan(plan).is_safe
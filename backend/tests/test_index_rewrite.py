@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+import pipeline
+from db import DBConnection
+from explain_guard import PlanVerdict
+from index_advisor import index_advisor
+
+CREDS = DBConnection(host="h", port=3306, user="u", password="p", database="d")
+TABLES = {"orders": {
+    "rows": 2_000_000,
+    "columns": [{"name": "id"}, {"name": "customer_id"}, {"name": "status"}],
+    "indexes": [{"name": "PRIMARY", "unique": True, "columns": ["id"]},
+                {"name": "ix_customer", "unique": False, "columns": ["customer_id"]}],
+}}
+ORIGINAL = "SELECT id FROM orders WHERE status = 'x'"
+REWRITE = "SELECT id FROM orders WHERE customer_id = 5 AND status = 'x'"
+
+@pytest.fixture
+def explains(monkeypatch):
+    """{sql without LIMIT: verdict}; records which SQL was EXPLAINed on which connection."""
+    plans, seen = {}, []
+
+    async def evaluate(creds, sql, conn=None):
+        seen.append((sql.split(" LIMIT")[0], conn))
+        return plans[sql.split(" LIMIT")[0]]
+
+    async def rewrite_sql_for_indexes(schema, question, sql, problems):
+        return REWRITE
+
+    monkeypatch.setattr(pipeline.ExplainGuard, "evaluate", staticmethod(evaluate))
+    monkeypatch.setattr(pipeline, "rewrite_sql_for_indexes", rewrite_sql_for_indexes)
+    monkeypatch.setattr(index_advisor, "rewrite", True)
+    return plans, seen
+
+def prepare_and_verify(seen, prompt):
+    async def run():
+        index_rewrite = await pipeline._review_indexes({"tables": TABLES}, "S", prompt, ORIGINAL, 100)
+        prepared = await pipeline._guard(CREDS, ORIGINAL, prompt, False, "user-1", 100, index_rewrite)
+        prepare_explains = len(seen)
+        await pipeline.verify_plan(prepared, conn="slot-connection")
+        return prepared, prepare_explains
+    return asyncio.run(run())
+
+def test_rewrite_is_compared_on_the_execution_connection(explains):
+    plans, seen = explains
+    plans[ORIGINAL] = PlanVerdict(is_safe=True, rows_examined=2_000_000, access=["orders:ALL:"])
+    plans[REWRITE] = PlanVerdict(is_safe=True, rows_examined=30, access=["orders:ref:ix_customer"])
+
+    prepared, prepare_explains = prepare_and_verify(seen, "orders with status x (rewrite kept)")
+    assert prepare_explains == 0
+    assert [conn for _, conn in seen] == ["slot-connection"] * 2
+    assert prepared.sql == REWRITE + " LIMIT 100"
+    assert prepared.generated_sql == REWRITE and prepared.index_rewrite is None
+
+def test_worse_rewrite_keeps_the_original(explains):
+    plans, seen = explains
+    plans[ORIGINAL] = PlanVerdict(is_safe=True, rows_examined=100)
+    plans[REWRITE] = PlanVerdict(is_safe=True, rows_examined=5_000)
+
+    prepared, _ = prepare_and_verify(seen, "orders with status x (rewrite dropped)")
+    assert prepared.sql == ORIGINAL + " LIMIT 100"
+    assert prepared.generated_sql == ORIGINAL
@@ -0,0 +1,11 @@
+import pytest
+
+from llm import LLMProvider, StubProvider
+
+def test_provider_must_implement_complete():
+    class Incomplete(LLMProvider):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+    assert StubProvider(sql="SELECT 1").name == "stub"
@@ -0,0 +1,12 @@
+import logging
+import time
+
+import orjson
+
+from logger import CustomJSONFormatter
+
+def test_timestamp_is_the_records_creation_time():
+    record = logging.LogRecord("app", logging.INFO, __file__, 1, "queued", (), None)
+    record.created = time.time() - 30
+    line = orjson.loads(CustomJSONFormatter().format(record))
+    assert line["timestamp"].startswith(time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)))
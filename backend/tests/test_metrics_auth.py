@@ -0,0 +1,28 @@
+import asyncio
+
+import httpx
+
+import app as app_module
+from auth import create_access_token
+
+def get_metrics(authorization=None):
+    headers = {"Authorization": authorization} if authorization else {}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/metrics", headers=headers)
+    return asyncio.run(run())
+
+def test_metrics_require_a_user_token_by_default(monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", None)
+    assert get_metrics().status_code == 401
+    assert get_metrics("Bearer not-a-jwt").status_code == 401
+    response = get_metrics(f"Bearer {create_access_token({'sub': 'alice'})}")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+def test_metrics_token_replaces_user_auth(monkeypatch):
+    monkeypatch.setattr(app_module, "METRICS_TOKEN", "scrape-secret")
+    assert get_metrics("Bearer scrape-secret").status_code == 200
+    assert get_metrics(f"Bearer {create_access_token({'sub': 'alice'})}").status_code == 401
@@ -0,0 +1,45 @@
+import pagination
+
+USER, DB = "user-1", "db-fingerprint"
+ROWS = [(i, f"name-{i}") for i in range(1, 101)]
+
+def cursor_state(generated_sql, sql=None, rows=ROWS, page_size=100):
+    cursor = pagination.first_cursor(
+        sql or generated_sql, generated_sql, page_size, ["id", "name"], rows,
+        USER, DB, {"users": ["id"]},
+    )
+    return None if cursor is None else pagination.read_cursor(cursor, USER, DB)
+
+def test_default_llm_limit_still_gets_a_cursor():
+    # The system prompt makes the LLM end nearly every query in LIMIT 100
+    state = cursor_state("SELECT id, name FROM users ORDER BY id LIMIT 100")
+    assert state is not None
+    assert state["remaining"] is None
+    sql, params, count = pagination.page_query(state)
+    assert sql == "SELECT id, name FROM users WHERE id > :k0 ORDER BY id LIMIT 100"
+    assert params == {"k0": 100}
+    assert count == 100
+
+def test_same_as_without_limit():
+    with_limit = cursor_state("SELECT id, name FROM users ORDER BY id LIMIT 100")
+    without = cursor_state("SELECT id, name FROM users ORDER BY id", sql="SELECT id, name FROM users ORDER BY id LIMIT 100")
+    assert pagination.page_query(with_limit) == pagination.page_query(without)
+
+def test_smaller_limit_from_the_question_ends_the_result():
+    assert cursor_state("SELECT id, name FROM users ORDER BY id LIMIT 10", rows=ROWS[:10]) is None
+
+def test_larger_limit_is_capped_and_paged():
+    state = cursor_state("SELECT id, name FROM users ORDER BY id LIMIT 250", sql="SELECT id, name FROM users ORDER BY id LIMIT 100")
+    assert state["remaining"] == 150
+
+def test_short_result_has_no_cursor():
+    assert cursor_state("SELECT id, name FROM users ORDER BY id LIMIT 100", rows=ROWS[:40]) is None
+
+def test_order_by_an_implicit_alias_falls_back_to_offset():
+    # ORDER BY id sorts by the output alias (users.name), not the primary key
+    for sql in ("SELECT name id FROM users ORDER BY id", "SELECT name AS id FROM users ORDER BY id"):
+        assert pagination.keyset_template(sql, {"users": ["id"]}, ["id"]) is None
+
+def test_qualified_and_plain_columns_are_not_aliases():
+    template = pagination.keyset_template("SELECT users.id, `name` FROM users ORDER BY id", {"users": ["id"]}, ["id", "name"])
+    assert template == ("SELECT users.id, `name` FROM users WHERE id > :k0 ORDER BY id", [0])
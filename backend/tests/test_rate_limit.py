@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from rate_limit import RateLimiter, RateLimitBackend, SQLiteBackend
+
+def check(limiter, cost=1):
+    return asyncio.run(limiter.check_rate_limit("user-1", cost=cost))
+
+def test_cost_above_the_limit_is_a_bad_request():
+    limiter = RateLimiter(requests_per_minute=20)
+    with pytest.raises(HTTPException) as error:
+        check(limiter, cost=25)
+    assert error.value.status_code == 400
+    # Nothing was counted, so a smaller request still goes through
+    assert check(limiter, cost=20).remaining == 0
+
+def test_exhausted_budget_is_retried_later():
+    limiter = RateLimiter(requests_per_minute=20)
+    check(limiter, cost=15)
+    with pytest.raises(HTTPException) as error:
+        check(limiter, cost=10)
+    assert error.value.status_code == 429
+    assert "Retry-After" in error.value.headers
+
+def test_sqlite_backend_runs_off_the_event_loop(tmp_path, monkeypatch):
+    backend = SQLiteBackend(str(tmp_path / "limits.sqlite3"))
+    threads = []
+    acquire = backend.acquire
+    monkeypatch.setattr(backend, "acquire", lambda *args: threads.append(threading.current_thread()) or acquire(*args))
+    limiter = RateLimiter(requests_per_minute=2, backend=backend)
+    check(limiter)
+    check(limiter)
+    with pytest.raises(HTTPException):
+        check(limiter)
+    assert threads and all(thread is not threading.main_thread() for thread in threads)
+
+def test_backend_must_implement_acquire():
+    with pytest.raises(TypeError):
+        RateLimitBackend()
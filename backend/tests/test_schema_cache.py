@@ -0,0 +1,24 @@
+import itertools
+
+import schema_cache as schema_cache_module
+from db import DBConnection
+from schema_cache import SchemaCache
+
+PRIMARY = DBConnection(host="primary", port=3306, user="u", password="p", database="d")
+
+def test_checksum_and_schema_come_from_the_same_replica(monkeypatch):
+    replicas = itertools.cycle(["replica-a", "replica-b"])
+    used = []
+    monkeypatch.setattr(schema_cache_module.replica_router, "route", lambda creds: creds.model_copy(update={"host": next(replicas)}))
+    monkeypatch.setattr(schema_cache_module, "get_schema_checksum", lambda host: used.append(("checksum", host.host)) or host.host)
+    monkeypatch.setattr(schema_cache_module, "load_schema", lambda host: used.append(("schema", host.host)) or {})
+
+    cache = SchemaCache(check_interval=0)
+    cache.get_entry(PRIMARY)  # miss
+    cache._entries[next(iter(cache._entries))]["checksum"] = "outdated"
+    cache.get_entry(PRIMARY)  # stale check, checksum changed, reload
+    cache.refresh(PRIMARY)
+
+    assert [kind for kind, _ in used] == ["checksum", "schema"] * 3
+    pairs = [used[i:i + 2] for i in range(0, len(used), 2)]
+    assert all(checksum[1] == schema[1] for checksum, schema in pairs)
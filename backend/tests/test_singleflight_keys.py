@@ -0,0 +1,67 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pipeline
+from db import DBConnection
+
+CREDS = DBConnection(host="h", port=3306, user="u", password="p", database="d")
+
+def test_generations_are_shared_only_under_the_same_row_cap(monkeypatch):
+    calls = []
+
+    async def generate(creds, schema_entry, prompt, max_limit):
+        calls.append(max_limit)
+        await asyncio.sleep(0.05)
+        return "SELECT id FROM users", None
+
+    async def schema_entry(creds):
+        return {"tables": {}, "summary": "Table: users", "summary_hash": "flight"}
+
+    monkeypatch.setattr(pipeline, "_generate", generate)
+    monkeypatch.setattr(pipeline, "load_schema_entry", schema_entry)
+
+    async def run():
+        return await asyncio.gather(
+            pipeline.prepare_query(CREDS, "all user ids", "user-1", max_limit=100),
+            pipeline.prepare_query(CREDS, "all user ids", "user-2", max_limit=100),
+            pipeline.prepare_query(CREDS, "all user ids", "user-3", max_limit=10000),
+        )
+
+    prepared = asyncio.run(run())
+    assert sorted(calls) == [100, 10000]
+    assert [p.sql for p in prepared] == ["SELECT id FROM users LIMIT 100"] * 2 + ["SELECT id FROM users LIMIT 10000"]
+
+def test_executions_are_shared_only_under_the_same_timeout_and_caching(monkeypatch):
+    runs = []
+
+    @asynccontextmanager
+    async def connect(creds):
+        yield None
+
+    async def verify_plan(prepared, conn):
+        return prepared
+
+    async def execute_query(conn, sql, timeout):
+        runs.append(timeout)
+        await asyncio.sleep(0.05)
+        return ["id"], [(1,)]
+
+    monkeypatch.setattr(pipeline, "connect", connect)
+    monkeypatch.setattr(pipeline, "verify_plan", verify_plan)
+    monkeypatch.setattr(pipeline, "execute_query", execute_query)
+
+    def prepared(timeout):
+        return pipeline.PreparedQuery(
+            creds=CREDS, sql="SELECT id FROM users LIMIT 100", generated_sql="", cache_key="k",
+            sql_cached=True, execution_timeout=timeout,
+        )
+
+    async def run():
+        await asyncio.gather(
+            pipeline.run_query(prepared(5), use_cache=False),
+            pipeline.run_query(prepared(5), use_cache=False),
+            pipeline.run_query(prepared(60), use_cache=False),
+        )
+
+    asyncio.run(run())
+    assert sorted(runs) == [5, 60]
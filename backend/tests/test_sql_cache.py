@@ -0,0 +1,28 @@
+import asyncio
+import threading
+
+from sql_cache import SQLCache
+
+def test_disk_tier_runs_off_the_event_loop(tmp_path, monkeypatch):
+    path = str(tmp_path / "sql_cache.sqlite3")
+    threads = []
+    disk_execute = SQLCache._disk_execute
+
+    def spy(self, statement, params):
+        threads.append(threading.current_thread())
+        return disk_execute(self, statement, params)
+
+    monkeypatch.setattr(SQLCache, "_disk_execute", spy)
+
+    async def run():
+        await SQLCache(db_path=path).set("key", "SELECT 1")
+        # A fresh instance has an empty memory tier, so this reads the disk
+        restarted = SQLCache(db_path=path)
+        found = await restarted.get("key")
+        await restarted.invalidate("key")
+        return found, await restarted.get("missing"), restarted.stats()
+
+    found, missing, stats = asyncio.run(run())
+    assert (found, missing) == ("SELECT 1", None)
+    assert (stats["disk_hits"], stats["misses"]) == (1, 1)
+    assert len(threads) == 4 and threading.main_thread() not in threads
@@ -0,0 +1,24 @@
+import pytest
+
+from sql_guard import with_max_execution_time
+
+@pytest.mark.parametrize("sql, expected", [
+    (
+        "SELECT id FROM users LIMIT 5",
+        "SELECT /*+ MAX_EXECUTION_TIME(1500) */ id FROM users LIMIT 5",
+    ),
+    (
+        "WITH recent AS (SELECT id FROM users) SELECT id FROM recent LIMIT 5",
+        "WITH recent AS (SELECT /*+ MAX_EXECUTION_TIME(1500) */ id FROM users) SELECT id FROM recent LIMIT 5",
+    ),
+    (
+        "(SELECT id FROM users) UNION (SELECT id FROM admins) LIMIT 5",
+        "(SELECT /*+ MAX_EXECUTION_TIME(1500) */ id FROM users) UNION (SELECT id FROM admins) LIMIT 5",
+    ),
+    (
+        "SELECT /*+ BKA(t) */ `select` FROM t LIMIT 5",
+        "SELECT /*+ MAX_EXECUTION_TIME(1500) */ /*+ BKA(t) */ `select` FROM t LIMIT 5",
+    ),
+])
+def test_hint_follows_the_first_select(sql, expected):
+    assert with_max_execution_time(sql, 1500) == expected
@@ -0,0 +1,30 @@
+import asyncio
+
+import httpx
+
+import app as app_module
+from async_utils import StageTimeoutError
+from auth import create_access_token
+
+def post_sse(db_token="not-a-session"):
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': 'sse-user'})}"}
+
+    async def run():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/query/ask/sse", json={"db_token": db_token, "prompt": "list users"}, headers=headers)
+    return asyncio.run(run())
+
+def test_invalid_session_is_unauthorized():
+    response = post_sse()
+    assert response.status_code == 401
+    assert response.headers["content-type"].startswith("application/json")
+
+def test_decrypt_timeout_is_a_gateway_timeout(monkeypatch):
+    async def decrypt_session(db_token):
+        raise StageTimeoutError("decrypt", 0.5)
+
+    monkeypatch.setattr(app_module, "decrypt_session", decrypt_session)
+    response = post_sse()
+    assert response.status_code == 504
+    assert "decrypt" in response.json()["detail"]
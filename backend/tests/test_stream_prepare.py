@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import pipeline
+from async_utils import STAGE_TIMEOUTS, StageTimeoutError
+from db import DBConnection
+from llm import rejected_early
+
+CREDS = DBConnection(host="h", port=3306, user="u", password="p", database="d")
+TABLES = {"users": {"comment": "", "rows": 10, "columns": [{"name": "id", "type": "INT", "key": "PRI", "comment": ""}],
+                    "indexes": [], "foreign_keys": []}}
+
+@pytest.fixture
+def llm_output(monkeypatch):
+    """Makes the streamed LLM answer the given chunks, with an optional delay before each."""
+    seen = {}
+
+    def install(chunks, delay=0.0):
+        async def stream_sql(schema, question):
+            for chunk in chunks:
+                await asyncio.sleep(delay)
+                seen["streamed"] = seen.get("streamed", "") + chunk
+                yield chunk
+
+        monkeypatch.setattr(pipeline, "stream_sql", stream_sql)
+        return seen
+
+    async def schema_entry(creds):
+        return {"tables": TABLES, "summary": "Table: users", "summary_hash": "h"}
+
+    monkeypatch.setattr(pipeline, "load_schema_entry", schema_entry)
+    return install
+
+def prepare(prompt="list users"):
+    async def run():
+        events = [event async for event in pipeline.stream_prepare_query(CREDS, prompt, "user-1")]
+        return events[-1][1]
+    return asyncio.run(run())
+
+@pytest.mark.parametrize("output", [
+    ["SELECT id FROM users;", " SELECT 2"],
+    ["SELECT id FROM users; ", "DROP TABLE users"],
+    ["```sql\nSELECT id FROM users;\n```\n", "DELETE FROM users"],
+])
+def test_stacked_statements_are_rejected(llm_output, output):
+    llm_output(output)
+    with pytest.raises(HTTPException) as error:
+        prepare()
+    assert error.value.status_code == 400
+    assert asyncio.run(pipeline.sql_cache.get(pipeline.make_cache_key("h", "list users"))) is None
+
+def test_single_statement_passes(llm_output):
+    llm_output(["```sql\nSELECT id ", "FROM users;\n", "```"])
+    assert prepare("single statement").sql == "SELECT id FROM users LIMIT 100"
+
+def test_stream_is_bounded_by_the_llm_deadline(llm_output, monkeypatch):
+    monkeypatch.setitem(STAGE_TIMEOUTS, "llm", 0.05)
+    llm_output(["SELECT id ", "FROM users"], delay=0.2)
+    with pytest.raises(StageTimeoutError):
+        prepare("slow question")
+
+def test_rejected_early():
+    assert rejected_early("INVALID_QUERY")
+    assert rejected_early("SELECT 1; DROP")
+    assert not rejected_early("SELECT 1;")
+    assert not rejected_early("SELECT 1; -- done")
+    assert not rejected_early("SELECT 'a; b")
+    assert not rejected_early("SELECT 1 /* a; b")
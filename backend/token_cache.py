@@ -0,0 +1,84 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+def token_digest(token: str) -> str:
+    # Raw tokens are never kept in memory as cache keys
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+class ExpiringCache:
+    """
+    Bounded LRU whose entries each carry their own expiry (e.g. a JWT's `exp`).
+    Also tracks the CPU time spent on misses, so hits can be reported as CPU saved.
+    """
+
+    def __init__(self, max_entries: int = 10_000, default_ttl: float = 900):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()  # {digest: (value, expires_at)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.miss_cpu_ms = 0.0
+
+    def get(self, token: str) -> Optional[Any]:
+        key = token_digest(token)
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                value, expires_at = cached
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def set(self, token: str, value: Any, expires_at: Optional[float] = None):
+        now = time.time()
+        if expires_at is None:
+            expires_at = now + self.default_ttl
+        if expires_at <= now:
+            return
+        with self._lock:
+            key = token_digest(token)
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_miss_cost(self, cpu_seconds: float):
+        with self._lock:
+            self.miss_cpu_ms += cpu_seconds * 1000
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            avg_miss_ms = self.miss_cpu_ms / self.misses if self.misses else 0.0
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "avg_verify_cpu_ms": round(avg_miss_ms, 3),
+                "cpu_ms_saved": round(self.hits * avg_miss_ms, 2),
+                "cpu_ms_saved_per_request": round(self.hits * avg_miss_ms / total, 3) if total else 0.0,
+            }
+
+# Global instances: verified JWT principals (expire at the token's `exp`) and
+# decrypted db_token sessions (Fernet tokens carry no expiry, so a fixed TTL)
+auth_cache = ExpiringCache(
+    max_entries=int(os.getenv("AUTH_CACHE_SIZE", 10_000)),
+    default_ttl=float(os.getenv("AUTH_CACHE_TTL", 900)),
+)
+session_cache = ExpiringCache(
+    max_entries=int(os.getenv("DB_SESSION_CACHE_SIZE", 10_000)),
+    default_ttl=float(os.getenv("DB_SESSION_CACHE_TTL", 900)),
+)